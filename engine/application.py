@@ -2,6 +2,8 @@ import glfw
 import logging
 from OpenGL.GL import *
 from engine.scene import Scene
+from engine.config import CONFIG
+from engine.core.profiler import PROFILER
 
 """
 Application
@@ -155,6 +157,7 @@ class Application:
             lastTime = currentTime
             
             # Update the scene, then draw the scene
+            PROFILER.begin_frame()
             self.scene.update(self.window, deltaTime)
             self.scene.draw()
 
@@ -163,6 +166,15 @@ class Application:
             
             # Swap render buffers
             glfw.swap_buffers(self.window)
+            PROFILER.end_frame()
+            
+            # Periodically log a rolling summary of the profile
+            if PROFILER.enabled and PROFILER.frame_index % CONFIG["profiler_summary_interval"] == 0:
+                PROFILER.log_summary()
+                
+        # Export the recorded profile for chrome://tracing, if configured
+        if PROFILER.enabled and CONFIG["profiler_trace_path"]:
+            PROFILER.export_chrome_trace(CONFIG["profiler_trace_path"])
 
         # On end of loop, terminate GLFW.
         glfw.terminate()
\ No newline at end of file
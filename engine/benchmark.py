@@ -0,0 +1,310 @@
+import glm
+import json
+import random
+import logging
+import numpy as np
+from time import perf_counter
+from OpenGL.GL import *
+from engine.scene import Scene, CampfiresScene
+from engine.config import CONFIG
+from engine.core.cache import TEXTURE_CACHE
+from engine.core.culling import CULLING_STATS
+from engine.core.lod import LOD_SELECTOR
+from engine.core.bvh import INSTANCE_INDEX
+from engine.core.profiler import PROFILER
+from engine.texture.framebuffer import FrameBuffer
+
+# Scenes that can be benchmarked, by name
+SCENES = {
+    "scene": Scene,
+    "campfires": CampfiresScene
+}
+
+def load_camera_path(path: str) -> dict:
+    """
+    Loads a camera path from a JSON file of the following shape:
+
+            {
+                "timestep": 0.016666,
+                "keyframes": [
+                    {"time": 0, "position": [x, y, z], "rotation": [yaw, pitch]},
+                    ...
+                ]
+            }
+
+    Keyframes must be in time order. Rotations are in degrees, as for
+    Camera.rotation.
+
+    Parameters
+    ----------
+    path : str
+        The path to the camera path file.
+
+    Raises
+    ------
+    ValueError
+        If the path has no keyframes.
+
+    Returns
+    -------
+    dict
+        The timestep, and keyframe times, positions, and rotations as arrays.
+
+    """
+
+    with open(path, "r") as file:
+        data = json.load(file)
+
+    keyframes = data.get("keyframes", [])
+    if not keyframes:
+        raise ValueError(f"Camera path {path} has no keyframes.")
+
+    return {
+        "timestep": data.get("timestep", 1 / 60),
+        "times": np.array([key["time"] for key in keyframes], dtype=np.float64),
+        "positions": np.array([key["position"] for key in keyframes], dtype=np.float64),
+        "rotations": np.array([key["rotation"] for key in keyframes], dtype=np.float64)
+    }
+
+def sample_camera_path(camera_path: dict, time: float) -> (glm.vec3, glm.vec2):
+    """
+    Linearly interpolates a camera path at the given time, holding the first
+    and last keyframes outside of the path's range.
+
+    Parameters
+    ----------
+    camera_path : dict
+        The camera path, as from load_camera_path().
+    time : float
+        The time in seconds.
+
+    Returns
+    -------
+    (glm.vec3, glm.vec2)
+        The camera position and rotation.
+
+    """
+
+    times = camera_path["times"]
+    position = [np.interp(time, times, camera_path["positions"][:, i]) for i in range(3)]
+    rotation = [np.interp(time, times, camera_path["rotations"][:, i]) for i in range(2)]
+    return glm.vec3(*position), glm.vec2(*rotation)
+
+def to_json(value):
+    """
+    Converts values json cannot serialise, ie, NumPy scalars and arrays from
+    stats, to Python types.
+
+    Parameters
+    ----------
+    value : object
+        The value.
+
+    Raises
+    ------
+    TypeError
+        If the value has no JSON equivalent.
+
+    Returns
+    -------
+    object
+        The Python equivalent.
+
+    """
+
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def percentiles(values: list[float]) -> dict:
+    """
+    Summarises a list of timings.
+
+    Parameters
+    ----------
+    values : list[float]
+        The timings.
+
+    Returns
+    -------
+    dict
+        Mean, min, max, and 50th, 90th, 95th and 99th percentiles.
+
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {}
+
+    summary = {"mean": float(values.mean()), "min": float(values.min()), "max": float(values.max())}
+    for percentile in (50, 90, 95, 99):
+        summary[f"p{percentile}"] = float(np.percentile(values, percentile))
+    return summary
+
+"""
+Benchmark
+
+Renders a scene offscreen for a fixed number of frames, replaying a recorded
+camera path with a fixed timestep so that runs are reproducible, and records
+load and frame times.
+
+Each frame is finished with glFinish() before it is timed, so frame times
+include the GPU's work rather than only the time taken to submit it.
+"""
+class Benchmark:
+    def __init__(self, scene: str = "scene", frames: int = 600, path: str = None, warmup: int = 10, seed: int = 0):
+        """
+        Initialises the benchmark.
+
+        Parameters
+        ----------
+        scene : str, optional
+            The name of the scene to render, a key of SCENES. The default is
+            "scene".
+        frames : int, optional
+            The number of frames to time. The default is 600.
+        path : str, optional
+            The camera path file to replay. The default is None (the camera
+            stays at its initial position).
+        warmup : int, optional
+            The number of frames to render before timing, to let caches and
+            drivers settle. The default is 10.
+        seed : int, optional
+            The seed for the scene's random numbers. The default is 0.
+
+        Raises
+        ------
+        ValueError
+            If the scene is unknown.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if scene not in SCENES:
+            raise ValueError(f"Unknown scene {scene}, expected one of {', '.join(SCENES)}.")
+
+        self.scene_name = scene
+        self.frames = frames
+        self.warmup = warmup
+        self.seed = seed
+        self.path = path
+        self.camera_path = load_camera_path(path) if path else None
+        self.timestep = self.camera_path["timestep"] if self.camera_path else 1 / 60
+
+    def run(self, window) -> dict:
+        """
+        Loads the scene and renders every frame.
+
+        Parameters
+        ----------
+        window : GLFWWindow
+            The (hidden) window whose context to render with. It is only used
+            for input polling by Scene.update(), which sees no input.
+
+        Returns
+        -------
+        dict
+            The results, as written by write().
+
+        """
+
+        # Scene setup and object placement use random, so seed it first
+        random.seed(self.seed)
+
+        # Time scene loading, including texture decodes and shader compiles
+        start = perf_counter()
+        scene = SCENES[self.scene_name]()
+        glFinish()
+        load_time = perf_counter() - start
+        logging.info(f"Loaded {self.scene_name} in {load_time:.3f} s")
+
+        # Render to an offscreen framebuffer the size of the window
+        target = FrameBuffer()
+        target.attach_renderbuffers(CONFIG["window_width"], CONFIG["window_height"])
+        scene.target = target
+
+        # Draw call and state counters come from the profiler, whose history
+        # must hold every timed frame
+        PROFILER.enabled = True
+        PROFILER.frames = type(PROFILER.frames)(maxlen=self.frames)
+        frame_times = []
+        for frame in range(self.warmup + self.frames):
+            timed = frame >= self.warmup
+            time = (frame - self.warmup) * self.timestep
+
+            start = perf_counter()
+            PROFILER.begin_frame()
+
+            # Advance the scene by the fixed timestep, then place the camera
+            # on the path, overriding any movement
+            scene.update(window, self.timestep)
+            if self.camera_path:
+                scene.camera.position, scene.camera.rotation = sample_camera_path(self.camera_path, time)
+                scene.camera.update_vectors()
+
+            scene.draw()
+            glFinish()
+            PROFILER.end_frame()
+
+            if timed:
+                frame_times.append((perf_counter() - start) * 1000)
+            elif frame == self.warmup - 1:
+                PROFILER.frames.clear()
+
+        # Every frame was finished, so all GPU timings are available
+        PROFILER.collect_queries()
+        summary = PROFILER.summary()
+        return {
+            "scene": self.scene_name,
+            "path": self.path,
+            "frames": self.frames,
+            "warmup": self.warmup,
+            "timestep": self.timestep,
+            "seed": self.seed,
+            "renderer": glGetString(GL_RENDERER).decode(),
+            "version": glGetString(GL_VERSION).decode(),
+            "resolution": [CONFIG["window_width"], CONFIG["window_height"]],
+            "load_time_s": load_time,
+            "frame_time_ms": percentiles(frame_times),
+            "counters": summary["counters"],
+            "sections": summary["sections"],
+            "culling": CULLING_STATS.last_frame,
+            "lod": LOD_SELECTOR.last_frame,
+            "lights": scene.light_clusters.last_frame,
+            "bvh": INSTANCE_INDEX.last_frame,
+            "static_batching": scene.static_batching,
+            "multi_draw": scene.multi_draw.last_frame if scene.multi_draw else None,
+            "textures": TEXTURE_CACHE.stats()
+        }
+
+    @staticmethod
+    def write(results: dict, path: str):
+        """
+        Writes benchmark results as JSON.
+
+        Parameters
+        ----------
+        results : dict
+            The results, as from run().
+        path : str
+            The path to write to.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        with open(path, "w") as file:
+            json.dump(results, file, indent=4, default=to_json)
+
+        frame_time = results["frame_time_ms"]
+        logging.info(
+            f"Benchmark of {results['frames']} frames: mean {frame_time.get('mean', 0):.2f} ms, "
+            f"p99 {frame_time.get('p99', 0):.2f} ms. Wrote results to {path}"
+        )
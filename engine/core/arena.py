@@ -0,0 +1,356 @@
+import ctypes
+import logging
+import numpy as np
+from OpenGL.GL import *
+from engine.config import CONFIG
+from engine.core.state import GL_STATE
+from engine.core.vertexformat import PACKED_VERTEX_DTYPE, PACKED_VERTEX_ATTRIBUTES, pack_vertices
+
+"""
+RangeAllocator
+
+Sub-allocates ranges of a fixed capacity, ie, of vertices or indices in a
+shared buffer, first fit. Freed ranges are merged with free neighbours, so
+the free list stays short.
+"""
+class RangeAllocator:
+    def __init__(self, capacity: int):
+        """
+        Initialises the allocator with everything free.
+
+        Parameters
+        ----------
+        capacity : int
+            The number of units to allocate from.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.capacity = capacity
+        self.used = 0
+
+        # Free ranges as [offset, size], by offset
+        self.free_ranges = [[0, capacity]] if capacity else []
+
+    def allocate(self, size: int) -> int:
+        """
+        Allocates a range, from the first free range large enough.
+
+        Parameters
+        ----------
+        size : int
+            The number of units.
+
+        Returns
+        -------
+        int
+            The offset of the range, or None if no free range is large
+            enough.
+
+        """
+
+        for index, (offset, free) in enumerate(self.free_ranges):
+            if free >= size:
+                if free == size:
+                    del self.free_ranges[index]
+                else:
+                    self.free_ranges[index] = [offset + size, free - size]
+                self.used += size
+                return offset
+        return None
+
+    def free(self, offset: int, size: int):
+        """
+        Frees a range, merging it with free neighbours.
+
+        Parameters
+        ----------
+        offset : int
+            The offset of the range, as returned by allocate().
+        size : int
+            The number of units, as allocated.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if not size:
+            return
+
+        # The first free range after this one
+        index = next((i for i, (start, _) in enumerate(self.free_ranges) if start > offset), len(self.free_ranges))
+        self.free_ranges.insert(index, [offset, size])
+        self.used -= size
+
+        # Merge with the following range, then the preceding one
+        if index + 1 < len(self.free_ranges) and offset + size == self.free_ranges[index + 1][0]:
+            self.free_ranges[index][1] += self.free_ranges.pop(index + 1)[1]
+        if index > 0 and sum(self.free_ranges[index - 1]) == offset:
+            self.free_ranges[index - 1][1] += self.free_ranges.pop(index)[1]
+
+    def grow(self, capacity: int):
+        """
+        Extends the capacity, adding the new units to the free list.
+
+        Parameters
+        ----------
+        capacity : int
+            The new capacity, at least the current one.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        added = capacity - self.capacity
+        self.capacity = capacity
+        self.used += added
+        self.free(capacity - added, added)
+
+"""
+GeometryArena
+
+Shared vertex and index buffers holding the geometry of many meshes, with one
+VAO, so meshes can be drawn one after another, or all at once with multi-draw
+indirect, without rebinding anything.
+
+Every mesh is stored in the packed vertex layout, at a base vertex, with its
+indices relative to that base, as 32 bit integers, at a first index. Buffers
+double in size when full, copying their contents on the GPU.
+"""
+class GeometryArena:
+    def __init__(self, vertex_capacity: int = None, index_capacity: int = None):
+        """
+        Creates the buffers and VAO.
+
+        Parameters
+        ----------
+        vertex_capacity : int, optional
+            The number of vertices to allocate room for at first. The default
+            is None (the "arena_vertex_capacity" config value).
+        index_capacity : int, optional
+            The number of indices to allocate room for at first. The default
+            is None (the "arena_index_capacity" config value).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.vertices = RangeAllocator(vertex_capacity or CONFIG["arena_vertex_capacity"])
+        self.indices = RangeAllocator(index_capacity or CONFIG["arena_index_capacity"])
+
+        self.VAO = glGenVertexArrays(1)
+        self.VBO = self.create_buffer(GL_ARRAY_BUFFER, self.vertices.capacity * PACKED_VERTEX_DTYPE.itemsize)
+        self.EBO = self.create_buffer(GL_ELEMENT_ARRAY_BUFFER, self.indices.capacity * 4)
+        self.bind_attributes()
+
+    def create_buffer(self, target: int, size: int) -> int:
+        """
+        Creates an empty buffer.
+
+        Parameters
+        ----------
+        target : int
+            The target to create it through, ie, GL_ARRAY_BUFFER.
+        size : int
+            The size in bytes.
+
+        Returns
+        -------
+        int
+            The buffer.
+
+        """
+
+        buffer = glGenBuffers(1)
+        glBindBuffer(target, buffer)
+        glBufferData(target, size, None, GL_STATIC_DRAW)
+        return buffer
+
+    def bind_attributes(self):
+        """
+        Points the VAO's vertex attributes at the vertex buffer, and its
+        element buffer at the index buffer.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        GL_STATE.bind_vertex_array(self.VAO)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        for location, size, type, normalised, offset in PACKED_VERTEX_ATTRIBUTES:
+            glVertexAttribPointer(location, size, type, normalised, PACKED_VERTEX_DTYPE.itemsize, ctypes.c_void_p(offset))
+            glEnableVertexAttribArray(location)
+        GL_STATE.bind_vertex_array(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def grow_buffer(self, buffer: int, size: int, new_size: int) -> int:
+        """
+        Replaces a buffer with a larger one, copying its contents.
+
+        Parameters
+        ----------
+        buffer : int
+            The buffer.
+        size : int
+            Its size in bytes.
+        new_size : int
+            The new size in bytes.
+
+        Returns
+        -------
+        int
+            The new buffer.
+
+        """
+
+        grown = self.create_buffer(GL_COPY_WRITE_BUFFER, new_size)
+        glBindBuffer(GL_COPY_READ_BUFFER, buffer)
+        glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, 0, 0, size)
+        glDeleteBuffers(1, [buffer])
+        return grown
+
+    def reserve(self, allocator: RangeAllocator, size: int) -> int:
+        """
+        Allocates a range, growing the buffer it is of if needed.
+
+        Parameters
+        ----------
+        allocator : RangeAllocator
+            self.vertices or self.indices.
+        size : int
+            The number of units.
+
+        Returns
+        -------
+        int
+            The offset of the range.
+
+        """
+
+        offset = allocator.allocate(size)
+        if offset is not None:
+            return offset
+
+        capacity = allocator.capacity
+        grown = max(capacity * 2, capacity + size)
+        logging.info(f"Growing geometry arena {'vertex' if allocator is self.vertices else 'index'} buffer to {grown}")
+        if allocator is self.vertices:
+            self.VBO = self.grow_buffer(self.VBO, capacity * PACKED_VERTEX_DTYPE.itemsize, grown * PACKED_VERTEX_DTYPE.itemsize)
+        else:
+            self.EBO = self.grow_buffer(self.EBO, capacity * 4, grown * 4)
+        allocator.grow(grown)
+        self.bind_attributes()
+        return allocator.allocate(size)
+
+    def allocate(self, mesh) -> (int, int):
+        """
+        Copies a mesh's vertices and indices, every level of detail, into the
+        arena.
+
+        Parameters
+        ----------
+        mesh : Mesh
+            The mesh.
+
+        Returns
+        -------
+        (int, int)
+            The mesh's base vertex and first index.
+
+        """
+
+        vertices = pack_vertices(mesh.vertices, mesh.normals, mesh.texCoords, mesh.tangents, mesh.bitangents)
+        indices = mesh.indices.astype(np.uint32)
+
+        base_vertex = self.reserve(self.vertices, len(vertices))
+        first_index = self.reserve(self.indices, len(indices))
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        glBufferSubData(GL_ARRAY_BUFFER, base_vertex * PACKED_VERTEX_DTYPE.itemsize, vertices.nbytes, vertices)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        # The element buffer is bound through the VAO
+        GL_STATE.bind_vertex_array(self.VAO)
+        glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, first_index * 4, indices.nbytes, indices)
+        return base_vertex, first_index
+
+    def free(self, base_vertex: int, vertex_count: int, first_index: int, index_count: int):
+        """
+        Frees a mesh's ranges, for reuse by later allocations.
+
+        Parameters
+        ----------
+        base_vertex : int
+            The mesh's base vertex.
+        vertex_count : int
+            Its number of vertices.
+        first_index : int
+            Its first index.
+        index_count : int
+            Its number of indices, of every level of detail.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.vertices.free(base_vertex, vertex_count)
+        self.indices.free(first_index, index_count)
+
+    def bind(self):
+        """
+        Binds the arena's VAO.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        GL_STATE.bind_vertex_array(self.VAO)
+
+    def stats(self) -> dict:
+        """
+        Returns the arena's memory use.
+
+        Returns
+        -------
+        dict
+            Bytes used and allocated, of the vertex and index buffers.
+
+        """
+
+        return {
+            "vertex_bytes": {"used": self.vertices.used * PACKED_VERTEX_DTYPE.itemsize, "capacity": self.vertices.capacity * PACKED_VERTEX_DTYPE.itemsize},
+            "index_bytes": {"used": self.indices.used * 4, "capacity": self.indices.capacity * 4}
+        }
+
+    def __del__(self):
+        """
+        On all references descoping, delete the VAO and buffers.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        try:
+            GL_STATE.forget_vertex_array(self.VAO)
+            glDeleteVertexArrays(1, [self.VAO])
+            glDeleteBuffers(2, [self.VBO, self.EBO])
+        except:
+            pass
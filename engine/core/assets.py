@@ -0,0 +1,215 @@
+import os
+import re
+import json
+import struct
+import logging
+import numpy as np
+from engine.config import CONFIG
+
+# Compiled assets are produced offline by engine.tools.compile_assets, which
+# writes them to the build directory alongside a manifest. At startup we load
+# the manifest, and loaders ask for the compiled artifact of a source file
+# before falling back to preparing the source at runtime.
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Texture blobs hold a pre-flipped RGBA mip chain, ready for upload.
+#
+#     magic    4 bytes   b"PGLT"
+#     version  uint32    TEXTURE_BLOB_VERSION
+#     width    uint32    Width of the base level
+#     height   uint32    Height of the base level
+#     levels   uint32    Number of mip levels
+#     alpha    uint32    1 if any texel is not fully opaque
+#     data     ...       RGBA8 levels, largest first, tightly packed
+TEXTURE_BLOB_MAGIC = b"PGLT"
+TEXTURE_BLOB_VERSION = 1
+TEXTURE_HEADER = struct.Struct("<4sIIIII")
+
+# Matches shader include directives of the form #include "file"
+INCLUDE_PATTERN = re.compile(r'^\s*#include\s+"([^"]+)"\s*$', re.MULTILINE)
+
+def load_manifest(build_dir: str) -> dict:
+    """
+    Loads the asset manifest from a build directory.
+
+    Parameters
+    ----------
+    build_dir : str
+        The build directory written by the asset compiler.
+
+    Returns
+    -------
+    dict
+        The manifest, or an empty manifest if none exists.
+
+    """
+
+    path = os.path.join(build_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path) as file:
+            manifest = json.load(file)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+        logging.warning(f"Ignoring asset manifest {path} with old version")
+
+    return {"version": MANIFEST_VERSION, "assets": {}}
+
+def get_asset_key(path: str) -> str:
+    """
+    Returns the manifest key for a source path, which is the path relative to
+    the asset source directory with forward slashes.
+
+    Parameters
+    ----------
+    path : str
+        The source path, as used by the engine (ie, resources/models/cube.json).
+
+    Returns
+    -------
+    str
+        The manifest key (ie, models/cube.json).
+
+    """
+
+    return os.path.relpath(path, CONFIG["asset_source_dir"]).replace(os.sep, "/")
+
+def get_compiled_asset(path: str) -> str:
+    """
+    Returns the path to the compiled artifact for a source file, if one exists
+    and was compiled from the current version of the source.
+
+    Parameters
+    ----------
+    path : str
+        The source path, as used by the engine.
+
+    Returns
+    -------
+    str
+        The path to the artifact, or None if there is no up to date artifact.
+
+    """
+
+    entry = ASSET_MANIFEST["assets"].get(get_asset_key(path))
+    if not entry:
+        return None
+
+    # Sources edited since the last compile fall back to runtime loading. We
+    # only stat here, as hashing every source would defeat the purpose.
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = None
+    if stat and (stat.st_mtime_ns != entry["mtime_ns"] or stat.st_size != entry["size"]):
+        return None
+
+    artifact = os.path.join(CONFIG["asset_build_dir"], entry["artifact"])
+    return artifact if os.path.exists(artifact) else None
+
+def write_texture_blob(path: str, levels: list[np.ndarray], has_alpha: bool):
+    """
+    Writes a texture blob from a mip chain.
+
+    Parameters
+    ----------
+    path : str
+        The path to write the blob to.
+    levels : list[np.ndarray]
+        The mip levels, largest first, each of shape (height, width, 4) and
+        dtype uint8.
+    has_alpha : bool
+        Whether any texel is not fully opaque.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    height, width = levels[0].shape[:2]
+    with open(path, "wb") as file:
+        file.write(TEXTURE_HEADER.pack(
+            TEXTURE_BLOB_MAGIC, TEXTURE_BLOB_VERSION, width, height, len(levels), int(has_alpha)
+        ))
+        for level in levels:
+            file.write(np.ascontiguousarray(level, dtype=np.uint8).tobytes())
+
+def read_texture_blob(path: str) -> (list[np.ndarray], bool):
+    """
+    Reads a texture blob. Levels are views into a read-only memory map.
+
+    Parameters
+    ----------
+    path : str
+        The path to the blob.
+
+    Raises
+    ------
+    RuntimeError
+        If the file is not a texture blob of the current version.
+
+    Returns
+    -------
+    (list[np.ndarray], bool)
+        The mip levels, largest first, and whether the texture has alpha.
+
+    """
+
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    magic, version, width, height, count, has_alpha = TEXTURE_HEADER.unpack_from(buffer)
+    if magic != TEXTURE_BLOB_MAGIC or version != TEXTURE_BLOB_VERSION:
+        raise RuntimeError(f"{path} is not a valid texture blob.")
+
+    # Each level halves in size, down to 1x1
+    levels = []
+    offset = TEXTURE_HEADER.size
+    for _ in range(count):
+        size = width * height * 4
+        levels.append(buffer[offset:offset + size].reshape(height, width, 4))
+        offset += size
+        width, height = max(width // 2, 1), max(height // 2, 1)
+
+    return levels, bool(has_alpha)
+
+def preprocess_shader(path: str, included: set = None) -> str:
+    """
+    Preprocesses GLSL source by resolving #include directives relative to the
+    including file, and stripping comments and blank lines.
+
+    Parameters
+    ----------
+    path : str
+        The path to the shader source.
+    included : set, optional
+        Paths already included, to break include cycles. The default is None.
+
+    Returns
+    -------
+    str
+        The preprocessed source.
+
+    """
+
+    included = included if included is not None else set()
+    included.add(os.path.abspath(path))
+
+    with open(path) as file:
+        source = file.read()
+
+    # Inline includes, skipping any already included
+    def include(match):
+        include_path = os.path.join(os.path.dirname(path), match.group(1))
+        if os.path.abspath(include_path) in included:
+            return ""
+        return preprocess_shader(include_path, included)
+    source = INCLUDE_PATTERN.sub(include, source)
+
+    # Strip block comments, then line comments and trailing whitespace
+    source = re.sub(r"/\*.*?\*/", "", source, flags=re.DOTALL)
+    lines = [re.sub(r"//.*$", "", line).rstrip() for line in source.splitlines()]
+    return "\n".join(line for line in lines if line) + "\n"
+
+# Load the manifest once at startup
+ASSET_MANIFEST = load_manifest(CONFIG["asset_build_dir"])
@@ -0,0 +1,819 @@
+import glm
+import numpy as np
+from engine.config import CONFIG
+from engine.core.clusters import expand_ranges
+from engine.core.culling import cull_aabbs
+from engine.core.profiler import PROFILER
+
+# Relative costs of visiting a node and testing an item, for the surface area
+# heuristic
+TRAVERSAL_COST = 1.0
+INTERSECTION_COST = 1.0
+
+# Nodes are only rejected or accepted whole by frustum queries when clearly
+# outside or inside, so rounding in their bounds never changes a result
+FRUSTUM_EPSILON = 1e-6
+
+# The number of nodes a ray cast visits at once, nearest first
+RAY_BATCH = 32
+
+def surface_areas(mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+    """
+    Computes half the surface area of many boxes. Empty boxes (with minimum
+    above maximum) have an area of 0.
+
+    Parameters
+    ----------
+    mins : np.ndarray
+        Minimum corners, of shape (..., 3).
+    maxs : np.ndarray
+        Maximum corners, of shape (..., 3).
+
+    Returns
+    -------
+    np.ndarray
+        The areas, of shape (...).
+
+    """
+
+    size = np.maximum(maxs - mins, 0)
+    return size[..., 0] * size[..., 1] + size[..., 1] * size[..., 2] + size[..., 2] * size[..., 0]
+
+def ray_boxes(origin: np.ndarray, direction: np.ndarray, mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+    """
+    Intersects a ray with many boxes (slab method).
+
+    Parameters
+    ----------
+    origin : np.ndarray
+        The ray's origin, of shape (3,).
+    direction : np.ndarray
+        The ray's direction, of shape (3,). Distances are in multiples of its
+        length.
+    mins : np.ndarray
+        Minimum corners, of shape (N, 3).
+    maxs : np.ndarray
+        Maximum corners, of shape (N, 3).
+
+    Returns
+    -------
+    np.ndarray
+        The distance along the ray at which it enters each box, 0 for boxes
+        containing the origin, or infinity for boxes it misses, of shape (N,).
+
+    """
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1 / direction
+        near = (mins - origin) * inverse
+        far = (maxs - origin) * inverse
+
+    # Axes the ray is parallel to give NaN for boxes whose slab the origin
+    # lies on the edge of, and are ignored
+    entry = np.nanmax(np.fmin(near, far), axis=1, initial=0)
+    leave = np.nanmin(np.fmax(near, far), axis=1, initial=np.inf)
+    return np.where(entry <= leave, entry, np.inf)
+
+def box_distances(point: np.ndarray, mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+    """
+    Computes the squared distance of a point from many boxes.
+
+    Parameters
+    ----------
+    point : np.ndarray
+        The point, of shape (3,).
+    mins : np.ndarray
+        Minimum corners, of shape (N, 3).
+    maxs : np.ndarray
+        Maximum corners, of shape (N, 3).
+
+    Returns
+    -------
+    np.ndarray
+        The squared distances, 0 for boxes containing the point, of shape
+        (N,).
+
+    """
+
+    offsets = np.clip(point, mins, maxs) - point
+    return np.einsum("ij,ij->i", offsets, offsets)
+
+"""
+BVH
+
+A bounding volume hierarchy over axis aligned boxes, ie, the world bounds of
+every instance in a scene, answering frustum, ray and sphere queries without
+testing every box.
+
+The tree is built top down with the binned surface area heuristic: at each
+node, item centroids are binned along each axis, and the node is split at the
+bin boundary minimising the expected cost of traversing its children. All
+nodes at a depth are split at once, so building costs a handful of NumPy
+calls per level of the tree rather than per node.
+
+Items are reordered so that the items under any node are contiguous, so whole
+subtrees can be accepted by a query without visiting them. Nodes are stored
+in flat arrays, children adjacently, with every node at a depth after its
+parents.
+
+Moving items are handled by refitting, which recomputes node bounds in place
+and keeps the tree's structure. As items move far, the refitted tree's boxes
+overlap more and queries slow down, so update() rebuilds it once its cost has
+grown by a configured ratio since it was last built.
+"""
+class BVH:
+    def __init__(self, leaf_size: int = None, bins: int = None, rebuild_ratio: float = None):
+        """
+        Initialises an empty tree.
+
+        Parameters
+        ----------
+        leaf_size : int, optional
+            The most items a leaf may hold. The default is None (the
+            "bvh_leaf_size" config value).
+        bins : int, optional
+            The number of bins per axis when choosing splits. The default is
+            None (the "bvh_bins" config value).
+        rebuild_ratio : float, optional
+            How much the tree's cost may grow by through refitting before
+            update() rebuilds it, ie, 1.5. The default is None (the
+            "bvh_rebuild_ratio" config value).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.leaf_size = max(leaf_size or CONFIG["bvh_leaf_size"], 1)
+        self.bins = max(bins or CONFIG["bvh_bins"], 2)
+        self.rebuild_ratio = rebuild_ratio or CONFIG["bvh_rebuild_ratio"]
+
+        # Item bounds, and the order items are stored in under the nodes
+        self.set_items(np.zeros((0, 3)), np.zeros((0, 3)))
+        self.order = np.zeros(0, dtype=np.int64)
+
+        # Node bounds, their range of self.order, and the index of their first
+        # child (the second follows it), or -1 for leaves. Node indices are
+        # also kept by depth, for refitting bottom up.
+        self.node_min = np.zeros((0, 3))
+        self.node_max = np.zeros((0, 3))
+        self.node_start = np.zeros(0, dtype=np.int64)
+        self.node_count = np.zeros(0, dtype=np.int64)
+        self.node_child = np.zeros(0, dtype=np.int64)
+        self.levels = []
+
+        # The tree's cost when built, and now
+        self.built_cost = 0.0
+        self.cost = 0.0
+
+    def __len__(self) -> int:
+        """
+        Returns the number of items in the tree.
+
+        Returns
+        -------
+        int
+            The number of items.
+
+        """
+
+        return len(self.centers)
+
+    def set_items(self, centers: np.ndarray, extents: np.ndarray):
+        """
+        Stores the items' bounds, as boxes.
+
+        Parameters
+        ----------
+        centers : np.ndarray
+            Box centres, of shape (N, 3).
+        extents : np.ndarray
+            Box half extents, of shape (N, 3).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        self.extents = np.asarray(extents, dtype=np.float64).reshape(-1, 3)
+        self.mins = self.centers - self.extents
+        self.maxs = self.centers + self.extents
+
+    def build(self, centers: np.ndarray, extents: np.ndarray):
+        """
+        Builds the tree from scratch.
+
+        Parameters
+        ----------
+        centers : np.ndarray
+            Item box centres, of shape (N, 3).
+        extents : np.ndarray
+            Item box half extents, of shape (N, 3).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.set_items(centers, extents)
+        count = len(self.centers)
+        capacity = max(2 * count - 1, 1)
+
+        self.order = np.arange(count)
+        self.node_min = np.full((capacity, 3), np.inf)
+        self.node_max = np.full((capacity, 3), -np.inf)
+        self.node_start = np.zeros(capacity, dtype=np.int64)
+        self.node_count = np.zeros(capacity, dtype=np.int64)
+        self.node_child = np.full(capacity, -1, dtype=np.int64)
+        self.node_count[0] = count
+        self.levels = []
+
+        # Split every node of a depth at once, until every node is a leaf
+        frontier = np.array([0])
+        nodes = 1
+        while count and len(frontier):
+            self.levels.append(frontier)
+            starts, counts = self.node_start[frontier], self.node_count[frontier]
+            self.bound_nodes(frontier)
+
+            split = counts > self.leaf_size
+            if not split.any():
+                break
+            parents = frontier[split]
+            right = self.partition(starts[split], counts[split])
+
+            # Each parent's children are the next two nodes, in order
+            children = nodes + 2 * np.arange(len(parents))
+            self.node_child[parents] = children
+            self.node_start[children] = starts[split]
+            self.node_count[children] = counts[split] - right
+            self.node_start[children + 1] = starts[split] + counts[split] - right
+            self.node_count[children + 1] = right
+            frontier = np.stack([children, children + 1], axis=1).ravel()
+            nodes += 2 * len(parents)
+
+        self.trim(nodes)
+        self.built_cost = self.cost = self.sah_cost()
+        PROFILER.count("bvh_builds")
+
+    def partition(self, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        """
+        Chooses a split for each of a set of nodes with the binned surface
+        area heuristic, and partitions their items in self.order, left
+        child's first. Nodes whose item centroids all coincide are split in
+        half.
+
+        Parameters
+        ----------
+        starts : np.ndarray
+            The start of each node's range of self.order.
+        counts : np.ndarray
+            The number of items under each node, each at least 2.
+
+        Returns
+        -------
+        np.ndarray
+            The number of items moved to each node's right child.
+
+        """
+
+        # Small nodes need no more bins than they have items
+        parents, bins = len(starts), int(min(self.bins, counts.max()))
+        owners, positions = expand_ranges(starts, counts)
+        items = self.order[positions]
+        offsets = np.cumsum(counts) - counts
+        centroids = self.centers[items]
+
+        # Bin centroids across each node's centroid bounds along every axis
+        low = np.minimum.reduceat(centroids, offsets)
+        size = np.maximum.reduceat(centroids, offsets) - low
+        with np.errstate(divide="ignore"):
+            scale = np.where(size > 0, bins / size, 0)
+        binned = np.minimum(((centroids - low[owners]) * scale[owners]).astype(np.int64), bins - 1)
+
+        # Count and bound the items in each bin of each axis of each node,
+        # sorting items by bin so each bin's bounds are a single reduction
+        mins, maxs = self.mins[items], self.maxs[items]
+        bin_counts = np.zeros((3, parents * bins), dtype=np.int64)
+        bin_min = np.full((3, parents * bins, 3), np.inf)
+        bin_max = np.full((3, parents * bins, 3), -np.inf)
+        for axis in range(3):
+            keys = owners * bins + binned[:, axis]
+            ranked = np.argsort(keys, kind="stable")
+            keys = keys[ranked]
+            firsts = np.flatnonzero(np.diff(keys, prepend=-1))
+            bin_counts[axis, keys[firsts]] = np.diff(firsts, append=len(keys))
+            bin_min[axis, keys[firsts]] = np.minimum.reduceat(mins[ranked], firsts)
+            bin_max[axis, keys[firsts]] = np.maximum.reduceat(maxs[ranked], firsts)
+        bin_counts = bin_counts.reshape(3, parents, bins).transpose(1, 0, 2)
+        bin_min = bin_min.reshape(3, parents, bins, 3).transpose(1, 0, 2, 3)
+        bin_max = bin_max.reshape(3, parents, bins, 3).transpose(1, 0, 2, 3)
+
+        # Sweep from each side for the cost of splitting after every bin but
+        # the last. Splits leaving a side empty are not allowed.
+        left_count = np.cumsum(bin_counts, axis=2)[..., :-1]
+        right_count = counts[:, None, None] - left_count
+        left_area = surface_areas(
+            np.minimum.accumulate(bin_min, axis=2)[..., :-1, :],
+            np.maximum.accumulate(bin_max, axis=2)[..., :-1, :]
+        )
+        right_area = surface_areas(
+            np.minimum.accumulate(bin_min[:, :, ::-1], axis=2)[:, :, ::-1][..., 1:, :],
+            np.maximum.accumulate(bin_max[:, :, ::-1], axis=2)[:, :, ::-1][..., 1:, :]
+        )
+        costs = left_area * left_count + right_area * right_count
+        costs[(left_count == 0) | (right_count == 0)] = np.inf
+
+        best = np.argmin(costs.reshape(parents, -1), axis=1)
+        axis, split = np.divmod(best, bins - 1)
+        right = binned[np.arange(len(items)), axis[owners]] > split[owners]
+
+        # Nodes with no valid split are halved in their current order
+        halved = np.isinf(costs.reshape(parents, -1)[np.arange(parents), best])
+        if halved.any():
+            ranks = np.arange(len(items)) - offsets[owners]
+            right = np.where(halved[owners], ranks >= counts[owners] // 2, right)
+
+        # A stable sort by node, then side, moves each node's left items
+        # before its right, within its own range
+        self.order[positions] = items[np.argsort(owners * 2 + right, kind="stable")]
+        return np.bincount(owners, weights=right, minlength=parents).astype(np.int64)
+
+    def bound_nodes(self, nodes: np.ndarray):
+        """
+        Computes the bounds of nodes from their items.
+
+        Parameters
+        ----------
+        nodes : np.ndarray
+            The node indices.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if not len(nodes):
+            return
+        counts = self.node_count[nodes]
+        _, positions = expand_ranges(self.node_start[nodes], counts)
+        items = self.order[positions]
+        offsets = np.cumsum(counts) - counts
+        self.node_min[nodes] = np.minimum.reduceat(self.mins[items], offsets)
+        self.node_max[nodes] = np.maximum.reduceat(self.maxs[items], offsets)
+
+    def trim(self, nodes: int):
+        """
+        Shrinks the node arrays to the number of nodes used.
+
+        Parameters
+        ----------
+        nodes : int
+            The number of nodes.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.node_min = self.node_min[:nodes]
+        self.node_max = self.node_max[:nodes]
+        self.node_start = self.node_start[:nodes]
+        self.node_count = self.node_count[:nodes]
+        self.node_child = self.node_child[:nodes]
+
+    def sah_cost(self) -> float:
+        """
+        Computes the tree's expected cost of a query, by the surface area
+        heuristic, relative to the root's area.
+
+        Returns
+        -------
+        float
+            The cost, or 0 for an empty tree.
+
+        """
+
+        if not len(self):
+            return 0.0
+        areas = surface_areas(self.node_min, self.node_max)
+        root = areas[0]
+        if root <= 0:
+            return 0.0
+        leaves = self.node_child < 0
+        total = TRAVERSAL_COST * areas[~leaves].sum() + INTERSECTION_COST * (areas[leaves] * self.node_count[leaves]).sum()
+        return float(total / root)
+
+    def refit(self, centers: np.ndarray, extents: np.ndarray):
+        """
+        Updates the items' bounds, and the node bounds enclosing them, keeping
+        the tree's structure. The items must be the same, in the same order,
+        as when the tree was built.
+
+        Parameters
+        ----------
+        centers : np.ndarray
+            Item box centres, of shape (N, 3).
+        extents : np.ndarray
+            Item box half extents, of shape (N, 3).
+
+        Raises
+        ------
+        ValueError
+            If the number of items has changed.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if len(centers) != len(self):
+            raise ValueError(f"Cannot refit a BVH of {len(self)} items to {len(centers)}.")
+
+        self.set_items(centers, extents)
+        self.bound_nodes(np.flatnonzero(self.node_child < 0))
+
+        # Children always lie at a greater depth than their parents
+        for level in reversed(self.levels):
+            inner = level[self.node_child[level] >= 0]
+            children = self.node_child[inner]
+            self.node_min[inner] = np.minimum(self.node_min[children], self.node_min[children + 1])
+            self.node_max[inner] = np.maximum(self.node_max[children], self.node_max[children + 1])
+
+        self.cost = self.sah_cost()
+        PROFILER.count("bvh_refits")
+
+    def update(self, centers: np.ndarray, extents: np.ndarray) -> bool:
+        """
+        Refits the tree to moved items, or rebuilds it if the items have
+        changed in number or refitting has degraded it too far.
+
+        Parameters
+        ----------
+        centers : np.ndarray
+            Item box centres, of shape (N, 3).
+        extents : np.ndarray
+            Item box half extents, of shape (N, 3).
+
+        Returns
+        -------
+        bool
+            True if the tree was rebuilt.
+
+        """
+
+        if len(centers) == len(self) and len(self.levels):
+            self.refit(centers, extents)
+            if self.cost <= self.built_cost * self.rebuild_ratio:
+                return False
+        self.build(centers, extents)
+        return True
+
+    def leaf_items(self, nodes: np.ndarray) -> np.ndarray:
+        """
+        Returns the items under nodes.
+
+        Parameters
+        ----------
+        nodes : np.ndarray
+            The node indices.
+
+        Returns
+        -------
+        np.ndarray
+            The item indices.
+
+        """
+
+        _, positions = expand_ranges(self.node_start[nodes], self.node_count[nodes])
+        return self.order[positions]
+
+    def query_frustum(self, planes: np.ndarray) -> np.ndarray:
+        """
+        Finds the items whose boxes are at least partly inside a frustum. The
+        result matches testing every box with cull_aabbs().
+
+        Parameters
+        ----------
+        planes : np.ndarray
+            Frustum planes, of shape (6, 4), as from extract_frustum_planes().
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask of shape (N,), True where the item is visible.
+
+        """
+
+        visible = np.zeros(len(self), dtype=bool)
+        if not len(self):
+            return visible
+
+        normals, offsets = planes[:, :3], planes[:, 3]
+        frontier = np.array([0])
+        while len(frontier):
+            PROFILER.count("bvh_nodes_visited", len(frontier))
+            centers = (self.node_min[frontier] + self.node_max[frontier]) / 2
+            extents = (self.node_max[frontier] - self.node_min[frontier]) / 2
+            distances = centers @ normals.T + offsets
+            radii = extents @ np.abs(normals).T
+
+            # Nodes wholly inside every plane are visible with all their
+            # items, and nodes wholly outside any are skipped
+            outside = np.any(distances < -radii - FRUSTUM_EPSILON, axis=1)
+            inside = np.all(distances > radii + FRUSTUM_EPSILON, axis=1)
+            visible[self.leaf_items(frontier[inside])] = True
+
+            # Items in leaves crossing the frustum are tested themselves
+            crossing = frontier[~inside & ~outside]
+            leaves = self.node_child[crossing] < 0
+            items = self.leaf_items(crossing[leaves])
+            visible[items] = cull_aabbs(planes, self.centers[items], self.extents[items])
+
+            children = self.node_child[crossing[~leaves]]
+            frontier = np.concatenate([children, children + 1])
+        return visible
+
+    def query_sphere(self, center: np.ndarray, radius: float) -> np.ndarray:
+        """
+        Finds the items whose boxes intersect a sphere, ie, the instances a
+        point light reaches.
+
+        Parameters
+        ----------
+        center : np.ndarray
+            The sphere's centre, of shape (3,).
+        radius : float
+            The sphere's radius.
+
+        Returns
+        -------
+        np.ndarray
+            The indices of the items, ascending.
+
+        """
+
+        center = np.asarray(center, dtype=np.float64)
+        found = []
+        frontier = np.array([0]) if len(self) else np.zeros(0, dtype=np.int64)
+        while len(frontier):
+            PROFILER.count("bvh_nodes_visited", len(frontier))
+            hit = frontier[box_distances(center, self.node_min[frontier], self.node_max[frontier]) <= radius * radius]
+            leaves = self.node_child[hit] < 0
+            items = self.leaf_items(hit[leaves])
+            found.append(items[box_distances(center, self.mins[items], self.maxs[items]) <= radius * radius])
+
+            children = self.node_child[hit[~leaves]]
+            frontier = np.concatenate([children, children + 1])
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def raycast(self, origin: np.ndarray, direction: np.ndarray, max_distance: float = np.inf) -> (int, float):
+        """
+        Finds the first item box a ray enters, ie, for picking or camera
+        collision. Boxes containing the origin are hit at distance 0.
+
+        Parameters
+        ----------
+        origin : np.ndarray
+            The ray's origin, of shape (3,).
+        direction : np.ndarray
+            The ray's direction, of shape (3,).
+        max_distance : float, optional
+            The furthest distance to look, in multiples of the direction's
+            length. The default is infinity.
+
+        Returns
+        -------
+        (int, float)
+            The index of the item hit and the distance to it, or -1 and
+            infinity if none is.
+
+        """
+
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        best, best_distance = -1, max_distance
+        if not len(self):
+            return best, np.inf
+
+        # Visit the nodes the ray enters nearest first, a batch at a time, so
+        # once an item is hit, nodes entered beyond it are never visited
+        frontier = np.array([0])
+        distances = ray_boxes(origin, direction, self.node_min[:1], self.node_max[:1])
+        while len(frontier):
+            ahead = distances <= best_distance
+            frontier, distances = frontier[ahead], distances[ahead]
+            if len(frontier) > RAY_BATCH:
+                nearest = np.argpartition(distances, RAY_BATCH)[:RAY_BATCH]
+            else:
+                nearest = np.arange(len(frontier))
+            batch = frontier[nearest]
+            frontier, distances = np.delete(frontier, nearest), np.delete(distances, nearest)
+            PROFILER.count("bvh_nodes_visited", len(batch))
+
+            leaves = self.node_child[batch] < 0
+            items = self.leaf_items(batch[leaves])
+            if len(items):
+                item_distances = ray_boxes(origin, direction, self.mins[items], self.maxs[items])
+                nearest = np.argmin(item_distances)
+                if item_distances[nearest] <= best_distance and np.isfinite(item_distances[nearest]):
+                    best, best_distance = int(items[nearest]), float(item_distances[nearest])
+
+            children = self.node_child[batch[~leaves]]
+            children = np.concatenate([children, children + 1])
+            frontier = np.concatenate([frontier, children])
+            distances = np.concatenate([distances, ray_boxes(origin, direction, self.node_min[children], self.node_max[children])])
+        return best, (best_distance if best >= 0 else np.inf)
+
+"""
+InstanceIndex
+
+A BVH over the world bounds of every instance of every mesh in a scene. It is
+updated once a frame, refitting as instances move, and answers each frustum
+once for all meshes, which then read their own instances' visibility from the
+result.
+
+Queries on small scenes cost more through the tree than testing every
+instance, so meshes only cull through the index once it holds at least a
+configured number of instances.
+"""
+class InstanceIndex:
+    def __init__(self, threshold: int = None):
+        """
+        Initialises an empty index.
+
+        Parameters
+        ----------
+        threshold : int, optional
+            The fewest instances for which culling uses the index. The default
+            is None (the "bvh_culling_threshold" config value).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.bvh = BVH()
+        self.threshold = CONFIG["bvh_culling_threshold"] if threshold is None else threshold
+
+        # The meshes indexed, the first item of each, and the instance
+        # version of each when indexed
+        self.meshes = []
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.spans = {}
+
+        # Frustum query results this frame, by planes
+        self.queries = {}
+
+        # Counts of the last update, for profiling
+        self.last_frame = {}
+
+    def update(self, objects: list):
+        """
+        Brings the index up to date with the scene's instances, rebuilding the
+        tree if meshes or instances were added or removed, and refitting it
+        if any moved.
+
+        Parameters
+        ----------
+        objects : list
+            The scene's models.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.queries = {}
+        meshes = [mesh for obj in objects for mesh in obj.meshes]
+        bounds = [mesh.get_world_bounds() for mesh in meshes]
+        versions = [mesh.instance_version for mesh in meshes]
+        counts = np.array([len(centers) for centers, _ in bounds], dtype=np.int64)
+
+        same_meshes = meshes == self.meshes and np.array_equal(counts, np.diff(self.starts, append=len(self.bvh)))
+        if same_meshes and all(self.spans[mesh][2] == version for mesh, version in zip(meshes, versions)):
+            self.last_frame = {"instances": len(self.bvh), "nodes": len(self.bvh.node_child), "rebuilt": False, "refit": False}
+            return
+
+        centers = np.concatenate([centers for centers, _ in bounds]) if bounds else np.zeros((0, 3))
+        extents = np.concatenate([extents for _, extents in bounds]) if bounds else np.zeros((0, 3))
+        if same_meshes:
+            rebuilt = self.bvh.update(centers, extents)
+        else:
+            self.bvh.build(centers, extents)
+            rebuilt = True
+
+        self.meshes = meshes
+        self.starts = np.cumsum(counts) - counts
+        self.spans = {mesh: (int(start), int(count), version) for mesh, start, count, version in zip(meshes, self.starts, counts, versions)}
+        self.last_frame = {"instances": len(self.bvh), "nodes": len(self.bvh.node_child), "rebuilt": rebuilt, "refit": not rebuilt}
+
+    def cull(self, mesh, frustum: np.ndarray) -> np.ndarray:
+        """
+        Returns the visibility of a mesh's instances in a frustum, querying
+        the tree once per frustum for every mesh.
+
+        Parameters
+        ----------
+        mesh : Mesh
+            The mesh.
+        frustum : np.ndarray
+            Frustum planes, of shape (6, 4).
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask of the mesh's visible instances, or None if the index
+            is below its threshold, or does not hold the mesh's current bounds.
+
+        """
+
+        span = self.spans.get(mesh)
+        if span is None or len(self.bvh) < self.threshold or span[2] != mesh.instance_version:
+            return None
+
+        key = frustum.tobytes()
+        visible = self.queries.get(key)
+        if visible is None:
+            visible = self.queries[key] = self.bvh.query_frustum(frustum)
+        start, count, _ = span
+        return visible[start:start + count]
+
+    def locate(self, items: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Converts tree items to meshes and instances.
+
+        Parameters
+        ----------
+        items : np.ndarray
+            Item indices.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray)
+            The index in self.meshes of each item's mesh, and its instance.
+
+        """
+
+        owners = np.searchsorted(self.starts, items, side="right") - 1
+        return owners, items - self.starts[owners]
+
+    def raycast(self, origin: glm.vec3, direction: glm.vec3, max_distance: float = np.inf):
+        """
+        Finds the first instance bounding box a ray enters, ie, for picking.
+
+        Parameters
+        ----------
+        origin : glm.vec3
+            The ray's origin.
+        direction : glm.vec3
+            The ray's direction.
+        max_distance : float, optional
+            The furthest distance to look. The default is infinity.
+
+        Returns
+        -------
+        (Mesh, int, float)
+            The mesh and instance hit, and the distance to it, or None if
+            nothing is.
+
+        """
+
+        item, distance = self.bvh.raycast(np.array(origin), np.array(direction), max_distance)
+        if item < 0:
+            return None
+        owners, instances = self.locate(np.array([item]))
+        return self.meshes[owners[0]], int(instances[0]), distance
+
+    def query_sphere(self, center: glm.vec3, radius: float) -> list:
+        """
+        Finds the instances whose bounding boxes intersect a sphere, ie, those
+        a point light reaches.
+
+        Parameters
+        ----------
+        center : glm.vec3
+            The sphere's centre.
+        radius : float
+            The sphere's radius.
+
+        Returns
+        -------
+        list[(Mesh, np.ndarray)]
+            Each mesh with instances in the sphere, and their indices.
+
+        """
+
+        owners, instances = self.locate(self.bvh.query_sphere(np.array(center), radius))
+        return [(self.meshes[owner], instances[owners == owner]) for owner in np.unique(owners)]
+
+INSTANCE_INDEX = InstanceIndex()
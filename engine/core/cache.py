@@ -1,15 +1,227 @@
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from engine.config import CONFIG
 from engine.texture.texture import Texture
 from OpenGL.GL import GL_TEXTURE_2D
 
-# Textures can and should be reused between materials. Therefore we use a 
-# texture cache to hold pointers to preloaded textures.
+"""
+TextureCache
 
-TEXTURE_CACHE = {}
+Textures can and should be reused between materials. Therefore we use a
+texture cache to hold pointers to preloaded textures.
+
+The cache also accounts for the GPU memory of each resident texture, and keeps
+the total within a budget by evicting the least recently bound textures. An
+evicted texture keeps its Texture object (and so its place in any Material),
+and is reloaded when next bound.
+"""
+class TextureCache:
+    def __init__(self, budget_bytes: int):
+        """
+        Initialises an empty cache.
+
+        Parameters
+        ----------
+        budget_bytes : int
+            The most bytes resident textures may use before eviction.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.budget_bytes = budget_bytes
+
+        # Every texture by path, and resident textures in least to most
+        # recently bound order
+        self.textures = {}
+        self.resident = OrderedDict()
+        self.resident_bytes = 0
+
+        # Textures bound during the current frame are never evicted, as they
+        # may still be bound to a texture unit for the current draw
+        self.frame = 0
+
+        # Statistics. Hits and misses count lookups by path, and reloads
+        # count binds of textures that had been evicted.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+
+    def get(self, path: str, executor=None) -> Texture:
+        """
+        Fetch a texture, creating and loading it if not already cached.
+
+        Parameters
+        ----------
+        path : str
+            The path to the texture.
+        executor : Executor, optional
+            Executor to decode new textures on. The default is None.
+
+        Returns
+        -------
+        Texture
+            The texture instance.
+
+        """
+
+        texture = self.textures.get(path)
+        if texture is not None:
+            self.hits += 1
+            return texture
+
+        self.misses += 1
+        texture = Texture(GL_TEXTURE_2D, path, executor=executor, cache=self)
+        self.textures[path] = texture
+        return texture
+
+    def on_upload(self, texture: Texture):
+        """
+        Accounts for a newly uploaded texture, evicting others if this takes
+        the cache over budget. Called by Texture.upload().
+
+        Parameters
+        ----------
+        texture : Texture
+            The uploaded texture.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if texture.path in self.resident:
+            self.resident_bytes -= self.resident.pop(texture.path).size_bytes
+        self.resident[texture.path] = texture
+        self.resident_bytes += texture.size_bytes
+        self.evict()
+
+    def on_bind(self, texture: Texture):
+        """
+        Marks a texture as most recently used, reloading it first if it was
+        evicted. Called by Texture.bind().
+
+        Parameters
+        ----------
+        texture : Texture
+            The texture being bound.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        texture.last_frame = self.frame
+        if texture.path in self.resident:
+            self.resident.move_to_end(texture.path)
+        else:
+            self.reloads += 1
+            logging.info(f"Reloading evicted texture {texture.path}")
+            texture.reload()
+
+    def evict(self):
+        """
+        Evicts least recently bound textures until within budget.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for path in list(self.resident.keys()):
+            if self.resident_bytes <= self.budget_bytes:
+                return
+
+            # Resident is ordered by last bind, so once we reach a texture
+            # bound this frame, every texture after it was too
+            texture = self.resident[path]
+            if texture.last_frame == self.frame:
+                break
+
+            del self.resident[path]
+            self.resident_bytes -= texture.size_bytes
+            self.evictions += 1
+            texture.evict()
+
+        if self.resident_bytes > self.budget_bytes:
+            logging.warning(
+                f"Textures bound this frame need {self.resident_bytes} bytes, "
+                f"over the {self.budget_bytes} byte budget"
+            )
+
+    def new_frame(self):
+        """
+        Starts a new frame, allowing textures bound in earlier frames to be
+        evicted, and evicts any needed to return within budget.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.frame += 1
+        self.evict()
+
+    def finish_loads(self):
+        """
+        Wait for every queued texture decode, and upload the results.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for texture in self.textures.values():
+            texture.finish()
+
+    def stats(self) -> dict:
+        """
+        Returns cache statistics.
+
+        Returns
+        -------
+        dict
+            Lookup hits and misses, evictions, reloads of evicted textures,
+            and resident, budget, and total texture counts and bytes.
+
+        """
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "reloads": self.reloads,
+            "textures": len(self.textures),
+            "resident_textures": len(self.resident),
+            "resident_bytes": self.resident_bytes,
+            "budget_bytes": self.budget_bytes
+        }
+
+# Budget is configured in megabytes
+TEXTURE_CACHE = TextureCache(CONFIG["texture_budget_mb"] * 1024 * 1024)
+
+# Image decoding is CPU bound but releases the GIL, so textures are decoded on
+# a pool of threads. Uploading must happen on the context thread, so is
+# deferred until finish_texture_loads() or the texture is first bound.
+TEXTURE_DECODER = ThreadPoolExecutor(
+    max_workers=CONFIG["texture_decode_threads"],
+    thread_name_prefix="texture-decode"
+)
 
 def get_or_load_texture(path: str):
     """
-    Load a texture, or fetch reference if already loaded
+    Load a texture, or fetch reference if already loaded. Loading is
+    asynchronous: the texture object is returned immediately, and its image is
+    decoded in the background.
 
     Parameters
     ----------
@@ -22,9 +234,20 @@ def get_or_load_texture(path: str):
         The texture instance.
 
     """
-    
+
     logging.info(f"Loading {path}")
-    if not path in TEXTURE_CACHE.keys():
-        TEXTURE_CACHE[path] = Texture(GL_TEXTURE_2D, path)
-    
-    return TEXTURE_CACHE[path]
+    return TEXTURE_CACHE.get(path, executor=TEXTURE_DECODER)
+
+def finish_texture_loads():
+    """
+    Wait for every queued texture decode, and upload the results. Call once
+    after creating all materials, so decodes overlap with each other and with
+    the rest of scene setup.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    TEXTURE_CACHE.finish_loads()
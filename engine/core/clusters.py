@@ -0,0 +1,565 @@
+import glm
+import numpy as np
+from OpenGL.GL import *
+from engine.config import CONFIG
+from engine.core.profiler import PROFILER
+from engine.core.state import GL_STATE
+from engine.core.program import SAMPLER_UNITS
+
+# Texture units of the light, cluster, and light index buffers
+POINT_LIGHTS_UNIT = SAMPLER_UNITS["pointLightData"]
+CLUSTERS_UNIT = SAMPLER_UNITS["clusterData"]
+LIGHT_INDICES_UNIT = SAMPLER_UNITS["clusterLightIndices"]
+
+# Point lights, as read from the light texture buffer: four RGBA32F texels
+# per light, falloff values and radius filling each vec3's fourth component
+POINT_LIGHT_DTYPE = np.dtype({
+    "names": ["position", "constant", "ambient", "linear", "diffuse", "quadratic", "specular", "radius"],
+    "formats": [("<f4", 3), "<f4", ("<f4", 3), "<f4", ("<f4", 3), "<f4", ("<f4", 3), "<f4"],
+    "offsets": [0, 12, 16, 28, 32, 44, 48, 60],
+    "itemsize": 64
+})
+
+# Lights are tested against clusters with this much slack, relative to their
+# radius, so fragments on a cluster's boundary never miss a light
+RADIUS_MARGIN = 1e-4
+
+def light_radii(lights: np.ndarray, cutoff: float) -> np.ndarray:
+    """
+    Computes the distance at which each light's attenuation brings its
+    brightest colour below a cutoff, ie, the "light_cutoff" config value of
+    0.01. The lighting shader fades each light out to nothing at this radius,
+    so lights need only be shaded by fragments within it.
+
+    Parameters
+    ----------
+    lights : np.ndarray
+        The lights, of dtype POINT_LIGHT_DTYPE.
+    cutoff : float
+        The brightness below which a light is ignored.
+
+    Returns
+    -------
+    np.ndarray
+        The radii, of shape (N,).
+
+    """
+
+    brightest = np.max(np.concatenate([lights["ambient"], lights["diffuse"], lights["specular"]], axis=1), axis=1)
+
+    # Solve quadratic * d^2 + linear * d + constant = brightest / cutoff
+    a = lights["quadratic"].astype(np.float64)
+    b = lights["linear"].astype(np.float64)
+    c = lights["constant"] - brightest / cutoff
+    with np.errstate(divide="ignore", invalid="ignore"):
+        quadratic_root = (-b + np.sqrt(np.maximum(b * b - 4 * a * c, 0))) / (2 * a)
+        linear_root = -c / b
+    radii = np.where(a > 0, quadratic_root, np.where(b > 0, linear_root, np.inf))
+    return np.maximum(radii, 0).astype(np.float32)
+
+def slice_depths(near: float, far: float, slices: int) -> np.ndarray:
+    """
+    Returns the boundaries of depth slices spaced exponentially between the
+    near and far planes, so clusters are roughly as deep as they are wide.
+
+    Parameters
+    ----------
+    near : float
+        The near plane distance.
+    far : float
+        The far plane distance.
+    slices : int
+        The number of slices.
+
+    Returns
+    -------
+    np.ndarray
+        The slice boundaries, of shape (slices + 1,).
+
+    """
+
+    return near * (far / near) ** (np.arange(slices + 1) / slices)
+
+def cluster_bounds(grid: tuple[int, int, int], near: float, far: float, scale: tuple[float, float]) -> np.ndarray:
+    """
+    Computes the view space bounding box of every cluster. Clusters are cells
+    of the view frustum: tiles of the screen along x and y, and depth slices
+    along z. Coordinates are (x, y, depth), depth being distance in front of
+    the camera.
+
+    Parameters
+    ----------
+    grid : tuple[int, int, int]
+        Clusters along x, y, and z.
+    near : float
+        The near plane distance.
+    far : float
+        The far plane distance.
+    scale : tuple[float, float]
+        The projection matrix's x and y scales, ie, 1 / tan(fov / 2) / aspect.
+
+    Returns
+    -------
+    np.ndarray
+        Minimum and maximum corners, of shape (z * y * x, 2, 3), indexed by
+        cluster (z * grid_y + y) * grid_x + x.
+
+    """
+
+    size_x, size_y, size_z = grid
+    depths = slice_depths(near, far, size_z)
+    bounds = np.empty((size_z, size_y, size_x, 2, 3))
+
+    # Tile edges in normalised device coordinates span a range of view space
+    # coordinates over the depths of each slice
+    for axis, size in ((0, size_x), (1, size_y)):
+        edges = -1 + 2 * np.arange(size + 1) / size
+        low = np.minimum(edges[:-1, None] * depths[None, :-1], edges[:-1, None] * depths[None, 1:]) / scale[axis]
+        high = np.maximum(edges[1:, None] * depths[None, :-1], edges[1:, None] * depths[None, 1:]) / scale[axis]
+        shape = (size_z, size, 1) if axis else (size_z, 1, size)
+        bounds[..., 0, axis] = low.T.reshape(shape)
+        bounds[..., 1, axis] = high.T.reshape(shape)
+
+    bounds[..., 0, 2] = depths[:-1, None, None]
+    bounds[..., 1, 2] = depths[1:, None, None]
+    return bounds.reshape(-1, 2, 3)
+
+def spheres_intersect_boxes(centers: np.ndarray, radii: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    Tests spheres against boxes, pairwise, with a small margin.
+
+    Parameters
+    ----------
+    centers : np.ndarray
+        Sphere centres, of shape (N, 3).
+    radii : np.ndarray
+        Sphere radii, of shape (N,).
+    boxes : np.ndarray
+        Minimum and maximum corners, of shape (N, 2, 3).
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask of shape (N,), True where the sphere and box intersect.
+
+    """
+
+    closest = np.clip(centers, boxes[:, 0], boxes[:, 1])
+    distances = np.einsum("ij,ij->i", closest - centers, closest - centers)
+    reach = radii * (1 + RADIUS_MARGIN) + RADIUS_MARGIN
+    return distances <= reach * reach
+
+def expand_ranges(starts: np.ndarray, counts: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Expands ranges into their members, ie, starts (2, 7) and counts (3, 1)
+    into owners (0, 0, 0, 1) and values (2, 3, 4, 7).
+
+    Parameters
+    ----------
+    starts : np.ndarray
+        The first value of each range.
+    counts : np.ndarray
+        The length of each range.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The index of the range each member belongs to, and its value.
+
+    """
+
+    owners = np.repeat(np.arange(len(counts)), counts)
+    values = np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+    return owners, values
+
+def axis_distances(values: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """
+    Returns the squared distance of values from ranges, or 0 within them.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values.
+    low : np.ndarray
+        The start of each range.
+    high : np.ndarray
+        The end of each range.
+
+    Returns
+    -------
+    np.ndarray
+        The squared distances.
+
+    """
+
+    distances = np.maximum(np.maximum(low - values, values - high), 0)
+    return distances * distances
+
+def to_cluster_space(positions: np.ndarray, view: glm.mat4) -> np.ndarray:
+    """
+    Transforms world space positions to view space (x, y, depth), as used by
+    cluster_bounds().
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        World space positions, of shape (N, 3).
+    view : glm.mat4
+        The camera's view matrix.
+
+    Returns
+    -------
+    np.ndarray
+        The positions, of shape (N, 3).
+
+    """
+
+    # NumPy reads glm matrices row by row
+    matrix = np.array(view, dtype=np.float64)
+    points = positions @ matrix[:3, :3].T + matrix[:3, 3]
+    points[:, 2] = -points[:, 2]
+    return points
+
+def assign_lights(
+    centers: np.ndarray,
+    radii: np.ndarray,
+    grid: tuple[int, int, int],
+    near: float,
+    far: float,
+    scale: tuple[float, float],
+    bounds: np.ndarray = None
+) -> (np.ndarray, np.ndarray):
+    """
+    Assigns lights to every cluster their sphere of influence touches.
+    Candidate clusters are found per light, one axis at a time, then tested
+    exactly, all without Python loops.
+
+    Parameters
+    ----------
+    centers : np.ndarray
+        Light positions, as from to_cluster_space(), of shape (N, 3).
+    radii : np.ndarray
+        Light radii, of shape (N,).
+    grid : tuple[int, int, int]
+        Clusters along x, y, and z.
+    near : float
+        The near plane distance.
+    far : float
+        The far plane distance.
+    scale : tuple[float, float]
+        The projection matrix's x and y scales.
+    bounds : np.ndarray, optional
+        The clusters' bounds, as from cluster_bounds(), if already computed.
+        The default is None.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The offset and count of each cluster's lights in the index list, of
+        shape (clusters, 2), and the index list, with each cluster's lights
+        in ascending order. Both are uint32.
+
+    """
+
+    size_x, size_y, size_z = grid
+    if bounds is None:
+        bounds = cluster_bounds(grid, near, far, scale)
+    centers = np.asarray(centers, dtype=np.float64)
+    radii = np.asarray(radii, dtype=np.float64)
+    reach = radii * (1 + RADIUS_MARGIN) + RADIUS_MARGIN
+
+    # Each axis of a cluster's bounds depends on its slice and its tile along
+    # that axis only, so the distance from a light to a cluster can be summed
+    # one axis at a time, discarding candidates out of reach along the way.
+    # This only prunes, so is given slack; the exact test comes last.
+    remaining = reach * reach * (1 + 1e-6)
+    depths = slice_depths(near, far, size_z)
+    by_axis = bounds.reshape(size_z, size_y, size_x, 2, 3)
+    x_bounds = by_axis[:, 0, :, :, 0]
+    y_bounds = by_axis[:, :, 0, :, 1]
+
+    # Depth slices overlapping each light, with a slice of slack either side.
+    # Lights entirely behind the camera or beyond the far plane have none.
+    log_scale = size_z / np.log(far / near)
+    z0 = np.floor(np.log(np.clip(centers[:, 2] - reach, near, far) / near) * log_scale) - 1
+    z1 = np.floor(np.log(np.clip(centers[:, 2] + reach, near, far) / near) * log_scale) + 1
+    z0, z1 = np.clip(z0, 0, size_z - 1).astype(np.int64), np.clip(z1, 0, size_z - 1).astype(np.int64)
+    valid = (centers[:, 2] + reach >= near) & (centers[:, 2] - reach <= far)
+    lights, slices = expand_ranges(z0, np.where(valid, z1 - z0 + 1, 0))
+    remaining = remaining[lights] - axis_distances(centers[lights, 2], depths[slices], depths[slices + 1])
+    keep = remaining >= 0
+    lights, slices, remaining = lights[keep], slices[keep], remaining[keep]
+
+    # Tiles overlapping each light in each slice, found by inverting the tile
+    # edges' view space extent at the slice's near and far depths
+    def tile_range(axis, size):
+        position, depth_near, depth_far = centers[lights, axis], depths[slices], depths[slices + 1]
+        low, high = (position - reach[lights]) * scale[axis], (position + reach[lights]) * scale[axis]
+        first = np.where(low >= 0, low / depth_far, low / depth_near)
+        last = np.where(high >= 0, high / depth_near, high / depth_far)
+        start = np.clip(np.ceil((first + 1) * size / 2 - 1) - 1, 0, size - 1).astype(np.int64)
+        end = np.clip(np.floor((last + 1) * size / 2) + 1, 0, size - 1).astype(np.int64)
+        return start, end - start + 1
+
+    owners, tiles_x = expand_ranges(*tile_range(0, size_x))
+    lights, slices, remaining = lights[owners], slices[owners], remaining[owners]
+    remaining = remaining - axis_distances(centers[lights, 0], x_bounds[slices, tiles_x, 0], x_bounds[slices, tiles_x, 1])
+    keep = remaining >= 0
+    lights, slices, remaining, tiles_x = lights[keep], slices[keep], remaining[keep], tiles_x[keep]
+
+    owners, tiles_y = expand_ranges(*tile_range(1, size_y))
+    lights, slices, tiles_x = lights[owners], slices[owners], tiles_x[owners]
+    clusters = (slices * size_y + tiles_y) * size_x + tiles_x
+
+    # Keep candidates whose cluster the light's sphere actually touches
+    hit = spheres_intersect_boxes(centers[lights], radii[lights], bounds[clusters])
+    lights, clusters = lights[hit], clusters[hit]
+
+    # Group by cluster. Candidates were made in light order, so a stable sort
+    # keeps each cluster's lights in ascending order.
+    order = np.argsort(clusters, kind="stable")
+    counts = np.bincount(clusters, minlength=size_x * size_y * size_z)
+    offsets = np.cumsum(counts) - counts
+    return np.stack([offsets, counts], axis=1).astype(np.uint32), lights[order].astype(np.uint32)
+
+def assign_lights_reference(
+    centers: np.ndarray,
+    radii: np.ndarray,
+    grid: tuple[int, int, int],
+    near: float,
+    far: float,
+    scale: tuple[float, float]
+) -> (np.ndarray, np.ndarray):
+    """
+    Assigns lights to clusters by brute force, testing every light against
+    every cluster. Far too slow to use per frame, but gives exactly the same
+    result as assign_lights(), so checks it.
+
+    Parameters
+    ----------
+    centers : np.ndarray
+        Light positions, as from to_cluster_space(), of shape (N, 3).
+    radii : np.ndarray
+        Light radii, of shape (N,).
+    grid : tuple[int, int, int]
+        Clusters along x, y, and z.
+    near : float
+        The near plane distance.
+    far : float
+        The far plane distance.
+    scale : tuple[float, float]
+        The projection matrix's x and y scales.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        As from assign_lights().
+
+    """
+
+    bounds = cluster_bounds(grid, near, far, scale)
+    centers = np.asarray(centers, dtype=np.float64)
+    radii = np.asarray(radii, dtype=np.float64)
+    clusters = []
+    indices = []
+    for box in bounds:
+        hit = np.flatnonzero(spheres_intersect_boxes(centers, radii, np.broadcast_to(box, (len(centers), 2, 3))))
+        clusters.append((len(indices), len(hit)))
+        indices.extend(hit.tolist())
+    return np.array(clusters, dtype=np.uint32), np.array(indices, dtype=np.uint32)
+
+"""
+LightClusters
+
+Clustered forward lighting: every frame, point lights are assigned to the
+clusters of the camera's frustum they can reach, and the lighting shader
+shades each fragment with only its cluster's lights.
+
+The lights, each cluster's offset and count, and the cluster light index list
+are stored in texture buffers, which have no size limit in practice and are
+readable from GLSL 3.30. The grid and depth slicing are written to the
+LightData uniform block.
+"""
+class LightClusters:
+    def __init__(self, grid: tuple[int, int, int] = None, cutoff: float = None):
+        """
+        Creates the texture buffers.
+
+        Parameters
+        ----------
+        grid : tuple[int, int, int], optional
+            Clusters along x, y, and z. The default is None (as configured).
+        cutoff : float, optional
+            The brightness below which lights are ignored. The default is None
+            (as configured).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.grid = tuple(grid or CONFIG["cluster_grid"])
+        self.cutoff = cutoff or CONFIG["light_cutoff"]
+
+        # Cluster bounds, and the projection they were computed for
+        self.bounds = None
+        self.bounds_key = None
+
+        # Buffer, texture, and capacity in bytes of each texture buffer
+        self.buffers = {}
+        self.create_buffer("lights", GL_RGBA32F)
+        self.create_buffer("clusters", GL_RG32UI)
+        self.create_buffer("indices", GL_R32UI)
+
+        # Lights, and light to cluster assignments, in the last update
+        self.last_frame = {"lights": 0, "assignments": 0, "max_per_cluster": 0}
+
+    def create_buffer(self, name: str, format: int):
+        """
+        Creates an empty texture buffer.
+
+        Parameters
+        ----------
+        name : str
+            The buffer's name.
+        format : int
+            The texel format, ie, GL_RGBA32F.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        buffer = glGenBuffers(1)
+        glBindBuffer(GL_TEXTURE_BUFFER, buffer)
+        glBufferData(GL_TEXTURE_BUFFER, 16, None, GL_DYNAMIC_DRAW)
+        texture = glGenTextures(1)
+        GL_STATE.bind_texture(GL_TEXTURE_BUFFER, texture)
+        glTexBuffer(GL_TEXTURE_BUFFER, format, buffer)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+        self.buffers[name] = [buffer, texture, 16]
+
+    def upload(self, name: str, data: np.ndarray):
+        """
+        Uploads data to a texture buffer, growing it if needed.
+
+        Parameters
+        ----------
+        name : str
+            The buffer's name.
+        data : np.ndarray
+            The data.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        buffer, _, capacity = self.buffers[name]
+        if not data.nbytes:
+            return
+        glBindBuffer(GL_TEXTURE_BUFFER, buffer)
+        if data.nbytes > capacity:
+            glBufferData(GL_TEXTURE_BUFFER, data.nbytes, data, GL_DYNAMIC_DRAW)
+            self.buffers[name][2] = data.nbytes
+        else:
+            glBufferSubData(GL_TEXTURE_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def update(self, lights: np.ndarray, view: glm.mat4, projection: glm.mat4, light_data: np.ndarray):
+        """
+        Assigns this frame's lights to clusters, uploads the lights and
+        clusters, and fills the LightData uniform block.
+
+        Parameters
+        ----------
+        lights : np.ndarray
+            The point lights, of dtype POINT_LIGHT_DTYPE. Their radii are
+            computed here.
+        view : glm.mat4
+            The camera's view matrix.
+        projection : glm.mat4
+            The camera's projection matrix.
+        light_data : np.ndarray
+            The LightData block, as from UniformBuffer, to fill.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        near, far = CONFIG["near_plane"], CONFIG["far_plane"]
+        scale = (abs(projection[0][0]), abs(projection[1][1]))
+
+        # Bounds only change with the projection
+        key = (self.grid, near, far, scale)
+        if key != self.bounds_key:
+            self.bounds = cluster_bounds(self.grid, near, far, scale)
+            self.bounds_key = key
+
+        lights["radius"] = light_radii(lights, self.cutoff)
+        centers = to_cluster_space(lights["position"].astype(np.float64), view)
+        clusters, indices = assign_lights(centers, lights["radius"], self.grid, near, far, scale, self.bounds)
+
+        self.upload("lights", lights)
+        self.upload("clusters", clusters)
+        self.upload("indices", indices)
+
+        size_x, size_y, size_z = self.grid
+        light_data["clusterGrid"] = (size_x, size_y, size_z, int(CONFIG["clustered_lighting"]))
+        light_data["clusterDepth"] = (near, far, size_z / np.log(far / near), np.log(near))
+        light_data["clusterTileSize"] = (CONFIG["window_width"] / size_x, CONFIG["window_height"] / size_y)
+        light_data["pointLightCount"] = len(lights)
+
+        self.last_frame = {
+            "lights": len(lights),
+            "assignments": len(indices),
+            "max_per_cluster": int(clusters[:, 1].max()) if len(clusters) else 0
+        }
+        PROFILER.count("light_assignments", len(indices))
+
+    def bind(self, program):
+        """
+        Binds the texture buffers to their units, and points the lighting
+        shader's samplers at them.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The lighting program, in use.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for name, sampler, unit in (
+            ("lights", "pointLightData", POINT_LIGHTS_UNIT),
+            ("clusters", "clusterData", CLUSTERS_UNIT),
+            ("indices", "clusterLightIndices", LIGHT_INDICES_UNIT)
+        ):
+            program.setInt(sampler, unit)
+            GL_STATE.bind_texture(GL_TEXTURE_BUFFER, self.buffers[name][1], unit)
+
+    def __del__(self):
+        """
+        On all references descoping, delete the buffers and textures.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        try:
+            for buffer, texture, _ in self.buffers.values():
+                GL_STATE.forget_texture(texture)
+                glDeleteTextures(1, [texture])
+                glDeleteBuffers(1, buffer)
+        except:
+            pass
@@ -0,0 +1,190 @@
+import glm
+import numpy as np
+
+def extract_frustum_planes(matrix: glm.mat4) -> np.ndarray:
+    """
+    Extracts the six clip planes of a view frustum from a view projection
+    matrix (Gribb/Hartmann). A point p is inside plane (n, d) when
+    dot(n, p) + d >= 0.
+
+    Parameters
+    ----------
+    matrix : glm.mat4
+        The view projection matrix, ie, perspective * view, or a light space
+        matrix.
+
+    Returns
+    -------
+    np.ndarray
+        The normalised planes, of shape (6, 4): left, right, bottom, top,
+        near, far.
+
+    """
+
+    # NumPy reads glm matrices row by row
+    m = np.array(matrix, dtype=np.float64)
+    planes = np.array([
+        m[3] + m[0],
+        m[3] - m[0],
+        m[3] + m[1],
+        m[3] - m[1],
+        m[3] + m[2],
+        m[3] - m[2]
+    ])
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+def transform_aabbs(matrices: np.ndarray, local_min: np.ndarray, local_max: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Transforms a local axis aligned bounding box by many model matrices,
+    giving the world space box enclosing each (Arvo's method).
+
+    Parameters
+    ----------
+    matrices : np.ndarray
+        Row major model matrices, of shape (N, 4, 4).
+    local_min : np.ndarray
+        Minimum corner of the local box, of shape (3,).
+    local_max : np.ndarray
+        Maximum corner of the local box, of shape (3,).
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        World space centres and half extents, each of shape (N, 3).
+
+    """
+
+    center = (local_min + local_max) / 2
+    extent = (local_max - local_min) / 2
+    linear = matrices[:, :3, :3]
+    centers = linear @ center + matrices[:, :3, 3]
+    extents = np.abs(linear) @ extent
+    return centers, extents
+
+def cull_aabbs(planes: np.ndarray, centers: np.ndarray, extents: np.ndarray) -> np.ndarray:
+    """
+    Tests many axis aligned bounding boxes against frustum planes at once.
+    Conservative: boxes crossing a frustum corner may be kept, but no visible
+    box is culled.
+
+    Parameters
+    ----------
+    planes : np.ndarray
+        Frustum planes, of shape (6, 4), as from extract_frustum_planes().
+    centers : np.ndarray
+        Box centres, of shape (N, 3).
+    extents : np.ndarray
+        Box half extents, of shape (N, 3).
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask of shape (N,), True where the box is at least partly
+        inside the frustum.
+
+    """
+
+    # Signed distance of each centre from each plane, against the box's
+    # projected radius onto each plane normal
+    distances = centers @ planes[:, :3].T + planes[:, 3]
+    radii = extents @ np.abs(planes[:, :3]).T
+    return np.all(distances >= -radii, axis=1)
+
+def cull_spheres(planes: np.ndarray, centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+    """
+    Tests many bounding spheres against frustum planes at once.
+
+    Parameters
+    ----------
+    planes : np.ndarray
+        Frustum planes, of shape (6, 4), as from extract_frustum_planes().
+    centers : np.ndarray
+        Sphere centres, of shape (N, 3).
+    radii : np.ndarray
+        Sphere radii, of shape (N,).
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask of shape (N,), True where the sphere is at least partly
+        inside the frustum.
+
+    """
+
+    distances = centers @ planes[:, :3].T + planes[:, 3]
+    return np.all(distances >= -radii[:, None], axis=1)
+
+"""
+CullingStats
+
+Counts instances drawn and culled per render pass, for profiling.
+"""
+class CullingStats:
+    def __init__(self):
+        """
+        Initialises empty counts.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.current_pass = None
+        self.counts = {}
+        self.last_frame = {}
+
+    def begin_pass(self, name: str):
+        """
+        Sets the pass that subsequent counts are recorded against.
+
+        Parameters
+        ----------
+        name : str
+            The pass name, ie, "shadow" or "lighting".
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.current_pass = name
+        self.counts.setdefault(name, {"drawn": 0, "culled": 0})
+
+    def record(self, drawn: int, culled: int):
+        """
+        Records instance counts for the current pass.
+
+        Parameters
+        ----------
+        drawn : int
+            Instances drawn.
+        culled : int
+            Instances culled.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        counts = self.counts.setdefault(self.current_pass, {"drawn": 0, "culled": 0})
+        counts["drawn"] += drawn
+        counts["culled"] += culled
+
+    def new_frame(self):
+        """
+        Stores the counts of the frame just finished, and resets.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.last_frame = self.counts
+        self.counts = {}
+        self.current_pass = None
+
+CULLING_STATS = CullingStats()
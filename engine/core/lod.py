@@ -0,0 +1,209 @@
+import glm
+import numpy as np
+from engine.config import CONFIG
+from engine.core.profiler import PROFILER
+
+def screen_sizes(centers: np.ndarray, radii: np.ndarray, camera_position: np.ndarray, projection_scale: float) -> np.ndarray:
+    """
+    Estimates the projected size of many bounding spheres: the radius on
+    screen as a fraction of half the viewport height. Spheres containing the
+    camera are infinitely large.
+
+    Parameters
+    ----------
+    centers : np.ndarray
+        Sphere centres, of shape (N, 3).
+    radii : np.ndarray
+        Sphere radii, of shape (N,).
+    camera_position : np.ndarray
+        The camera position, of shape (3,).
+    projection_scale : float
+        The vertical scale of the projection matrix, ie, 1 / tan(fov / 2).
+
+    Returns
+    -------
+    np.ndarray
+        The sizes, of shape (N,).
+
+    """
+
+    distances = np.linalg.norm(centers - camera_position, axis=1)
+    with np.errstate(divide="ignore"):
+        return np.where(distances > radii, radii * projection_scale / distances, np.inf)
+
+def select_lods(sizes: np.ndarray, current: np.ndarray, thresholds: list[float], hysteresis: float) -> np.ndarray:
+    """
+    Picks the level of detail of many instances from their screen sizes.
+    Level i + 1 is used below thresholds[i], but with hysteresis: an instance
+    only moves to a coarser level once it is smaller than the threshold by
+    the hysteresis fraction, and only back to a finer one once larger by it,
+    so instances near a threshold do not flicker between levels.
+
+    Parameters
+    ----------
+    sizes : np.ndarray
+        Screen sizes, as from screen_sizes(), of shape (N,).
+    current : np.ndarray
+        The level of each instance last frame, of shape (N,), or None for no
+        hysteresis.
+    thresholds : list[float]
+        Screen sizes below which each coarser level is used, descending.
+    hysteresis : float
+        The fraction of each threshold to overshoot by, ie, 0.1.
+
+    Returns
+    -------
+    np.ndarray
+        The level of each instance, of shape (N,), where 0 is full detail.
+
+    """
+
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    if current is None:
+        return np.count_nonzero(sizes[:, None] < thresholds, axis=1)
+
+    # The coarsest level the instance has clearly shrunk past, and the finest
+    # it has not clearly grown out of
+    coarser = np.count_nonzero(sizes[:, None] < thresholds * (1 - hysteresis), axis=1)
+    finer = np.count_nonzero(sizes[:, None] < thresholds * (1 + hysteresis), axis=1)
+    return np.clip(current, coarser, finer)
+
+"""
+LODSelector
+
+Picks the level of detail each visible instance is drawn at from its size on
+screen, as seen by the camera of the current pass, and counts the triangles
+drawn before and after selection.
+"""
+class LODSelector:
+    def __init__(self, thresholds: list[float] = None, hysteresis: float = None):
+        """
+        Initialises the selector with no view, so that everything is drawn at
+        full detail until set_view() is called.
+
+        Parameters
+        ----------
+        thresholds : list[float], optional
+            Screen sizes below which each coarser level is used. The default
+            is None (as configured).
+        hysteresis : float, optional
+            The fraction of each threshold to overshoot by before switching.
+            The default is None (as configured).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.thresholds = thresholds if thresholds is not None else CONFIG["lod_screen_sizes"]
+        self.hysteresis = hysteresis if hysteresis is not None else CONFIG["lod_hysteresis"]
+        self.camera_position = None
+        self.projection_scale = 1.
+
+        # Triangles of the instances drawn, at full detail and at the selected
+        # levels, this frame and in the last frame
+        self.triangles_before = 0
+        self.triangles_after = 0
+        self.last_frame = {"triangles_before": 0, "triangles_after": 0}
+
+    def set_view(self, camera_position: glm.vec3, projection: glm.mat4):
+        """
+        Sets the camera that sizes are measured from.
+
+        Parameters
+        ----------
+        camera_position : glm.vec3
+            The camera position.
+        projection : glm.mat4
+            The camera's projection matrix.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.camera_position = np.array(camera_position, dtype=np.float32)
+        self.projection_scale = abs(projection[1][1])
+
+    def select(self, mesh, visible: np.ndarray = None) -> np.ndarray:
+        """
+        Picks the level of each of a mesh's instances, remembering it on the
+        mesh for hysteresis next frame.
+
+        Parameters
+        ----------
+        mesh : Mesh
+            The mesh, whose transforms are up to date.
+        visible : np.ndarray, optional
+            Boolean mask of the instances to be drawn. The default is None
+            (all).
+
+        Returns
+        -------
+        np.ndarray
+            The level of every instance, of shape (N,), or None if the mesh
+            has no levels of detail, or there is no view.
+
+        """
+
+        full = int(mesh.lod_index_counts[0]) // 3
+        drawn = len(mesh.transforms) if visible is None else int(np.count_nonzero(visible))
+        if self.camera_position is None or len(mesh.lods) < 2:
+            self.record(drawn * full, drawn * full)
+            return None
+
+        # Bounding spheres enclose each instance's world space box
+        centers, extents = mesh.get_world_bounds()
+        sizes = screen_sizes(centers, np.linalg.norm(extents, axis=1), self.camera_position, self.projection_scale)
+
+        # Instances added or removed since last frame start without hysteresis
+        current = mesh.instance_lods
+        if current is not None and len(current) != len(sizes):
+            current = None
+        lods = np.minimum(select_lods(sizes, current, self.thresholds, self.hysteresis), len(mesh.lods) - 1)
+        mesh.instance_lods = lods
+
+        drawn_lods = lods if visible is None else lods[visible]
+        triangles = int(mesh.lod_index_counts[drawn_lods].sum()) // 3
+        self.record(drawn * full, triangles)
+        return lods
+
+    def record(self, before: int, after: int):
+        """
+        Records triangles drawn before and after selection.
+
+        Parameters
+        ----------
+        before : int
+            Triangles at full detail.
+        after : int
+            Triangles at the selected levels.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.triangles_before += before
+        self.triangles_after += after
+        PROFILER.count("triangles_before_lod", before)
+        PROFILER.count("triangles_after_lod", after)
+
+    def new_frame(self):
+        """
+        Stores the counts of the frame just finished, and resets them.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.last_frame = {"triangles_before": self.triangles_before, "triangles_after": self.triangles_after}
+        self.triangles_before = 0
+        self.triangles_after = 0
+
+LOD_SELECTOR = LODSelector()
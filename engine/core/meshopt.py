@@ -0,0 +1,329 @@
+import logging
+import numpy as np
+from collections import deque
+
+# Per-vertex arrays of an Assimp2JSON mesh, and their components per vertex.
+# Texture coordinates are stored per channel, so are handled separately.
+VERTEX_ARRAYS = {
+    "vertices": 3,
+    "normals": 3,
+    "tangents": 3,
+    "bitangents": 3
+}
+
+def compute_acmr(indices: np.ndarray, cache_size: int = 16) -> float:
+    """
+    Computes the average cache miss ratio (ACMR) of a triangle list: the mean
+    number of vertices transformed per triangle, for a FIFO post-transform
+    vertex cache. 3 is the worst possible, and around 0.5 to 0.7 is good.
+
+    Parameters
+    ----------
+    indices : np.ndarray
+        Triangle indices, of any shape.
+    cache_size : int, optional
+        The number of vertices the cache holds. The default is 16.
+
+    Returns
+    -------
+    float
+        The ACMR.
+
+    """
+
+    indices = np.asarray(indices).reshape(-1)
+    if len(indices) < 3:
+        return 0.
+
+    cache = deque()
+    cached = set()
+    misses = 0
+    for vertex in indices.tolist():
+        if vertex in cached:
+            continue
+        misses += 1
+        cache.append(vertex)
+        cached.add(vertex)
+        if len(cache) > cache_size:
+            cached.discard(cache.popleft())
+    return misses / (len(indices) // 3)
+
+def tipsify(indices: np.ndarray, vertex_count: int, cache_size: int = 16) -> (np.ndarray, list[int]):
+    """
+    Reorders triangles for the post-transform vertex cache, with Sander et
+    al.'s Tipsify: triangles are emitted in fans around a vertex, then the
+    next fan is chosen among the vertices just emitted, preferring ones that
+    are still cached.
+
+    Parameters
+    ----------
+    indices : np.ndarray
+        Triangle indices, of any shape.
+    vertex_count : int
+        The number of vertices indexed.
+    cache_size : int, optional
+        The number of vertices the cache holds. The default is 16.
+
+    Returns
+    -------
+    (np.ndarray, list[int])
+        The reordered indices, flat, and the triangle offset at which each
+        cluster starts. Clusters begin wherever the fan could not continue
+        from a recently emitted vertex, so may be reordered freely (ie, for
+        overdraw) at little cost to the cache.
+
+    """
+
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    triangles = indices.reshape(-1, 3)
+    if not len(triangles):
+        return indices, []
+
+    # Triangles using each vertex, in CSR form
+    live = np.bincount(indices, minlength=vertex_count)
+    offsets = np.concatenate([[0], np.cumsum(live)]).tolist()
+    adjacency = (np.argsort(indices, kind="stable") // 3).tolist()
+    live = live.tolist()
+    triangle_list = triangles.tolist()
+
+    # Time each vertex entered the cache. Starting the clock past the cache
+    # size makes every vertex start uncached.
+    cache_time = [0] * vertex_count
+    time = cache_size + 1
+    emitted = [False] * len(triangle_list)
+
+    output = []
+    clusters = [0]
+    dead_end = []
+    cursor = 0
+    fanning = int(indices[0])
+    while fanning >= 0:
+        candidates = []
+        for triangle in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[triangle]:
+                continue
+            emitted[triangle] = True
+            for vertex in triangle_list[triangle]:
+                output.append(vertex)
+                dead_end.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if time - cache_time[vertex] > cache_size:
+                    cache_time[vertex] = time
+                    time += 1
+
+        # Prefer the candidate that stays cached longest while its remaining
+        # triangles are emitted
+        best, best_priority = -1, -1
+        for vertex in candidates:
+            if live[vertex] <= 0:
+                continue
+            priority = 0
+            if time - cache_time[vertex] + 2 * live[vertex] <= cache_size:
+                priority = time - cache_time[vertex]
+            if priority > best_priority:
+                best, best_priority = vertex, priority
+
+        if best >= 0:
+            fanning = best
+            continue
+
+        # Dead end: fall back to recently emitted vertices, then to any
+        # vertex with triangles left, which starts a new cluster
+        while dead_end and best < 0:
+            vertex = dead_end.pop()
+            if live[vertex] > 0:
+                best = vertex
+        while best < 0 and cursor < vertex_count:
+            if live[cursor] > 0:
+                best = cursor
+            cursor += 1
+        if best >= 0 and len(output) // 3 not in clusters:
+            clusters.append(len(output) // 3)
+        fanning = best
+
+    return np.array(output, dtype=np.int64), clusters
+
+def sort_clusters_for_overdraw(indices: np.ndarray, clusters: list[int], positions: np.ndarray) -> np.ndarray:
+    """
+    Reorders triangle clusters so that those facing outwards from the mesh's
+    centre are drawn first, as they are the most likely to occlude the rest
+    of the mesh. Occluded fragments then fail the depth test before shading.
+
+    Parameters
+    ----------
+    indices : np.ndarray
+        Triangle indices, flat.
+    clusters : list[int]
+        The triangle offset at which each cluster starts, as from tipsify().
+    positions : np.ndarray
+        Vertex positions, of shape (N, 3).
+
+    Returns
+    -------
+    np.ndarray
+        The reordered indices, flat.
+
+    """
+
+    triangles = indices.reshape(-1, 3)
+    if len(clusters) < 2:
+        return indices
+
+    corners = positions[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    centroids = corners.mean(axis=1)
+    mesh_centre = np.average(centroids, axis=0, weights=areas) if areas.sum() > 0 else centroids.mean(axis=0)
+
+    # Area weighted normal and centroid of each cluster
+    bounds = clusters + [len(triangles)]
+    scores = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        normal = normals[start:end].sum(axis=0)
+        length = np.linalg.norm(normal)
+        weight = areas[start:end].sum()
+        centroid = (centroids[start:end] * areas[start:end, None]).sum(axis=0) / weight if weight > 0 else centroids[start:end].mean(axis=0)
+        scores.append(np.dot(centroid - mesh_centre, normal / length) if length > 0 else 0.)
+
+    order = np.argsort(-np.array(scores), kind="stable")
+    return np.concatenate([triangles[bounds[i]:bounds[i + 1]] for i in order]).reshape(-1)
+
+def reorder_vertices(indices: np.ndarray, vertex_count: int) -> (np.ndarray, np.ndarray):
+    """
+    Reorders vertices into the order triangles first use them, so vertex
+    fetches walk through memory. Unused vertices move to the end.
+
+    Parameters
+    ----------
+    indices : np.ndarray
+        Triangle indices, flat.
+    vertex_count : int
+        The number of vertices.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The remapped indices, and the new order of the old vertices (ie,
+        new_vertices = old_vertices[order]).
+
+    """
+
+    used, first = np.unique(indices, return_index=True)
+    used = used[np.argsort(first, kind="stable")]
+    unused = np.setdiff1d(np.arange(vertex_count), used, assume_unique=True)
+    order = np.concatenate([used, unused]).astype(np.int64)
+
+    remap = np.empty(vertex_count, dtype=np.int64)
+    remap[order] = np.arange(vertex_count)
+    return remap[indices], order
+
+def optimize_mesh(mesh_data: dict, cache_size: int = 16, overdraw: bool = True, overdraw_threshold: float = 1.05) -> dict:
+    """
+    Optimises a mesh's triangle and vertex order in place: triangles for the
+    vertex cache (and optionally overdraw), then vertices for fetch locality.
+    Meshes that are not triangle lists are left as they are.
+
+    Parameters
+    ----------
+    mesh_data : dict
+        The Assimp2JSON mesh. Arrays may be lists or NumPy arrays.
+    cache_size : int, optional
+        The number of vertices the cache holds. The default is 16.
+    overdraw : bool, optional
+        Whether to also order triangle clusters to reduce overdraw. The
+        default is True.
+    overdraw_threshold : float, optional
+        How much worse the ACMR may become for the sake of overdraw, ie, 1.05
+        allows 5%. The default is 1.05.
+
+    Returns
+    -------
+    dict
+        The mesh's ACMR before and after, or None if it was not optimised.
+
+    """
+
+    faces = np.asarray(mesh_data.get("faces", []))
+    if faces.ndim != 2 or faces.shape[1] != 3 or not len(faces):
+        return None
+
+    positions = np.asarray(mesh_data["vertices"], dtype=np.float32).reshape(-1, 3)
+    vertex_count = len(positions)
+    before = compute_acmr(faces, cache_size)
+
+    # Exporters often already emit a cache friendly order, so only keep the
+    # new order if it is better
+    indices, clusters = tipsify(faces, vertex_count, cache_size)
+    acmr = compute_acmr(indices, cache_size)
+    if acmr > before:
+        indices, clusters, acmr = faces.reshape(-1).astype(np.int64), [], before
+        
+    # Ordering clusters for overdraw costs some cache efficiency at cluster
+    # boundaries, so is only kept within the threshold, and never if worse
+    # than the original order
+    if overdraw and len(clusters) > 1:
+        sorted_indices = sort_clusters_for_overdraw(indices, clusters, positions)
+        if compute_acmr(sorted_indices, cache_size) <= min(acmr * overdraw_threshold, before):
+            indices = sorted_indices
+            
+    indices, order = reorder_vertices(indices, vertex_count)
+
+    # Apply the vertex order to every per-vertex array, keeping its shape
+    for key, size in VERTEX_ARRAYS.items():
+        if key in mesh_data:
+            array = np.asarray(mesh_data[key])
+            if array.size == vertex_count * size:
+                mesh_data[key] = array.reshape(vertex_count, size)[order].reshape(array.shape)
+    if "texturecoords" in mesh_data:
+        array = np.asarray(mesh_data["texturecoords"])
+        channels = array.reshape(len(array), -1) if array.ndim > 1 else array.reshape(1, -1)
+        if channels.shape[1] % vertex_count == 0:
+            channels = channels.reshape(len(channels), vertex_count, -1)[:, order]
+            mesh_data["texturecoords"] = channels.reshape(array.shape)
+
+    mesh_data["faces"] = indices.reshape(-1, 3)
+    after = compute_acmr(indices, cache_size)
+    mesh_data["acmr"] = {"before": before, "after": after}
+    return mesh_data["acmr"]
+
+def optimize_model(data: dict, name: str = "", cache_size: int = 16, overdraw: bool = True, overdraw_threshold: float = 1.05):
+    """
+    Optimises every mesh of an Assimp2JSON model in place, and logs the
+    model's ACMR before and after, weighted by triangle count.
+
+    Parameters
+    ----------
+    data : dict
+        The model dictionary.
+    name : str, optional
+        The model's name, for logging. The default is "".
+    cache_size : int, optional
+        The number of vertices the cache holds. The default is 16.
+    overdraw : bool, optional
+        Whether to also order triangle clusters to reduce overdraw. The
+        default is True.
+    overdraw_threshold : float, optional
+        How much worse the ACMR may become for the sake of overdraw. The
+        default is 1.05.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    before = after = triangles = 0
+    for mesh_data in data["meshes"]:
+        acmr = optimize_mesh(mesh_data, cache_size, overdraw, overdraw_threshold)
+        if acmr is not None:
+            count = len(mesh_data["faces"])
+            before += acmr["before"] * count
+            after += acmr["after"] * count
+            triangles += count
+
+    # Recorded so caches made with other settings are rebuilt
+    data["optimized"] = True
+    data["optimize_settings"] = {"cache_size": cache_size, "overdraw": overdraw}
+    if triangles:
+        logging.info(f"Optimised {name}: ACMR {before / triangles:.3f} -> {after / triangles:.3f} over {triangles} triangles")
@@ -0,0 +1,306 @@
+import os
+import json
+import struct
+import hashlib
+import logging
+import numpy as np
+from engine.config import CONFIG
+from engine.core.assets import get_compiled_asset
+from engine.core.meshopt import optimize_model
+from engine.core.simplify import generate_model_lods
+
+# Parsing Assimp2JSON files is slow, as every vertex component becomes a
+# Python float before being turned into a NumPy array. We therefore keep a
+# binary copy of each model on disk, which can be memory mapped directly.
+#
+# The binary layout is as follows:
+#
+#     magic       4 bytes    b"PGLM"
+#     version     uint32     MODEL_CACHE_VERSION
+#     hash        32 bytes   SHA-256 of the source JSON file
+#     header_len  uint64     Length of the header in bytes
+#     header      JSON       Model metadata and per-mesh array descriptors
+#     arrays      ...        Typed arrays, each aligned to ARRAY_ALIGNMENT
+#
+# Each array descriptor in the header holds the dtype, shape, and byte offset
+# of the array from the start of the file.
+
+MODEL_CACHE_MAGIC = b"PGLM"
+MODEL_CACHE_VERSION = 3
+ARRAY_ALIGNMENT = 16
+
+# Prefix before the JSON header: magic, version, hash, header length
+PREFIX = struct.Struct("<4sI32sQ")
+
+# Mesh array keys we store in binary, and the dtypes to store them as
+MESH_ARRAYS = {
+    "vertices": np.float32,
+    "normals": np.float32,
+    "tangents": np.float32,
+    "bitangents": np.float32,
+    "texturecoords": np.float32,
+    "faces": np.uint32
+}
+
+def hash_file(path: str) -> bytes:
+    """
+    Computes the SHA-256 digest of a file's contents.
+
+    Parameters
+    ----------
+    path : str
+        The path to the file.
+
+    Returns
+    -------
+    bytes
+        The 32 byte digest.
+
+    """
+
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).digest()
+
+def get_cache_path(path: str) -> str:
+    """
+    Returns the path of the binary cache file for a model source file.
+
+    Parameters
+    ----------
+    path : str
+        The path to the model JSON source file.
+
+    Returns
+    -------
+    str
+        The path to the binary cache file.
+
+    """
+
+    # Flatten the relative source path into a single file name, so models
+    # with the same name in different directories do not collide
+    name = os.path.normpath(path).replace(os.sep, "_").replace(":", "")
+    return os.path.join(CONFIG["model_cache_dir"], f"{os.path.splitext(name)[0]}.pglm")
+
+def write_model_cache(cache_path: str, data: dict, digest: bytes):
+    """
+    Writes a model dictionary (as loaded from Assimp2JSON) to the binary
+    format.
+
+    Parameters
+    ----------
+    cache_path : str
+        The path to write the binary file to.
+    data : dict
+        The model dictionary. Mesh arrays may be lists or NumPy arrays.
+    digest : bytes
+        The SHA-256 digest of the source JSON file.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    arrays = []
+    meshes = []
+
+    # Split each mesh into its metadata and its typed arrays
+    for mesh_data in data["meshes"]:
+        meta = {"arrays": {}}
+        for key, value in mesh_data.items():
+            if key in MESH_ARRAYS or isinstance(value, np.ndarray):
+                dtype = MESH_ARRAYS.get(key, getattr(value, "dtype", np.float32))
+                array = np.ascontiguousarray(np.asarray(value, dtype=dtype))
+                meta["arrays"][key] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+                arrays.append((meta["arrays"][key], array))
+            else:
+                meta[key] = value
+        meshes.append(meta)
+
+    # Everything other than the meshes is kept in the header as is
+    header = {key: value for key, value in data.items() if key != "meshes"}
+    header["meshes"] = meshes
+
+    # Offsets depend on the header length, which depends on the offsets. We
+    # therefore reserve space for the offsets with a fixed width placeholder,
+    # measure, then fill them in.
+    for descriptor, _ in arrays:
+        descriptor["offset"] = 0
+    placeholder = len(json.dumps(header).encode()) + 24 * len(arrays)
+
+    offset = PREFIX.size + placeholder
+    for descriptor, array in arrays:
+        offset += -offset % ARRAY_ALIGNMENT
+        descriptor["offset"] = offset
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode().ljust(placeholder)
+
+    # Write to a temporary file and move it into place, so an interrupted
+    # write never leaves a truncated cache behind
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(PREFIX.pack(MODEL_CACHE_MAGIC, MODEL_CACHE_VERSION, digest, len(header_bytes)))
+        file.write(header_bytes)
+        for descriptor, array in arrays:
+            file.write(b"\0" * (descriptor["offset"] - file.tell()))
+            file.write(array.tobytes())
+    os.replace(temp_path, cache_path)
+
+def read_model_cache(cache_path: str, digest: bytes = None) -> dict:
+    """
+    Reads a model dictionary from the binary format. Arrays are views into a
+    read-only memory map of the file, so no copying or parsing takes place.
+
+    Parameters
+    ----------
+    cache_path : str
+        The path to the binary file.
+    digest : bytes, optional
+        The expected SHA-256 digest of the source JSON file. If given and the
+        stored digest differs, the cache is considered stale. The default is
+        None.
+
+    Returns
+    -------
+    dict
+        The model dictionary, or None if the cache is missing or stale.
+
+    """
+
+    if not os.path.exists(cache_path):
+        return None
+
+    # Check the prefix before mapping the whole file
+    with open(cache_path, "rb") as file:
+        prefix = file.read(PREFIX.size)
+        if len(prefix) < PREFIX.size:
+            return None
+        magic, version, stored_digest, header_length = PREFIX.unpack(prefix)
+        if magic != MODEL_CACHE_MAGIC or version != MODEL_CACHE_VERSION:
+            return None
+        if digest is not None and stored_digest != digest:
+            return None
+        header = json.loads(file.read(header_length))
+
+    # Map the file, then replace each descriptor with a view into the map
+    buffer = np.memmap(cache_path, dtype=np.uint8, mode="r")
+    for mesh_data in header["meshes"]:
+        for key, descriptor in mesh_data.pop("arrays").items():
+            dtype = np.dtype(descriptor["dtype"])
+            count = int(np.prod(descriptor["shape"]))
+            start = descriptor["offset"]
+            mesh_data[key] = np.frombuffer(
+                buffer, dtype=dtype, count=count, offset=start
+            ).reshape(descriptor["shape"])
+
+    return header
+
+def prepare_model(data: dict, name: str = ""):
+    """
+    Applies load time processing to a freshly parsed model, before it is
+    cached: if configured, reorders each mesh's triangles and vertices for the
+    GPU's vertex cache, then generates simplified levels of detail.
+
+    Parameters
+    ----------
+    data : dict
+        The model dictionary, modified in place.
+    name : str, optional
+        The model's name, for logging. The default is "".
+
+    Returns
+    -------
+    None.
+
+    """
+
+    if CONFIG["optimize_meshes"]:
+        optimize_model(data, name, CONFIG["vertex_cache_size"], CONFIG["optimize_overdraw"])
+
+    # Levels index the optimised vertices, so are generated after
+    if CONFIG["lod_ratios"]:
+        generate_model_lods(data, CONFIG["lod_ratios"], CONFIG["lod_min_triangles"], name, CONFIG["vertex_cache_size"])
+
+def is_prepared(data: dict) -> bool:
+    """
+    Checks whether a cached model was processed with the current settings:
+    every setting prepare_model() reads must match those recorded.
+
+    Parameters
+    ----------
+    data : dict
+        The cached model dictionary.
+
+    Returns
+    -------
+    bool
+        True if the model is up to date with the configuration.
+
+    """
+
+    optimize_settings = {
+        "cache_size": CONFIG["vertex_cache_size"],
+        "overdraw": CONFIG["optimize_overdraw"]
+    } if CONFIG["optimize_meshes"] else None
+    lod_settings = {
+        "ratios": CONFIG["lod_ratios"],
+        "min_triangles": CONFIG["lod_min_triangles"],
+        "cache_size": CONFIG["vertex_cache_size"]
+    } if CONFIG["lod_ratios"] else None
+    return (
+        data.get("optimized", False) == CONFIG["optimize_meshes"]
+        and data.get("optimize_settings") == optimize_settings
+        and data.get("lod_settings") == lod_settings
+    )
+
+def load_model(path: str) -> dict:
+    """
+    Loads a model dictionary, from its compiled artifact or binary cache where
+    either is up to date, otherwise from its JSON source, rebuilding the cache.
+
+    Parameters
+    ----------
+    path : str
+        The path to the model JSON source file.
+
+    Returns
+    -------
+    dict
+        The model dictionary.
+
+    """
+
+    # Artifacts from the offline asset compiler need no hash check, as the
+    # manifest has already checked the source is unchanged
+    artifact = get_compiled_asset(path)
+    if artifact:
+        data = read_model_cache(artifact)
+        if data is not None and is_prepared(data):
+            logging.info(f"Loaded {path} from compiled assets")
+            return data
+
+    cache_path = get_cache_path(path)
+    digest = hash_file(path)
+
+    data = read_model_cache(cache_path, digest)
+    if data is not None and is_prepared(data):
+        logging.info(f"Loaded {path} from model cache")
+        return data
+
+    # Cache is missing or stale, so parse the source and rebuild it
+    logging.info(f"Rebuilding model cache for {path}")
+    with open(path) as file:
+        data = json.load(file)
+    prepare_model(data, path)
+
+    try:
+        write_model_cache(cache_path, data, digest)
+    except OSError as error:
+        logging.warning(f"Could not write model cache {cache_path}: {error}")
+        return data
+
+    # Read back the cache we just wrote, so arrays have the same dtypes
+    # whether or not the model was cached
+    return read_model_cache(cache_path, digest)
@@ -0,0 +1,499 @@
+import ctypes
+import logging
+import numpy as np
+from OpenGL.GL import *
+from engine.core.arena import GeometryArena
+from engine.core.culling import CULLING_STATS, cull_aabbs
+from engine.core.lod import LOD_SELECTOR, screen_sizes, select_lods
+from engine.core.profiler import PROFILER
+
+# Shader storage buffer bindings, as declared in vertex_mdi.vs and
+# depth_vertex_mdi.vs
+INSTANCE_TRANSFORMS_BINDING = 0
+DRAW_INSTANCES_BINDING = 1
+DRAW_MATERIALS_BINDING = 2
+MATERIALS_BINDING = 3
+
+# One indirect draw, as read by glMultiDrawElementsIndirect
+DRAW_COMMAND_DTYPE = np.dtype([
+    ("count", np.uint32),
+    ("instance_count", np.uint32),
+    ("first_index", np.uint32),
+    ("base_vertex", np.int32),
+    ("base_instance", np.uint32)
+])
+
+# Material constants, as the MaterialData struct in vertex_mdi.vs
+MATERIAL_DTYPE = np.dtype([
+    ("shininess", np.float32),
+    ("height_scale", np.float32)
+])
+
+"""
+MultiDrawRenderer
+
+Draws every opaque mesh of a scene with a handful of multi-draw indirect
+calls, one per set of material textures, from a single geometry arena.
+
+Every instance's model matrix lives in one storage buffer. Each pass culls and
+picks levels of detail for all instances at once, then sorts the visible ones
+into draw commands, one per mesh and level, whose base instance points at
+their run of instance indices in a second storage buffer. Python work per pass
+is a few array operations, plus a loop over texture sets.
+
+Blended meshes are left to the render queue, as they must be sorted back to
+front.
+"""
+class MultiDrawRenderer:
+    def __init__(self):
+        """
+        Creates the arena and storage buffers, empty until build().
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.arena = GeometryArena()
+
+        # Each mesh's arena ranges, kept across builds so unchanged meshes
+        # are not copied again
+        self.allocations = {}
+
+        # Buffers as [buffer, capacity], by name
+        self.buffers = {}
+        for name in ("transforms", "draw_instances", "draw_materials", "materials", "commands"):
+            self.buffers[name] = [glGenBuffers(1), 0]
+
+        self.objects = None
+        self.meshes = []
+        self.last_frame = {}
+
+    def upload(self, name: str, target: int, data: np.ndarray):
+        """
+        Uploads data to a buffer, replacing its storage. Storage is orphaned
+        rather than overwritten, so a pass does not wait on the GPU still
+        reading the previous pass's data.
+
+        Parameters
+        ----------
+        name : str
+            The buffer's name.
+        target : int
+            The target to upload through, ie, GL_SHADER_STORAGE_BUFFER.
+        data : np.ndarray
+            The data.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        buffer = self.buffers[name]
+        glBindBuffer(target, buffer[0])
+        glBufferData(target, max(data.nbytes, 4), data if data.nbytes else None, GL_STREAM_DRAW)
+        buffer[1] = data.nbytes
+
+    def build(self, objects: list):
+        """
+        Copies the meshes of the given objects into the arena, and gathers
+        their instances, bounds, levels of detail and materials into arrays.
+
+        Parameters
+        ----------
+        objects : list
+            The scene's objects.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.objects = list(objects)
+        self.meshes = [mesh for obj in self.objects for mesh in obj.meshes]
+
+        # Free the ranges of meshes no longer drawn, then allocate new ones
+        current = {id(mesh) for mesh in self.meshes}
+        for key in [key for key in self.allocations if key not in current]:
+            _, base_vertex, vertex_count, first_index, index_count = self.allocations.pop(key)
+            self.arena.free(base_vertex, vertex_count, first_index, index_count)
+        for mesh in self.meshes:
+            if id(mesh) not in self.allocations:
+                base_vertex, first_index = self.arena.allocate(mesh)
+                self.allocations[id(mesh)] = (mesh, base_vertex, mesh.vertices.size // 3, first_index, len(mesh.indices))
+
+        # Each level's first index and index count, by mesh. Meshes with
+        # fewer levels repeat their coarsest.
+        self.levels = max((len(mesh.lods) for mesh in self.meshes), default=1)
+        count = len(self.meshes)
+        self.first_index = np.zeros((count, self.levels), dtype=np.uint32)
+        self.index_count = np.zeros((count, self.levels), dtype=np.uint32)
+        self.base_vertex = np.zeros(count, dtype=np.int32)
+        self.level_count = np.zeros(count, dtype=np.int64)
+        for index, mesh in enumerate(self.meshes):
+            _, base_vertex, _, first_index, _ = self.allocations[id(mesh)]
+            lods = mesh.lods + [mesh.lods[-1]] * (self.levels - len(mesh.lods))
+            self.first_index[index] = [first_index + offset // mesh.indices.itemsize for offset, _ in lods]
+            self.index_count[index] = [index_count for _, index_count in lods]
+            self.base_vertex[index] = base_vertex
+            self.level_count[index] = len(mesh.lods)
+
+        # Material constants by material, and texture sets by mesh. Meshes
+        # of one texture set are drawn by one call.
+        materials = {}
+        texture_sets = {}
+        self.mesh_material = np.zeros(count, dtype=np.uint32)
+        self.mesh_batch = np.zeros(count, dtype=np.int64)
+        self.batch_meshes = []
+        for index, mesh in enumerate(self.meshes):
+            self.mesh_material[index] = materials.setdefault(id(mesh.material), len(materials))
+            batch = texture_sets.setdefault(mesh.material.textures, len(texture_sets))
+            if batch == len(self.batch_meshes):
+                self.batch_meshes.append(mesh)
+            self.mesh_batch[index] = batch
+
+        material_data = np.zeros(len(materials), dtype=MATERIAL_DTYPE)
+        for index, mesh in enumerate(self.meshes):
+            material_data[self.mesh_material[index]] = (mesh.material.shininess, mesh.material.height_scale)
+        self.upload("materials", GL_SHADER_STORAGE_BUFFER, material_data)
+
+        # Instances of every mesh, one after another, and the range of each
+        # object's instances
+        instance_counts = np.array([len(mesh.get_instance_data()) for mesh in self.meshes], dtype=np.int64)
+        self.mesh_start = np.concatenate([[0], np.cumsum(instance_counts)])
+        self.instance_mesh = np.repeat(np.arange(count), instance_counts)
+        self.object_ranges = {}
+        start = 0
+        for obj in self.objects:
+            end = start + sum(len(mesh.get_instance_data()) for mesh in obj.meshes)
+            self.object_ranges[id(obj)] = (start, end)
+            start = end
+
+        self.refresh_instances()
+        self.lods = np.zeros(len(self.instance_mesh), dtype=np.int64)
+
+        # Only dynamic objects' transforms are checked for changes each frame
+        self.dynamic = [
+            (index, mesh) for index, mesh in enumerate(self.meshes)
+            if any(mesh in obj.meshes for obj in self.objects if obj.dynamic)
+        ]
+        self.versions = {index: mesh.instance_version for index, mesh in self.dynamic}
+
+        stats = self.arena.stats()
+        logging.info(
+            f"Built multi-draw renderer: {count} meshes, {len(self.instance_mesh)} instances, "
+            f"{len(self.batch_meshes)} texture sets, {stats['vertex_bytes']['used']} vertex bytes, "
+            f"{stats['index_bytes']['used']} index bytes"
+        )
+
+    def refresh_instances(self):
+        """
+        Gathers every instance's bounds and model matrix, and uploads the
+        matrices.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        bounds = [mesh.get_world_bounds() for mesh in self.meshes]
+        self.centers = np.concatenate([centers for centers, _ in bounds]) if bounds else np.zeros((0, 3))
+        self.extents = np.concatenate([extents for _, extents in bounds]) if bounds else np.zeros((0, 3))
+        self.radii = np.linalg.norm(self.extents, axis=1)
+        self.transforms = np.concatenate([mesh.get_instance_data() for mesh in self.meshes]).astype(np.float32) if bounds else np.zeros((0, 4, 4), dtype=np.float32)
+        self.upload("transforms", GL_SHADER_STORAGE_BUFFER, self.transforms)
+
+    def update(self, objects: list):
+        """
+        Brings the renderer up to date with the scene: rebuilding if objects
+        or instance counts changed, or otherwise uploading the transforms of
+        dynamic meshes that moved.
+
+        Parameters
+        ----------
+        objects : list
+            The scene's objects.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.objects != objects:
+            self.build(objects)
+            return
+
+        for index, mesh in self.dynamic:
+            centers, extents = mesh.get_world_bounds()
+            if mesh.instance_version == self.versions[index]:
+                continue
+            self.versions[index] = mesh.instance_version
+            start, end = self.mesh_start[index], self.mesh_start[index + 1]
+            if len(centers) != end - start:
+                self.build(objects)
+                return
+
+            # Only this mesh's slice of the transform buffer changes
+            self.centers[start:end] = centers
+            self.extents[start:end] = extents
+            self.radii[start:end] = np.linalg.norm(extents, axis=1)
+            self.transforms[start:end] = mesh.get_instance_data()
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.buffers["transforms"][0])
+            glBufferSubData(GL_SHADER_STORAGE_BUFFER, int(start) * 64, int(end - start) * 64, self.transforms[start:end])
+
+    def blended(self) -> np.ndarray:
+        """
+        Returns which meshes are blended. Checked every frame, as whether a
+        material is blended is only known once its texture loads.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask of meshes, of shape (M,).
+
+        """
+
+        return np.array([mesh.material.blended for mesh in self.meshes], dtype=bool)
+
+    def blended_meshes(self) -> list:
+        """
+        Returns the meshes left for the render queue to draw.
+
+        Returns
+        -------
+        list
+            The blended meshes.
+
+        """
+
+        return [mesh for mesh in self.meshes if mesh.material.blended]
+
+    def cull(self, candidates: np.ndarray, frustum: np.ndarray = None) -> np.ndarray:
+        """
+        Culls instances against a frustum, recording how many were culled.
+
+        Parameters
+        ----------
+        candidates : np.ndarray
+            Indices of the instances to consider.
+        frustum : np.ndarray, optional
+            Frustum planes. The default is None (no culling).
+
+        Returns
+        -------
+        np.ndarray
+            Indices of the visible instances.
+
+        """
+
+        if frustum is None or not len(candidates):
+            visible = candidates
+        else:
+            visible = candidates[cull_aabbs(frustum, self.centers[candidates], self.extents[candidates])]
+        CULLING_STATS.record(len(visible), len(candidates) - len(visible))
+        return visible
+
+    def select_lods(self, instances: np.ndarray) -> np.ndarray:
+        """
+        Picks the level of each visible instance, as LOD_SELECTOR does per
+        mesh, but for every mesh at once.
+
+        Parameters
+        ----------
+        instances : np.ndarray
+            Indices of the visible instances.
+
+        Returns
+        -------
+        np.ndarray
+            The level of each, of shape (len(instances),).
+
+        """
+
+        meshes = self.instance_mesh[instances]
+        full = int(self.index_count[meshes, 0].sum()) // 3
+        if LOD_SELECTOR.camera_position is None or self.levels < 2:
+            LOD_SELECTOR.record(full, full)
+            return np.zeros(len(instances), dtype=np.int64)
+
+        sizes = screen_sizes(self.centers[instances], self.radii[instances], LOD_SELECTOR.camera_position, LOD_SELECTOR.projection_scale)
+        lods = select_lods(sizes, self.lods[instances], LOD_SELECTOR.thresholds, LOD_SELECTOR.hysteresis)
+        lods = np.minimum(lods, self.level_count[meshes] - 1)
+        self.lods[instances] = lods
+        LOD_SELECTOR.record(full, int(self.index_count[meshes, lods].sum()) // 3)
+        return lods
+
+    def build_commands(self, instances: np.ndarray, lods: np.ndarray, batches: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Sorts instances by batch, mesh and level, uploads one draw command per
+        run, and the instance indices each run reads.
+
+        Parameters
+        ----------
+        instances : np.ndarray
+            Indices of the instances to draw.
+        lods : np.ndarray
+            The level of each.
+        batches : np.ndarray
+            The batch of each.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray)
+            The batch of each run of commands, and the first command of each
+            run, followed by the total number of commands.
+
+        """
+
+        meshes = self.instance_mesh[instances]
+        keys = (batches * len(self.meshes) + meshes) * self.levels + lods
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+
+        # Each distinct key is one command, its instances contiguous
+        firsts = np.flatnonzero(np.diff(keys, prepend=-1))
+        key = keys[firsts]
+        lod = key % self.levels
+        mesh = (key // self.levels) % len(self.meshes)
+        batch = key // (self.levels * len(self.meshes))
+
+        commands = np.zeros(len(firsts), dtype=DRAW_COMMAND_DTYPE)
+        commands["count"] = self.index_count[mesh, lod]
+        commands["instance_count"] = np.diff(firsts, append=len(keys))
+        commands["first_index"] = self.first_index[mesh, lod]
+        commands["base_vertex"] = self.base_vertex[mesh]
+        commands["base_instance"] = firsts
+
+        self.upload("commands", GL_DRAW_INDIRECT_BUFFER, commands)
+        self.upload("draw_instances", GL_SHADER_STORAGE_BUFFER, instances[order].astype(np.uint32))
+        self.upload("draw_materials", GL_SHADER_STORAGE_BUFFER, self.mesh_material[mesh])
+
+        starts = np.flatnonzero(np.diff(batch, prepend=-1))
+        return batch[starts], np.append(starts, len(commands))
+
+    def bind(self):
+        """
+        Binds the arena, storage buffers and indirect buffer.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.arena.bind()
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, INSTANCE_TRANSFORMS_BINDING, self.buffers["transforms"][0])
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, DRAW_INSTANCES_BINDING, self.buffers["draw_instances"][0])
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, DRAW_MATERIALS_BINDING, self.buffers["draw_materials"][0])
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, MATERIALS_BINDING, self.buffers["materials"][0])
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.buffers["commands"][0])
+
+    def multi_draw(self, first: int, count: int):
+        """
+        Issues one multi-draw indirect call, of uploaded commands.
+
+        Parameters
+        ----------
+        first : int
+            The first command.
+        count : int
+            The number of commands.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        PROFILER.count("draw_calls")
+        PROFILER.count("indirect_commands", count)
+        glMultiDrawElementsIndirect(GL_TRIANGLES, GL_UNSIGNED_INT, ctypes.c_void_p(first * DRAW_COMMAND_DTYPE.itemsize), count, 0)
+
+    def draw(self, program, frustum: np.ndarray = None):
+        """
+        Draws every visible opaque instance with the lighting program, one
+        call per texture set. The program's shadow and light uniforms must
+        already be set.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The multi-draw lighting program.
+        frustum : np.ndarray, optional
+            Camera frustum planes. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        opaque = ~self.blended()
+        instances = self.cull(np.flatnonzero(opaque[self.instance_mesh]), frustum)
+        self.last_frame = {"instances": len(instances), "commands": 0, "draw_calls": 0, "arena": self.arena.stats()}
+        if not len(instances):
+            return
+
+        lods = self.select_lods(instances)
+        batches, starts = self.build_commands(instances, lods, self.mesh_batch[self.instance_mesh[instances]])
+
+        program.use()
+        self.bind()
+        for index, batch in enumerate(batches):
+            self.batch_meshes[batch].bind_material(program)
+            program.setInt("drawOffset", int(starts[index]))
+            self.multi_draw(int(starts[index]), int(starts[index + 1] - starts[index]))
+        self.last_frame["commands"] = int(starts[-1])
+        self.last_frame["draw_calls"] = len(batches)
+
+    def draw_depth(self, program, objects: list, frustum: np.ndarray = None):
+        """
+        Draws the instances of the given objects depth only, in one call, into
+        the bound shadow map. The program must be in use.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The multi-draw depth program.
+        objects : list
+            The shadow casters, among the objects built from.
+        frustum : np.ndarray, optional
+            Frustum planes to cull casters against. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        ranges = [self.object_ranges[id(obj)] for obj in objects]
+        candidates = np.concatenate([np.arange(start, end) for start, end in ranges]) if ranges else np.zeros(0, dtype=np.int64)
+        instances = self.cull(candidates, frustum)
+        if not len(instances):
+            return
+
+        # Shadows are drawn at full detail
+        zeros = np.zeros(len(instances), dtype=np.int64)
+        _, starts = self.build_commands(instances, zeros, zeros)
+        self.bind()
+        self.multi_draw(0, int(starts[-1]))
+
+    def __del__(self):
+        """
+        On all references descoping, delete the buffers.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        try:
+            glDeleteBuffers(len(self.buffers), [buffer for buffer, _ in self.buffers.values()])
+        except:
+            pass
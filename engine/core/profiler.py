@@ -0,0 +1,361 @@
+import json
+import ctypes
+import logging
+from time import perf_counter_ns
+from collections import deque
+from OpenGL.GL import *
+from engine.config import CONFIG
+
+"""
+ProfilerSection
+
+Context manager timing one named section of a frame on the CPU and, where
+requested, on the GPU.
+"""
+class ProfilerSection:
+    def __init__(self, profiler, name: str, gpu: bool):
+        """
+        Initialises the section.
+
+        Parameters
+        ----------
+        profiler : Profiler
+            The owning profiler.
+        name : str
+            The section name.
+        gpu : bool
+            Whether to time the section on the GPU too.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.profiler = profiler
+        self.name = name
+        self.gpu = gpu
+
+    def __enter__(self):
+        self.profiler.begin_section(self.name, self.gpu)
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.end_section()
+
+"""
+Profiler
+
+Records per-frame CPU and GPU time and call counts for named sections (ie,
+render passes), keeping a rolling history for summaries and trace export.
+
+GPU time is measured with GL_TIME_ELAPSED queries. Results are only read once
+the GPU reports them available, usually a few frames later, so profiling
+never stalls the pipeline waiting on the GPU. Queries are recycled from a
+pool once read.
+"""
+class Profiler:
+    def __init__(self, enabled: bool = True, history: int = 600):
+        """
+        Initialises the profiler.
+
+        Parameters
+        ----------
+        enabled : bool, optional
+            Whether to record anything. The default is True.
+        history : int, optional
+            Number of frames to keep. The default is 600.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.enabled = enabled
+        self.frames = deque(maxlen=history)
+        self.frame = None
+        self.frame_index = 0
+
+        # Stack of open sections, as (name, record, start time, query)
+        self.stack = []
+
+        # Free query objects, and queries awaiting results as (record, query)
+        self.free_queries = []
+        self.pending_queries = []
+
+    def section(self, name: str, gpu: bool = True) -> ProfilerSection:
+        """
+        Returns a context manager timing a section of the current frame.
+
+        Parameters
+        ----------
+        name : str
+            The section name.
+        gpu : bool, optional
+            Whether to time the section on the GPU too. GPU timers cannot
+            nest, so nested sections are only timed on the CPU. The default
+            is True.
+
+        Returns
+        -------
+        ProfilerSection
+            The context manager.
+
+        """
+
+        return ProfilerSection(self, name, gpu)
+
+    def begin_frame(self):
+        """
+        Starts recording a new frame, and collects any GPU results that have
+        become available.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if not self.enabled:
+            return
+
+        self.collect_queries()
+        self.frame = {
+            "frame": self.frame_index,
+            "start_ns": perf_counter_ns(),
+            "cpu_ns": 0,
+            "sections": {},
+            "counters": {}
+        }
+
+    def end_frame(self):
+        """
+        Finishes recording the current frame.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if not self.enabled or self.frame is None:
+            return
+
+        self.frame["cpu_ns"] = perf_counter_ns() - self.frame["start_ns"]
+        self.frames.append(self.frame)
+        self.frame = None
+        self.frame_index += 1
+
+    def begin_section(self, name: str, gpu: bool):
+        """
+        Starts timing a section. Prefer Profiler.section().
+
+        Parameters
+        ----------
+        name : str
+            The section name.
+        gpu : bool
+            Whether to time the section on the GPU too.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if not self.enabled or self.frame is None:
+            return
+
+        record = self.frame["sections"].setdefault(name, {
+            "start_ns": perf_counter_ns() - self.frame["start_ns"],
+            "cpu_ns": 0,
+            "gpu_ns": None,
+            "counters": {}
+        })
+
+        # Only one GL_TIME_ELAPSED query may be active at a time
+        query = None
+        if gpu and not any(open_query for *_, open_query in self.stack):
+            query = self.free_queries.pop() if self.free_queries else int(glGenQueries(1)[0])
+            glBeginQuery(GL_TIME_ELAPSED, query)
+
+        self.stack.append((name, record, perf_counter_ns(), query))
+
+    def end_section(self):
+        """
+        Stops timing the innermost open section.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if not self.enabled or not self.stack:
+            return
+
+        _, record, start, query = self.stack.pop()
+        record["cpu_ns"] += perf_counter_ns() - start
+        if query is not None:
+            glEndQuery(GL_TIME_ELAPSED)
+            self.pending_queries.append((record, query))
+
+    def count(self, counter: str, amount: int = 1):
+        """
+        Increments a counter for the current frame, and for the innermost
+        open section.
+
+        Parameters
+        ----------
+        counter : str
+            The counter name, ie, "draw_calls".
+        amount : int, optional
+            The amount to add. The default is 1.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.frame is None:
+            return
+
+        counters = self.frame["counters"]
+        counters[counter] = counters.get(counter, 0) + amount
+        if self.stack:
+            counters = self.stack[-1][1]["counters"]
+            counters[counter] = counters.get(counter, 0) + amount
+
+    def collect_queries(self):
+        """
+        Reads the results of any GPU timer queries that are available,
+        without waiting for those that are not.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Results are written to out-parameters
+        available = ctypes.c_int()
+        elapsed = ctypes.c_uint64()
+        still_pending = []
+        for record, query in self.pending_queries:
+            glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE, available)
+            if available.value:
+                glGetQueryObjectui64v(query, GL_QUERY_RESULT, elapsed)
+                record["gpu_ns"] = (record["gpu_ns"] or 0) + elapsed.value
+                self.free_queries.append(query)
+            else:
+                still_pending.append((record, query))
+        self.pending_queries = still_pending
+
+    def summary(self) -> dict:
+        """
+        Averages the recorded history.
+
+        Returns
+        -------
+        dict
+            Frame count, mean frame CPU time, and per section mean CPU and GPU
+            milliseconds and mean counters per frame.
+
+        """
+
+        frames = list(self.frames)
+        if not frames:
+            return {"frames": 0, "cpu_ms": 0, "sections": {}, "counters": {}}
+
+        sections = {}
+        counters = {}
+        for frame in frames:
+            for counter, value in frame["counters"].items():
+                counters[counter] = counters.get(counter, 0) + value
+            for name, record in frame["sections"].items():
+                section = sections.setdefault(name, {"cpu_ns": 0, "gpu_ns": 0, "gpu_frames": 0, "frames": 0, "counters": {}})
+                section["frames"] += 1
+                section["cpu_ns"] += record["cpu_ns"]
+                if record["gpu_ns"] is not None:
+                    section["gpu_ns"] += record["gpu_ns"]
+                    section["gpu_frames"] += 1
+                for counter, value in record["counters"].items():
+                    section["counters"][counter] = section["counters"].get(counter, 0) + value
+
+        return {
+            "frames": len(frames),
+            "cpu_ms": sum(frame["cpu_ns"] for frame in frames) / len(frames) / 1e6,
+            "sections": {
+                name: {
+                    "cpu_ms": section["cpu_ns"] / section["frames"] / 1e6,
+                    "gpu_ms": section["gpu_ns"] / section["gpu_frames"] / 1e6 if section["gpu_frames"] else None,
+                    "counters": {key: value / section["frames"] for key, value in section["counters"].items()}
+                }
+                for name, section in sections.items()
+            },
+            "counters": {key: value / len(frames) for key, value in counters.items()}
+        }
+
+    def log_summary(self):
+        """
+        Logs a summary of the recorded history, one line per section.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        summary = self.summary()
+        logging.info(f"Profile over {summary['frames']} frames: {summary['cpu_ms']:.2f} ms CPU per frame")
+        for name, section in summary["sections"].items():
+            gpu = f"{section['gpu_ms']:.2f} ms" if section["gpu_ms"] is not None else "n/a"
+            counters = ", ".join(f"{key} {value:.0f}" for key, value in sorted(section["counters"].items()))
+            logging.info(f"  {name:<10} CPU {section['cpu_ms']:.2f} ms  GPU {gpu}  {counters}")
+
+    def export_chrome_trace(self, path: str):
+        """
+        Writes the recorded history as a Chrome trace (chrome://tracing or
+        Perfetto). CPU sections are on thread 0 and GPU sections on thread 1,
+        aligned to the start of their CPU section.
+
+        Parameters
+        ----------
+        path : str
+            The path to write the JSON trace to.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": 0, "args": {"name": "CPU"}},
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": 1, "args": {"name": "GPU"}}
+        ]
+        for frame in self.frames:
+            events.append({
+                "name": "frame", "cat": "frame", "ph": "X", "pid": 0, "tid": 0,
+                "ts": frame["start_ns"] / 1000, "dur": frame["cpu_ns"] / 1000,
+                "args": dict(frame["counters"], frame=frame["frame"])
+            })
+            for name, record in frame["sections"].items():
+                start = (frame["start_ns"] + record["start_ns"]) / 1000
+                events.append({
+                    "name": name, "cat": "cpu", "ph": "X", "pid": 0, "tid": 0,
+                    "ts": start, "dur": record["cpu_ns"] / 1000, "args": record["counters"]
+                })
+                if record["gpu_ns"] is not None:
+                    events.append({
+                        "name": name, "cat": "gpu", "ph": "X", "pid": 0, "tid": 1,
+                        "ts": start, "dur": record["gpu_ns"] / 1000
+                    })
+
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        logging.info(f"Wrote Chrome trace of {len(self.frames)} frames to {path}")
+
+PROFILER = Profiler(CONFIG["profiler_enabled"], CONFIG["profiler_history"])
@@ -1,7 +1,29 @@
 import glm
 import logging
+import numpy as np
 from OpenGL.GL import *
 from OpenGL.GL import shaders
+from engine.core.assets import get_compiled_asset
+from engine.core.profiler import PROFILER
+from engine.core.state import GL_STATE
+from engine.core.uniformbuffer import bind_uniform_blocks
+
+# Texture unit of every sampler, by uniform name: the material maps as bound
+# by Mesh.bind_material, the shadow map array as bound by ShadowsEffect.end,
+# and the light buffers as bound by LightClusters.bind. Samplers of different
+# types must not share a unit, even while unused, or the program fails
+# validation, so each is assigned its unit at link time.
+SAMPLER_UNITS = {
+    "skybox": 0,
+    "mat.diffuseMap": 1,
+    "mat.normalMap": 2,
+    "mat.specularMap": 3,
+    "mat.depthMap": 4,
+    "shadowMap": 10,
+    "pointLightData": 11,
+    "clusterData": 12,
+    "clusterLightIndices": 13
+}
 
 """
 ShaderProgram
@@ -10,7 +32,7 @@ Handles loading, linking, and compiling a shader from source. Holds a reference
 to the compiled shader for future use.
 """
 class ShaderProgram:
-    def __init__(self, vertPath: str, fragPath: str):
+    def __init__(self, vertPath: str, fragPath: str, defines: list[str] = None):
         """
         Constructor for a shader program. Handles source loading and 
         compilation, ready to be bound via ShaderProgram.use()
@@ -21,12 +43,25 @@ class ShaderProgram:
             Path to the vertex shader
         fragPath : str
             Path to the fragment shader
+        defines : list[str], optional
+            Macros to define in both shaders, ie, to compile a variant of a
+            shared source. The default is None.
 
         """
         # Shader ID as 0 to start (unassigned)
         self.id = 0
         
+        # Uniform name to location map, filled after linking, and the last
+        # value uploaded to each location, so repeated values can be skipped
+        self.uniform_locations = {}
+        self.uniform_values = {}
+        
+        # Counts of uniform set calls, and of those skipped as unchanged
+        self.uniform_calls = 0
+        self.uniform_skipped = 0
+        
         # Load source files from paths
+        self.defines = defines or []
         self.vertSource = self.loadSource(vertPath)
         self.fragSource = self.loadSource(fragPath)
         
@@ -48,10 +83,37 @@ class ShaderProgram:
             Contents of the file at the path specified.
 
         """
+        # Prefer the preprocessed source from the asset compiler
+        artifact = get_compiled_asset(path)
+        if artifact:
+            path = artifact
+            
         logging.info(f"Loading shader from {path}")
         with open(path) as file:
             source = file.read()
-        return source
+        return self.addDefines(source)
+    
+    def addDefines(self, source: str) -> str:
+        """
+        Inserts the program's defines after a source's #version directive,
+        which must come first.
+
+        Parameters
+        ----------
+        source : str
+            The shader source.
+
+        Returns
+        -------
+        str
+            The source with the defines.
+
+        """
+        
+        if not self.defines:
+            return source
+        version, _, body = source.partition("\n")
+        return "\n".join([version] + [f"#define {define}" for define in self.defines] + [body])
 
     def link(self):
         """
@@ -64,23 +126,86 @@ class ShaderProgram:
 
         """
         
-        # Compile shaders via PyOpenGL's .shaders subpackage
+        # Compile shaders via PyOpenGL's .shaders subpackage. Validation
+        # waits until samplers are assigned their units.
         self.id = shaders.compileProgram(
             shaders.compileShader(self.vertSource, shaders.GL_VERTEX_SHADER),
-            shaders.compileShader(self.fragSource, shaders.GL_FRAGMENT_SHADER)
+            shaders.compileShader(self.fragSource, shaders.GL_FRAGMENT_SHADER),
+            validate=False
         )
         logging.info(f"Compiled shader program {self.id}")
+        
+        # Locations and values belong to the previous program, if any
+        self.uniform_values.clear()
+        self.query_uniforms()
+        self.assign_samplers()
+        
+        # Point uniform blocks at their shared buffers, checking their layout
+        bind_uniform_blocks(self.id)
+        self.id.check_validate()
+        
+    def assign_samplers(self):
+        """
+        Points each of the program's samplers at its texture unit in
+        SAMPLER_UNITS, without changing the program in use.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        for name, unit in SAMPLER_UNITS.items():
+            location = self.uniform_locations.get(name)
+            if location is not None:
+                glProgramUniform1i(self.id, location, unit)
+                self.uniform_values[location] = unit
+        
+    def query_uniforms(self):
+        """
+        Queries every active uniform in the linked program once, and stores
+        its location by name, so setting uniforms never needs a string lookup
+        in the driver.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.uniform_locations = {}
+        for i in range(glGetProgramiv(self.id, GL_ACTIVE_UNIFORMS)):
+            name, size, _ = glGetActiveUniform(self.id, i)
+            name = name.decode() if isinstance(name, bytes) else name
+            location = glGetUniformLocation(self.id, name)
+            
+            # Members of uniform blocks have no location, and are set
+            # through their buffer
+            if location == -1:
+                continue
+            self.uniform_locations[name] = location
+            
+            # Arrays of basic types are reported once as name[0], but may be
+            # set by their base name or any element, which have consecutive
+            # locations
+            if name.endswith("[0]"):
+                base = name[:-3]
+                self.uniform_locations[base] = location
+                for element in range(1, size):
+                    self.uniform_locations[f"{base}[{element}]"] = location + element
+                    
+        logging.info(f"Found {len(self.uniform_locations)} uniform locations in program {self.id}")
 
     def use(self):
         """
-        Uses the program.
+        Uses the program, if not already in use.
 
         Returns
         -------
         None.
 
         """
-        glUseProgram(self.id)
+        GL_STATE.use_program(self.id)
 
     def getId(self):
         """
@@ -96,7 +221,9 @@ class ShaderProgram:
 
     def getUniformLocation(self, name: str):
         """
-        Returns the location for a uniform in the program
+        Returns the location for a uniform in the program, from the map built
+        at link time. Names not in the map (ie, inactive uniforms) are queried
+        once and remembered.
 
         Parameters
         ----------
@@ -110,7 +237,69 @@ class ShaderProgram:
 
         """
         
-        return glGetUniformLocation(self.id, name)
+        location = self.uniform_locations.get(name)
+        if location is None:
+            location = glGetUniformLocation(self.id, name)
+            self.uniform_locations[name] = location
+        return location
+    
+    def isUnchanged(self, location: int, value) -> bool:
+        """
+        Checks whether a uniform set call can be skipped, because the uniform
+        is inactive or already holds the value. Otherwise, records the value
+        as uploaded.
+
+        Parameters
+        ----------
+        location : int
+            The uniform's location
+        value : int, float, glm type, or np.ndarray
+            The value about to be set
+
+        Returns
+        -------
+        bool
+            True if the call should be skipped.
+
+        """
+        
+        self.uniform_calls += 1
+        
+        # Inactive uniforms have location -1, and setting them does nothing
+        if location == -1:
+            self.uniform_skipped += 1
+            return True
+        
+        last = self.uniform_values.get(location)
+        if isinstance(value, np.ndarray):
+            if last is not None and np.array_equal(last, value):
+                self.uniform_skipped += 1
+                return True
+            self.uniform_values[location] = value.copy()
+            PROFILER.count("uniform_uploads")
+            return False
+        
+        if last is not None and last == value:
+            self.uniform_skipped += 1
+            return True
+        
+        # glm types are mutable, so store a copy of the value
+        self.uniform_values[location] = value if isinstance(value, (int, float)) else type(value)(value)
+        PROFILER.count("uniform_uploads")
+        return False
+    
+    def reset_uniform_stats(self):
+        """
+        Resets the uniform call counters.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.uniform_calls = 0
+        self.uniform_skipped = 0
 
     def setInt(self, name: str, value: int):
         """
@@ -129,7 +318,9 @@ class ShaderProgram:
 
         """
         
-        glUniform1i(self.getUniformLocation(name), value)
+        location = self.getUniformLocation(name)
+        if not self.isUnchanged(location, value):
+            glUniform1i(location, value)
 
     def setFloat(self, name: str, value: float):
         """
@@ -148,7 +339,9 @@ class ShaderProgram:
 
         """
         
-        glUniform1f(self.getUniformLocation(name), value)
+        location = self.getUniformLocation(name)
+        if not self.isUnchanged(location, value):
+            glUniform1f(location, value)
 
     def setVec2(self, name: str, vec: glm.vec2):
         """
@@ -167,7 +360,9 @@ class ShaderProgram:
 
         """
         
-        glUniform2fv(self.getUniformLocation(name), 1, glm.value_ptr(vec))
+        location = self.getUniformLocation(name)
+        if not self.isUnchanged(location, vec):
+            glUniform2fv(location, 1, glm.value_ptr(vec))
 
     def setVec3(self, name: str, vec: glm.vec3):
         """
@@ -186,7 +381,9 @@ class ShaderProgram:
 
         """
         
-        glUniform3fv(self.getUniformLocation(name), 1, glm.value_ptr(vec))
+        location = self.getUniformLocation(name)
+        if not self.isUnchanged(location, vec):
+            glUniform3fv(location, 1, glm.value_ptr(vec))
 
     def setVec4(self, name: str, vec: glm.vec4):
         """
@@ -205,7 +402,9 @@ class ShaderProgram:
 
         """
         
-        glUniform4fv(self.getUniformLocation(name), 1, glm.value_ptr(vec))
+        location = self.getUniformLocation(name)
+        if not self.isUnchanged(location, vec):
+            glUniform4fv(location, 1, glm.value_ptr(vec))
 
     def setMat2(self, name: str, mat: glm.mat2):
         """
@@ -224,7 +423,9 @@ class ShaderProgram:
 
         """
         
-        glUniformMatrix2fv(self.getUniformLocation(name), 1, False, glm.value_ptr(mat))
+        location = self.getUniformLocation(name)
+        if not self.isUnchanged(location, mat):
+            glUniformMatrix2fv(location, 1, False, glm.value_ptr(mat))
 
     def setMat3(self, name: str, mat: glm.mat3):
         """
@@ -243,7 +444,9 @@ class ShaderProgram:
 
         """
         
-        glUniformMatrix3fv(self.getUniformLocation(name), 1, False, glm.value_ptr(mat))
+        location = self.getUniformLocation(name)
+        if not self.isUnchanged(location, mat):
+            glUniformMatrix3fv(location, 1, False, glm.value_ptr(mat))
 
     def setMat4(self, name: str, mat: glm.mat4):
         """
@@ -253,8 +456,9 @@ class ShaderProgram:
         ----------
         name : str
             The uniform to set
-        value : mat4
-            The value to set the uniform to
+        value : mat4 or np.ndarray
+            The value to set the uniform to. NumPy arrays must be float32 and
+            column major, as packed by TransformStore.
 
         Returns
         -------
@@ -262,4 +466,6 @@ class ShaderProgram:
 
         """
         
-        glUniformMatrix4fv(self.getUniformLocation(name), 1, False, glm.value_ptr(mat))
\ No newline at end of file
+        location = self.getUniformLocation(name)
+        if not self.isUnchanged(location, mat):
+            glUniformMatrix4fv(location, 1, False, mat if isinstance(mat, np.ndarray) else glm.value_ptr(mat))
\ No newline at end of file
@@ -0,0 +1,345 @@
+import numpy as np
+from engine.core.profiler import PROFILER
+
+# Passes, in the order they are drawn when queued together
+SHADOW_PASS = 0
+LIGHTING_PASS = 1
+
+# Bit layout of the 64 bit sort key, most significant first. Items are drawn
+# in key order, so the most expensive state to change is in the highest bits.
+PASS_SHIFT, PASS_BITS = 60, 4
+PROGRAM_SHIFT, PROGRAM_BITS = 52, 8
+TEXTURES_SHIFT, TEXTURES_BITS = 36, 16
+MATERIAL_SHIFT, MATERIAL_BITS = 20, 16
+VAO_SHIFT, VAO_BITS = 0, 20
+
+def make_sort_key(render_pass: int, program: int, textures: int, material: int, vao: int) -> int:
+    """
+    Packs draw state into a 64 bit sort key. Each field is masked to its
+    width, so ids beyond a field's range only sort less well. Fields are
+    converted to Python ints first, as GL names are NumPy uint32 scalars,
+    which overflow when shifted.
+
+    Parameters
+    ----------
+    render_pass : int
+        The pass, ie, SHADOW_PASS.
+    program : int
+        The program's id in the queue.
+    textures : int
+        The id in the queue of the material's set of textures.
+    material : int
+        The material's id in the queue.
+    vao : int
+        The mesh's VAO name.
+
+    Returns
+    -------
+    int
+        The sort key.
+
+    """
+
+    return (
+        (int(render_pass) & ((1 << PASS_BITS) - 1)) << PASS_SHIFT
+        | (int(program) & ((1 << PROGRAM_BITS) - 1)) << PROGRAM_SHIFT
+        | (int(textures) & ((1 << TEXTURES_BITS) - 1)) << TEXTURES_SHIFT
+        | (int(material) & ((1 << MATERIAL_BITS) - 1)) << MATERIAL_SHIFT
+        | (int(vao) & ((1 << VAO_BITS) - 1)) << VAO_SHIFT
+    )
+
+def count_state_changes(items: list) -> int:
+    """
+    Counts the program, material, and VAO changes needed to draw items in the
+    given order.
+
+    Parameters
+    ----------
+    items : list
+        The render items.
+
+    Returns
+    -------
+    int
+        The number of state changes.
+
+    """
+
+    changes = 0
+    previous = None
+    for item in items:
+        if previous is None or item.program is not previous.program:
+            changes += 1
+        if not item.depth_only and (previous is None or previous.depth_only or item.program is not previous.program or item.mesh.material is not previous.mesh.material):
+            changes += 1
+        if previous is None or item.vao != previous.vao:
+            changes += 1
+        previous = item
+    return changes
+
+"""
+RenderItem
+
+One mesh to draw in a pass: its instances and the state to draw them with.
+Depth only items bind no material, and use the mesh's position only VAO.
+"""
+class RenderItem:
+    def __init__(
+        self,
+        key: int,
+        mesh,
+        program,
+        instance_data: np.ndarray,
+        visible: np.ndarray,
+        distance: float = 0,
+        depth_only: bool = False,
+        lods: np.ndarray = None
+    ):
+        """
+        Initialises the item.
+
+        Parameters
+        ----------
+        key : int
+            The sort key.
+        mesh : Mesh
+            The mesh to draw.
+        program : ShaderProgram
+            The program to draw with.
+        instance_data : np.ndarray
+            Column major model matrices of every instance, of shape (N, 4, 4).
+        visible : np.ndarray
+            Boolean mask of instances to draw, or None for all.
+        distance : float, optional
+            Distance from the camera, for sorting blended items. The default
+            is 0.
+        depth_only : bool, optional
+            Whether to draw depth only. The default is False.
+        lods : np.ndarray, optional
+            The level of detail of every instance, or None for full detail.
+            The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.key = key
+        self.mesh = mesh
+        self.program = program
+        self.instance_data = instance_data
+        self.visible = visible
+        self.distance = distance
+        self.depth_only = depth_only
+        self.lods = lods
+        self.vao = mesh.depthVAO if depth_only else mesh.VAO
+
+"""
+RenderQueue
+
+Collects the meshes submitted for drawing, and draws them sorted by state, so
+that programs, materials and VAOs are changed as rarely as possible.
+
+Opaque items are sorted by a 64 bit key of pass, program, textures, material
+and VAO. Blended items (ie, those with transparent diffuse textures) must be
+drawn after opaque ones, furthest first, so are kept in their own bucket and
+sorted by distance from the camera. Instances within one blended item are not
+sorted against each other.
+"""
+class RenderQueue:
+    def __init__(self):
+        """
+        Initialises an empty queue.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.opaque = []
+        self.blended = []
+        self.camera_position = None
+
+        # Small ids for programs, texture sets and materials, to fit the key
+        self.program_ids = {}
+        self.texture_ids = {}
+        self.material_ids = {}
+
+        # Items drawn and state changes avoided by sorting, this frame and in
+        # the last frame
+        self.items = 0
+        self.changes_avoided = 0
+        self.last_frame = {"items": 0, "changes_avoided": 0}
+
+    def get_id(self, ids: dict, value) -> int:
+        """
+        Returns a small id for a value, assigning the next if it has none.
+
+        Parameters
+        ----------
+        ids : dict
+            The ids assigned so far.
+        value : Any
+            The hashable value.
+
+        Returns
+        -------
+        int
+            The id.
+
+        """
+
+        return ids.setdefault(value, len(ids))
+
+    def begin(self, camera_position=None):
+        """
+        Empties the queue, ready for submissions.
+
+        Parameters
+        ----------
+        camera_position : glm.vec3, optional
+            The camera position, to sort blended items by. The default is
+            None (blended items are drawn in submission order).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.opaque = []
+        self.blended = []
+        self.camera_position = None if camera_position is None else np.array(camera_position, dtype=np.float32)
+
+    def submit(self, mesh, program, render_pass: int, instance_data: np.ndarray, visible: np.ndarray = None, lods: np.ndarray = None):
+        """
+        Queues a mesh's instances to be drawn. Prefer Model.submit(), which
+        culls first.
+
+        Parameters
+        ----------
+        mesh : Mesh
+            The mesh to draw.
+        program : ShaderProgram
+            The program to draw with.
+        render_pass : int
+            The pass, ie, LIGHTING_PASS.
+        instance_data : np.ndarray
+            Column major model matrices of every instance, of shape (N, 4, 4).
+        visible : np.ndarray, optional
+            Boolean mask of instances to draw. The default is None (all).
+        lods : np.ndarray, optional
+            The level of detail of every instance. The default is None (full
+            detail).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        material = mesh.material
+        key = make_sort_key(
+            render_pass,
+            self.get_id(self.program_ids, program),
+            self.get_id(self.texture_ids, material.textures),
+            self.get_id(self.material_ids, material),
+            mesh.VAO
+        )
+
+        # Only the lighting pass blends
+        if render_pass != LIGHTING_PASS or not material.blended:
+            self.opaque.append(RenderItem(key, mesh, program, instance_data, visible, lods=lods))
+            return
+
+        # Sort blended items by their furthest visible instance
+        distance = 0
+        if self.camera_position is not None:
+            centers, _ = mesh.get_world_bounds()
+            if visible is not None:
+                centers = centers[visible]
+            distance = float(np.linalg.norm(centers - self.camera_position, axis=1).max())
+        self.blended.append(RenderItem(key, mesh, program, instance_data, visible, distance, lods=lods))
+
+    def submit_depth(self, mesh, program, instance_data: np.ndarray, visible: np.ndarray = None):
+        """
+        Queues a mesh's instances to be drawn depth only, ie, into a shadow
+        map. Prefer Model.submit_depth(), which culls first. Depth items have
+        no material, so are sorted by program and VAO alone.
+
+        Parameters
+        ----------
+        mesh : Mesh
+            The mesh to draw.
+        program : ShaderProgram
+            The depth program to draw with.
+        instance_data : np.ndarray
+            Column major model matrices of every instance, of shape (N, 4, 4).
+        visible : np.ndarray, optional
+            Boolean mask of instances to draw. The default is None (all).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        key = make_sort_key(SHADOW_PASS, self.get_id(self.program_ids, program), 0, 0, mesh.depthVAO)
+        self.opaque.append(RenderItem(key, mesh, program, instance_data, visible, depth_only=True))
+
+    def execute(self):
+        """
+        Draws every queued item, opaque items in key order then blended items
+        furthest first, and empties the queue.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        submitted = self.opaque + self.blended
+        self.opaque.sort(key=lambda item: item.key)
+        self.blended.sort(key=lambda item: -item.distance)
+        ordered = self.opaque + self.blended
+
+        # Report the state changes saved against drawing in submission order
+        avoided = count_state_changes(submitted) - count_state_changes(ordered)
+        self.items += len(ordered)
+        self.changes_avoided += avoided
+        PROFILER.count("state_changes_avoided", avoided)
+
+        previous = None
+        for item in ordered:
+            mesh = item.mesh
+            if previous is None or item.program is not previous.program:
+                item.program.use()
+            if item.depth_only:
+                mesh.bind_depth_geometry()
+            else:
+                if previous is None or previous.depth_only or item.program is not previous.program or mesh.material is not previous.mesh.material:
+                    mesh.bind_material(item.program)
+                mesh.bind_geometry(item.program)
+            mesh.draw_instances(item.program, item.instance_data, item.visible, item.lods)
+            previous = item
+
+        self.opaque = []
+        self.blended = []
+
+    def new_frame(self):
+        """
+        Stores the counts of the frame just finished, and resets them.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.last_frame = {"items": self.items, "changes_avoided": self.changes_avoided}
+        self.items = 0
+        self.changes_avoided = 0
+
+RENDER_QUEUE = RenderQueue()
@@ -0,0 +1,332 @@
+import heapq
+import logging
+import numpy as np
+from engine.core.meshopt import tipsify
+
+def weld_positions(positions: np.ndarray) -> np.ndarray:
+    """
+    Maps each vertex to a canonical vertex with the same position, so that
+    vertices split along UV or normal seams are treated as one.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Vertex positions, of shape (N, 3).
+
+    Returns
+    -------
+    np.ndarray
+        The canonical vertex of each vertex, of shape (N,).
+
+    """
+
+    _, first, inverse = np.unique(positions, axis=0, return_index=True, return_inverse=True)
+    return first[inverse.reshape(-1)]
+
+def compute_quadrics(positions: np.ndarray, triangles: np.ndarray, canonical: np.ndarray) -> np.ndarray:
+    """
+    Computes the error quadric of each vertex (Garland and Heckbert): the sum
+    of the area weighted squared distance matrices of the planes of every
+    triangle around it. Welded vertices share one quadric.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Vertex positions, of shape (N, 3).
+    triangles : np.ndarray
+        Triangle indices, of shape (F, 3).
+    canonical : np.ndarray
+        The canonical vertex of each vertex, as from weld_positions().
+
+    Returns
+    -------
+    np.ndarray
+        The quadrics, of shape (N, 4, 4).
+
+    """
+
+    corners = positions[triangles].astype(np.float64)
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    normals = normals / np.maximum(areas, 1e-20)[:, None]
+    planes = np.concatenate([normals, -np.einsum("ij,ij->i", normals, corners[:, 0])[:, None]], axis=1)
+    face_quadrics = planes[:, :, None] * planes[:, None, :] * areas[:, None, None]
+
+    quadrics = np.zeros((len(positions), 4, 4))
+    for corner in range(3):
+        np.add.at(quadrics, canonical[triangles[:, corner]], face_quadrics)
+    return quadrics[canonical]
+
+def compute_boundary_quadrics(positions: np.ndarray, triangles: np.ndarray, canonical: np.ndarray, weight: float = 10.) -> np.ndarray:
+    """
+    Computes quadrics that keep open boundaries in place: for each boundary
+    edge (one belonging to only one triangle, once welded), the plane through
+    the edge perpendicular to its triangle. Collapsing a boundary vertex
+    inwards then costs as much as moving it off its own plane.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Vertex positions, of shape (N, 3).
+    triangles : np.ndarray
+        Triangle indices, of shape (F, 3).
+    canonical : np.ndarray
+        The canonical vertex of each vertex, as from weld_positions().
+    weight : float, optional
+        How much more boundary planes weigh than surface planes. The default
+        is 10.
+
+    Returns
+    -------
+    np.ndarray
+        The quadrics, of shape (N, 4, 4).
+
+    """
+
+    welded = canonical[triangles]
+    edges = np.concatenate([welded[:, [0, 1]], welded[:, [1, 2]], welded[:, [2, 0]]])
+    faces = np.tile(np.arange(len(triangles)), 3)
+    _, inverse, counts = np.unique(np.sort(edges, axis=1), axis=0, return_inverse=True, return_counts=True)
+    boundary = counts[inverse.reshape(-1)] == 1
+    edges, faces = edges[boundary], faces[boundary]
+
+    quadrics = np.zeros((len(positions), 4, 4))
+    if not len(edges):
+        return quadrics
+
+    corners = positions[triangles[faces]]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    start, end = positions[edges[:, 0]], positions[edges[:, 1]]
+    normals = np.cross(end - start, face_normals)
+    lengths = np.linalg.norm(normals, axis=1)
+    normals = normals / np.maximum(lengths, 1e-20)[:, None]
+    planes = np.concatenate([normals, -np.einsum("ij,ij->i", normals, start)[:, None]], axis=1)
+    edge_lengths = np.linalg.norm(end - start, axis=1)
+    edge_quadrics = planes[:, :, None] * planes[:, None, :] * (weight * edge_lengths ** 2)[:, None, None]
+
+    for corner in range(2):
+        np.add.at(quadrics, edges[:, corner], edge_quadrics)
+    return quadrics[canonical]
+
+def simplify(positions: np.ndarray, indices: np.ndarray, target_triangles: int, max_error: float = np.inf) -> np.ndarray:
+    """
+    Simplifies a triangle mesh by quadric error half edge collapse: each step
+    moves the vertex whose removal adds the least error onto a neighbour.
+    Vertices are only removed, never moved or created, so the result indexes
+    the original vertex buffer, and every level of detail can share it.
+
+    Vertices split along seams are collapsed together, and only onto a
+    vertex that each copy shares an edge with, so seams slide along
+    themselves rather than tearing. Collapses that would flip a triangle are
+    skipped.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Vertex positions, flat or of shape (N, 3).
+    indices : np.ndarray
+        Triangle indices, of any shape.
+    target_triangles : int
+        The triangle count to simplify down to, if possible.
+    max_error : float, optional
+        The largest collapse cost to accept. The default is no limit.
+
+    Returns
+    -------
+    np.ndarray
+        The simplified triangle indices, flat.
+
+    """
+
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3).copy()
+    vertex_count = len(positions)
+    if len(triangles) <= target_triangles:
+        return triangles.reshape(-1)
+
+    # Collapses work on welded groups of vertices, named by their canonical
+    # vertex, and keep one quadric per group
+    canonical = weld_positions(positions)
+    quadrics = compute_quadrics(positions, triangles, canonical) + compute_boundary_quadrics(positions, triangles, canonical)
+    homogeneous = np.concatenate([positions, np.ones((vertex_count, 1))], axis=1)
+    members = {}
+    for vertex, group in enumerate(canonical.tolist()):
+        members.setdefault(group, []).append(vertex)
+    canonical = canonical.tolist()
+
+    # Triangles around each vertex, and whether each triangle still exists
+    adjacent = [set() for _ in range(vertex_count)]
+    for triangle, corners in enumerate(triangles.tolist()):
+        for vertex in corners:
+            adjacent[vertex].add(triangle)
+    alive = np.ones(len(triangles), dtype=bool)
+    live_triangles = len(triangles)
+    version = [0] * vertex_count
+
+    def neighbours(group):
+        return {canonical[other] for vertex in members[group] for triangle in adjacent[vertex] for other in triangles[triangle]} - {group}
+
+    def push_edges(group):
+        # Queue every collapse of the group onto a neighbour, so the next
+        # cheapest can be tried if one turns out invalid
+        for other in neighbours(group):
+            point = homogeneous[other]
+            cost = float(point @ (quadrics[group] + quadrics[other]) @ point)
+            heapq.heappush(heap, (cost, group, other, version[group]))
+
+    def partners(source, target):
+        # The target vertex each source vertex moves onto, which must share
+        # a triangle with it, or None if any source vertex has none
+        mapping = {}
+        for vertex in members[source]:
+            if not adjacent[vertex]:
+                continue
+            partner = next((other for triangle in adjacent[vertex] for other in triangles[triangle] if canonical[other] == target), None)
+            if partner is None:
+                return None
+            mapping[vertex] = partner
+        return mapping
+
+    def flips(mapping, target):
+        # Whether the collapse would turn any remaining triangle over, or
+        # make it degenerate
+        for vertex, partner in mapping.items():
+            for triangle in adjacent[vertex]:
+                corners = triangles[triangle]
+                if any(canonical[corner] == target for corner in corners):
+                    continue
+                before = positions[corners]
+                after = np.where((corners == vertex)[:, None], positions[partner], before)
+                normal_before = np.cross(before[1] - before[0], before[2] - before[0])
+                normal_after = np.cross(after[1] - after[0], after[2] - after[0])
+                if np.dot(normal_before, normal_after) <= 1e-12 * np.dot(normal_before, normal_before):
+                    return True
+        return False
+
+    heap = []
+    for group in members:
+        push_edges(group)
+
+    while heap and live_triangles > target_triangles:
+        error, source, target, queued_version = heapq.heappop(heap)
+        if error > max_error:
+            break
+
+        # Skip collapses made stale by earlier collapses, or invalid
+        if queued_version != version[source] or not members[source] or not members[target]:
+            continue
+        mapping = partners(source, target)
+        if mapping is None or flips(mapping, target):
+            continue
+
+        # Remove triangles along the edge, and move the rest onto the target
+        for vertex, partner in mapping.items():
+            for triangle in list(adjacent[vertex]):
+                corners = triangles[triangle]
+                if any(canonical[corner] == target for corner in corners):
+                    alive[triangle] = False
+                    live_triangles -= 1
+                    for corner in corners:
+                        adjacent[corner].discard(triangle)
+                else:
+                    corners[corners == vertex] = partner
+                    adjacent[partner].add(triangle)
+            adjacent[vertex].clear()
+        members[source] = []
+        quadrics[target] += quadrics[source]
+
+        # Costs around the target have changed
+        for group in neighbours(target) | {target}:
+            version[group] += 1
+            push_edges(group)
+
+    return triangles[alive].reshape(-1)
+
+def generate_lods(
+    positions: np.ndarray,
+    indices: np.ndarray,
+    ratios: list[float],
+    min_triangles: int = 0,
+    cache_size: int = 16
+) -> list[np.ndarray]:
+    """
+    Generates a chain of simplified index buffers, each simplified from the
+    previous, and reordered for the vertex cache. Levels that fail to reduce
+    the triangle count meaningfully end the chain.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Vertex positions, flat or of shape (N, 3).
+    indices : np.ndarray
+        Triangle indices of the full detail mesh, of any shape.
+    ratios : list[float]
+        The fraction of the full triangle count each level targets, ie,
+        [0.5, 0.25].
+    min_triangles : int, optional
+        Meshes with fewer triangles get no levels. The default is 0.
+    cache_size : int, optional
+        The vertex cache size to reorder for. The default is 16.
+
+    Returns
+    -------
+    list[np.ndarray]
+        The index buffer of each level, flat.
+
+    """
+
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    full = len(indices) // 3
+    if full < min_triangles:
+        return []
+
+    vertex_count = len(np.asarray(positions).reshape(-1, 3))
+    lods = []
+    previous = indices
+    for ratio in ratios:
+        lod = simplify(positions, previous, int(full * ratio))
+
+        # Stop once simplification stalls, ie, on locked outlines
+        if len(lod) > 0.9 * len(previous) or not len(lod):
+            break
+        lod, _ = tipsify(lod, vertex_count, cache_size)
+        lods.append(lod)
+        previous = lod
+    return lods
+
+def generate_model_lods(data: dict, ratios: list[float], min_triangles: int = 0, name: str = "", cache_size: int = 16):
+    """
+    Generates levels of detail for every mesh of an Assimp2JSON model in
+    place, stored as index arrays lod1, lod2, ... beside each mesh's faces.
+
+    Parameters
+    ----------
+    data : dict
+        The model dictionary.
+    ratios : list[float]
+        The fraction of the full triangle count each level targets.
+    min_triangles : int, optional
+        Meshes with fewer triangles get no levels. The default is 0.
+    name : str, optional
+        The model's name, for logging. The default is "".
+    cache_size : int, optional
+        The vertex cache size to reorder for. The default is 16.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    for mesh_data in data["meshes"]:
+        faces = np.asarray(mesh_data.get("faces", []))
+        if faces.ndim != 2 or faces.shape[1] != 3:
+            continue
+        lods = generate_lods(mesh_data["vertices"], faces, ratios, min_triangles, cache_size)
+        for level, lod in enumerate(lods, start=1):
+            mesh_data[f"lod{level}"] = lod.astype(np.uint32)
+        if lods:
+            counts = " -> ".join(str(len(lod) // 3) for lod in [faces.reshape(-1)] + lods)
+            logging.info(f"Generated LODs for {name}: {counts} triangles")
+
+    data["lod_settings"] = {"ratios": list(ratios), "min_triangles": min_triangles, "cache_size": cache_size}
@@ -0,0 +1,419 @@
+from OpenGL.GL import *
+from engine.core.profiler import PROFILER
+
+"""
+GLState
+
+Shadows the OpenGL state the engine changes most often: the bound program,
+VAO, framebuffers, per unit textures, viewport, depth mask, blend function and
+enabled capabilities. Each setter only calls into OpenGL when the value would
+actually change, as every PyOpenGL call costs microseconds of Python overhead.
+
+This only works if every change to the tracked state goes through the
+tracker. Code that changes it directly must call GLState.invalidate()
+afterwards. Objects that are deleted must be forgotten, as OpenGL unbinds
+them, and their names may be reused.
+"""
+class GLState:
+    def __init__(self):
+        """
+        Initialises the tracker with all state unknown.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.invalidate()
+
+        # Calls issued and eliminated this frame, and in the last frame
+        self.issued = 0
+        self.eliminated = 0
+        self.last_frame = {"issued": 0, "eliminated": 0}
+
+    def invalidate(self):
+        """
+        Forgets all tracked state, so that the next call to each setter is
+        issued. Values set to None are unknown.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.program = None
+        self.vertex_array = None
+        self.draw_framebuffer = None
+        self.read_framebuffer = None
+        self.active_unit = None
+        self.viewport = None
+        self.depth_mask = None
+        self.blend_func = None
+
+        # Texture bound to each (unit, target), and capability enabled flags
+        self.textures = {}
+        self.capabilities = {}
+
+    def changed(self, current, value) -> bool:
+        """
+        Checks whether a value differs from the tracked value, counting the
+        call as issued or eliminated.
+
+        Parameters
+        ----------
+        current : Any
+            The tracked value.
+        value : Any
+            The value to be set.
+
+        Returns
+        -------
+        bool
+            True if the call must be issued.
+
+        """
+
+        if current is not None and current == value:
+            self.eliminated += 1
+            PROFILER.count("gl_calls_eliminated")
+            return False
+
+        self.issued += 1
+        PROFILER.count("gl_state_calls")
+        return True
+
+    def use_program(self, program: int):
+        """
+        Uses a shader program.
+
+        Parameters
+        ----------
+        program : int
+            The program name, or 0 for none.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.changed(self.program, program):
+            glUseProgram(program)
+            self.program = program
+
+    def bind_vertex_array(self, vertex_array: int):
+        """
+        Binds a vertex array object.
+
+        Parameters
+        ----------
+        vertex_array : int
+            The VAO name, or 0 for none.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.changed(self.vertex_array, vertex_array):
+            glBindVertexArray(vertex_array)
+            self.vertex_array = vertex_array
+
+    def bind_framebuffer(self, framebuffer: int, target: int = GL_FRAMEBUFFER):
+        """
+        Binds a framebuffer for drawing, reading, or both.
+
+        Parameters
+        ----------
+        framebuffer : int
+            The framebuffer name, or 0 for the window.
+        target : int, optional
+            GL_FRAMEBUFFER, GL_DRAW_FRAMEBUFFER or GL_READ_FRAMEBUFFER. The
+            default is GL_FRAMEBUFFER (both).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if target == GL_FRAMEBUFFER:
+            current = self.draw_framebuffer if self.draw_framebuffer == self.read_framebuffer else None
+        elif target == GL_DRAW_FRAMEBUFFER:
+            current = self.draw_framebuffer
+        else:
+            current = self.read_framebuffer
+
+        if self.changed(current, framebuffer):
+            glBindFramebuffer(target, framebuffer)
+            if target in (GL_FRAMEBUFFER, GL_DRAW_FRAMEBUFFER):
+                self.draw_framebuffer = framebuffer
+            if target in (GL_FRAMEBUFFER, GL_READ_FRAMEBUFFER):
+                self.read_framebuffer = framebuffer
+
+    def active_texture(self, unit: int):
+        """
+        Selects the active texture unit.
+
+        Parameters
+        ----------
+        unit : int
+            The unit index, ie, 1 for GL_TEXTURE1.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.changed(self.active_unit, unit):
+            glActiveTexture(GL_TEXTURE0 + unit)
+            self.active_unit = unit
+
+    def bind_texture(self, target: int, texture: int, unit: int = None) -> bool:
+        """
+        Binds a texture to a texture unit.
+
+        Parameters
+        ----------
+        target : int
+            The texture target, ie, GL_TEXTURE_2D.
+        texture : int
+            The texture name, or 0 for none.
+        unit : int, optional
+            The unit index to bind to. The default is None (the active unit).
+
+        Returns
+        -------
+        bool
+            True if the texture was bound, False if it already was.
+
+        """
+
+        if unit is not None:
+            self.active_texture(unit)
+        key = (self.active_unit, target)
+
+        # Binding to an unknown unit leaves nothing reliable to track
+        if self.active_unit is None:
+            glBindTexture(target, texture)
+            return True
+
+        if not self.changed(self.textures.get(key), texture):
+            return False
+
+        glBindTexture(target, texture)
+        self.textures[key] = texture
+        return True
+
+    def set_viewport(self, x: int, y: int, width: int, height: int):
+        """
+        Sets the viewport.
+
+        Parameters
+        ----------
+        x : int
+            Left of the viewport.
+        y : int
+            Bottom of the viewport.
+        width : int
+            Width of the viewport.
+        height : int
+            Height of the viewport.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        viewport = (x, y, width, height)
+        if self.changed(self.viewport, viewport):
+            glViewport(x, y, width, height)
+            self.viewport = viewport
+
+    def set_depth_mask(self, flag: bool):
+        """
+        Enables or disables writing to the depth buffer.
+
+        Parameters
+        ----------
+        flag : bool
+            Whether depth writes are enabled.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.changed(self.depth_mask, flag):
+            glDepthMask(GL_TRUE if flag else GL_FALSE)
+            self.depth_mask = flag
+
+    def set_blend_func(self, source: int, destination: int):
+        """
+        Sets the blend function.
+
+        Parameters
+        ----------
+        source : int
+            The source factor, ie, GL_SRC_ALPHA.
+        destination : int
+            The destination factor, ie, GL_ONE_MINUS_SRC_ALPHA.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        blend_func = (source, destination)
+        if self.changed(self.blend_func, blend_func):
+            glBlendFunc(source, destination)
+            self.blend_func = blend_func
+
+    def set_enabled(self, capability: int, enabled: bool):
+        """
+        Enables or disables a capability, ie, GL_BLEND.
+
+        Parameters
+        ----------
+        capability : int
+            The capability.
+        enabled : bool
+            Whether to enable it.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.changed(self.capabilities.get(capability), enabled):
+            if enabled:
+                glEnable(capability)
+            else:
+                glDisable(capability)
+            self.capabilities[capability] = enabled
+
+    def enable(self, capability: int):
+        """
+        Enables a capability. See GLState.set_enabled().
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.set_enabled(capability, True)
+
+    def disable(self, capability: int):
+        """
+        Disables a capability. See GLState.set_enabled().
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.set_enabled(capability, False)
+
+    def forget_texture(self, texture: int):
+        """
+        Forgets a texture that is being deleted, which OpenGL unbinds from
+        every unit.
+
+        Parameters
+        ----------
+        texture : int
+            The texture name.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for key, bound in list(self.textures.items()):
+            if bound == texture:
+                self.textures[key] = 0
+
+    def forget_vertex_array(self, vertex_array: int):
+        """
+        Forgets a vertex array object that is being deleted.
+
+        Parameters
+        ----------
+        vertex_array : int
+            The VAO name.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.vertex_array == vertex_array:
+            self.vertex_array = 0
+
+    def forget_framebuffer(self, framebuffer: int):
+        """
+        Forgets a framebuffer that is being deleted, which OpenGL replaces
+        with the window's framebuffer wherever it was bound.
+
+        Parameters
+        ----------
+        framebuffer : int
+            The framebuffer name.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.draw_framebuffer == framebuffer:
+            self.draw_framebuffer = 0
+        if self.read_framebuffer == framebuffer:
+            self.read_framebuffer = 0
+
+    def forget_program(self, program: int):
+        """
+        Forgets a program that is being deleted. A program in use stays in use
+        until another is used, so the tracked value only becomes unknown.
+
+        Parameters
+        ----------
+        program : int
+            The program name.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.program == program:
+            self.program = None
+
+    def new_frame(self):
+        """
+        Stores the counts of the frame just finished, and resets them.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.last_frame = {"issued": self.issued, "eliminated": self.eliminated}
+        self.issued = 0
+        self.eliminated = 0
+
+GL_STATE = GLState()
@@ -0,0 +1,242 @@
+import glm
+import numpy as np
+
+def rotation_matrices(axis: np.ndarray, angles: np.ndarray) -> np.ndarray:
+    """
+    Builds rotation matrices about a single axis for many angles at once,
+    matching glm.rotate.
+
+    Parameters
+    ----------
+    axis : np.ndarray
+        The axis to rotate about, of shape (3,). Need not be normalised.
+    angles : np.ndarray
+        The angles in radians, of shape (N,).
+
+    Returns
+    -------
+    np.ndarray
+        The rotation matrices, of shape (N, 3, 3).
+
+    """
+
+    # Rodrigues' formula: R = cI + s[k]x + (1 - c)kk^T
+    k = axis / np.linalg.norm(axis)
+    c = np.cos(angles)[:, None, None]
+    s = np.sin(angles)[:, None, None]
+    cross = np.array([
+        [0, -k[2], k[1]],
+        [k[2], 0, -k[0]],
+        [-k[1], k[0], 0]
+    ])
+    return c * np.eye(3) + s * cross + (1 - c) * np.outer(k, k)
+
+def compose_model_matrices(
+    positions: np.ndarray,
+    rotations: np.ndarray,
+    scales: np.ndarray,
+    up: glm.vec3,
+    right: glm.vec3
+) -> np.ndarray:
+    """
+    Builds the model matrices for many transforms at once. Each is equal to
+
+        translate(position) * rotate(rotation.x, up) * rotate(rotation.y, right) * scale(scale)
+
+    as built with glm per transform.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions, of shape (N, 3).
+    rotations : np.ndarray
+        Rotations in radians, of shape (N, 3). Only x and y are used.
+    scales : np.ndarray
+        Scales, of shape (N, 3).
+    up : glm.vec3
+        The axis rotation.x turns about.
+    right : glm.vec3
+        The axis rotation.y turns about.
+
+    Returns
+    -------
+    np.ndarray
+        The model matrices, of shape (N, 4, 4), row major (ie, M[i, :3, 3] is
+        the translation of transform i).
+
+    """
+
+    count = len(positions)
+    matrices = np.zeros((count, 4, 4), dtype=np.float32)
+    if count == 0:
+        return matrices
+
+    # Rotate, then scale each column of the rotation
+    rotation = rotation_matrices(np.array(up, dtype=np.float64), rotations[:, 0]) \
+        @ rotation_matrices(np.array(right, dtype=np.float64), rotations[:, 1])
+    matrices[:, :3, :3] = rotation * scales[:, None, :]
+    matrices[:, :3, 3] = positions
+    matrices[:, 3, 3] = 1
+    return matrices
+
+"""
+TransformStore
+
+Holds the transforms of a model's instances as flat float32 arrays, and the
+model matrices built from them, which are cached until the transforms change.
+"""
+class TransformStore:
+    def __init__(self):
+        """
+        Initialises an empty store.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.positions = np.zeros((0, 3), dtype=np.float32)
+        self.rotations = np.zeros((0, 3), dtype=np.float32)
+        self.scales = np.zeros((0, 3), dtype=np.float32)
+
+        # Incremented whenever the transforms change, so users of the matrices
+        # (ie, instance buffers and shadow caches) can cheaply check for changes
+        self.version = 0
+
+        # Cached matrices, and the version and axes they were built for
+        self.matrices = None
+        self.instance_data = None
+        self.cache_key = None
+
+    def __len__(self) -> int:
+        """
+        Returns the number of transforms.
+
+        Returns
+        -------
+        int
+            The number of transforms.
+
+        """
+
+        return len(self.positions)
+
+    def set_arrays(self, positions: np.ndarray, rotations: np.ndarray = None, scales: np.ndarray = None):
+        """
+        Sets all transforms from arrays. This is the fast path for large
+        numbers of instances. Setting the same transforms again does not count
+        as a change.
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            Positions, of shape (N, 3).
+        rotations : np.ndarray, optional
+            Rotations, of shape (N, 3) or (3,). The default is None (no
+            rotation).
+        scales : np.ndarray, optional
+            Scales, of shape (N, 3), (3,), or a scalar. The default is None
+            (unit scale).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        shape = positions.shape
+        rotations = np.broadcast_to(np.asarray(0 if rotations is None else rotations, dtype=np.float32), shape)
+        scales = np.broadcast_to(np.asarray(1 if scales is None else scales, dtype=np.float32), shape)
+
+        if (
+            shape == self.positions.shape
+            and np.array_equal(positions, self.positions)
+            and np.array_equal(rotations, self.rotations)
+            and np.array_equal(scales, self.scales)
+        ):
+            return
+
+        self.positions = positions.copy()
+        self.rotations = rotations.copy()
+        self.scales = scales.copy()
+        self.version += 1
+
+    def set_dicts(self, transforms: list[dict[str, glm.vec3]]):
+        """
+        Sets all transforms from a list of dicts of the following shape:
+
+                {
+                    position: glm.vec3,
+                    rotation: glm.vec3,
+                    scale: glm.vec3
+                }
+
+        Parameters
+        ----------
+        transforms : list[dict[str, glm.vec3]]
+            The list of transformation dicts
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.set_arrays(
+            [tuple(trf["position"]) for trf in transforms],
+            [tuple(trf["rotation"]) for trf in transforms] or None,
+            [tuple(trf["scale"]) for trf in transforms] or None
+        )
+
+    def get_matrices(self, up: glm.vec3, right: glm.vec3) -> np.ndarray:
+        """
+        Returns the model matrix of every transform, rebuilding them only if
+        the transforms or axes have changed.
+
+        Parameters
+        ----------
+        up : glm.vec3
+            The axis rotation.x turns about.
+        right : glm.vec3
+            The axis rotation.y turns about.
+
+        Returns
+        -------
+        np.ndarray
+            The model matrices, of shape (N, 4, 4), row major.
+
+        """
+
+        key = (self.version, tuple(up), tuple(right))
+        if key != self.cache_key:
+            self.matrices = compose_model_matrices(self.positions, self.rotations, self.scales, up, right)
+
+            # OpenGL expects matrices column by column
+            self.instance_data = np.ascontiguousarray(self.matrices.transpose(0, 2, 1))
+            self.cache_key = key
+
+        return self.matrices
+
+    def get_instance_data(self, up: glm.vec3, right: glm.vec3) -> np.ndarray:
+        """
+        Returns the model matrices packed column major, as expected by OpenGL
+        for uniforms and instance attributes.
+
+        Parameters
+        ----------
+        up : glm.vec3
+            The axis rotation.x turns about.
+        right : glm.vec3
+            The axis rotation.y turns about.
+
+        Returns
+        -------
+        np.ndarray
+            The packed model matrices, of shape (N, 4, 4).
+
+        """
+
+        self.get_matrices(up, right)
+        return self.instance_data
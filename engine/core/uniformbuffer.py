@@ -0,0 +1,253 @@
+import glm
+import logging
+import numpy as np
+from OpenGL.GL import *
+from engine.core.profiler import PROFILER
+
+# Binding points shared by every program that declares each block
+FRAME_DATA_BINDING = 0
+LIGHT_DATA_BINDING = 1
+
+# Must match MAX_SHADOW_CASCADES in the shaders
+MAX_SHADOW_CASCADES = 4
+
+# std140 layouts, as structured dtypes with explicit offsets. vec3s are
+# aligned to 16 bytes, but a following float may fill their last 4; structs,
+# arrays of structs, and blocks are padded to a multiple of 16. Matrices are
+# stored column major.
+GLOBAL_LIGHT_DTYPE = np.dtype({
+    "names": ["position", "ambient", "diffuse", "specular"],
+    "formats": [("<f4", 3)] * 4,
+    "offsets": [0, 16, 32, 48],
+    "itemsize": 64
+})
+
+# layout (std140) uniform FrameData, in every shader
+FRAME_DATA_DTYPE = np.dtype({
+    "names": ["viewProject", "view", "projection", "lightSpaceMatrices", "cascadeSplits", "viewPos", "cascadeCount", "globalLight"],
+    "formats": [("<f4", (4, 4))] * 3 + [("<f4", (MAX_SHADOW_CASCADES, 4, 4)), ("<f4", 4), ("<f4", 3), "<i4", GLOBAL_LIGHT_DTYPE],
+    "offsets": [0, 64, 128, 192, 192 + 64 * MAX_SHADOW_CASCADES, 208 + 64 * MAX_SHADOW_CASCADES, 220 + 64 * MAX_SHADOW_CASCADES, 224 + 64 * MAX_SHADOW_CASCADES],
+    "itemsize": 288 + 64 * MAX_SHADOW_CASCADES
+})
+
+# layout (std140) uniform LightData, in the lighting shaders. The point lights
+# themselves are in texture buffers (see engine/core/clusters.py).
+LIGHT_DATA_DTYPE = np.dtype({
+    "names": ["clusterGrid", "clusterDepth", "clusterTileSize", "pointLightCount"],
+    "formats": [("<i4", 4), ("<f4", 4), ("<f4", 2), "<i4"],
+    "offsets": [0, 16, 32, 40],
+    "itemsize": 48
+})
+
+# Every block, by name in GLSL: its binding point and layout. Programs bind
+# whichever they declare when linked.
+UNIFORM_BLOCKS = {
+    "FrameData": (FRAME_DATA_BINDING, FRAME_DATA_DTYPE),
+    "LightData": (LIGHT_DATA_BINDING, LIGHT_DATA_DTYPE)
+}
+
+def pack_mat4(matrix: glm.mat4) -> np.ndarray:
+    """
+    Converts a glm matrix to the column major layout of std140.
+
+    Parameters
+    ----------
+    matrix : glm.mat4
+        The matrix.
+
+    Returns
+    -------
+    np.ndarray
+        The matrix, of shape (4, 4), indexed [column][row].
+
+    """
+
+    # NumPy reads glm matrices row by row
+    return np.array(matrix, dtype=np.float32).T
+
+def member_offsets(dtype: np.dtype, prefix: str = "", base: int = 0) -> dict[str, int]:
+    """
+    Flattens a block layout into the names OpenGL reports for the block's
+    active members, ie, globalLight.position or pointLights[3].diffuse, and
+    their byte offsets.
+
+    Parameters
+    ----------
+    dtype : np.dtype
+        The block or struct layout.
+    prefix : str, optional
+        Prefix for member names. The default is "".
+    base : int, optional
+        Offset of the layout in the block. The default is 0.
+
+    Returns
+    -------
+    dict[str, int]
+        Offset of each member, by name.
+
+    """
+
+    offsets = {}
+    for name, (field, offset) in dtype.fields.items():
+        name = f"{prefix}{name}"
+        if field.names is not None:
+            offsets.update(member_offsets(field, f"{name}.", base + offset))
+        elif field.subdtype is not None and field.subdtype[0].names is not None:
+            element, shape = field.subdtype
+            for index in range(int(np.prod(shape))):
+                offsets.update(member_offsets(element, f"{name}[{index}].", base + offset + index * element.itemsize))
+        else:
+            # Arrays of basic types are reported once, as name[0]
+            offsets[name] = offsets[f"{name}[0]"] = base + offset
+    return offsets
+
+def bind_uniform_blocks(program: int):
+    """
+    Assigns each block a linked program declares to its binding point, after
+    checking the program's layout of the block matches ours. Blocks the
+    program does not declare, or optimised away, are skipped.
+
+    Parameters
+    ----------
+    program : int
+        The linked program's name.
+
+    Raises
+    ------
+    RuntimeError
+        If a block's size or any member's offset differs from its layout.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    for name, (binding, dtype) in UNIFORM_BLOCKS.items():
+        index = glGetUniformBlockIndex(program, name)
+        if index == GL_INVALID_INDEX:
+            continue
+
+        size = np.zeros(1, dtype=np.int32)
+        glGetActiveUniformBlockiv(program, index, GL_UNIFORM_BLOCK_DATA_SIZE, size)
+        # Drivers may or may not count the padding at the end of the block
+        if size[0] + -size[0] % 16 != dtype.itemsize:
+            raise RuntimeError(f"Uniform block {name} is {size[0]} bytes in program {program}, expected {dtype.itemsize}.")
+
+        # Check the offset of every active member against the layout
+        count = np.zeros(1, dtype=np.int32)
+        glGetActiveUniformBlockiv(program, index, GL_UNIFORM_BLOCK_ACTIVE_UNIFORMS, count)
+        indices = np.zeros(count[0], dtype=np.int32)
+        glGetActiveUniformBlockiv(program, index, GL_UNIFORM_BLOCK_ACTIVE_UNIFORM_INDICES, indices)
+        offsets = np.zeros(count[0], dtype=np.int32)
+        glGetActiveUniformsiv(program, count[0], indices.astype(np.uint32), GL_UNIFORM_OFFSET, offsets)
+
+        expected = member_offsets(dtype)
+        for uniform, offset in zip(indices.tolist(), offsets.tolist()):
+            member, _, _ = glGetActiveUniform(program, uniform)
+            member = member.decode() if isinstance(member, bytes) else member
+
+            # Some drivers prefix members with the block name
+            member = member.removeprefix(f"{name}.")
+            if expected.get(member) != offset:
+                raise RuntimeError(f"Uniform {member} of block {name} is at offset {offset} in program {program}, expected {expected.get(member)}.")
+
+        glUniformBlockBinding(program, index, binding)
+        logging.info(f"Bound uniform block {name} of program {program} to binding {binding}")
+
+"""
+UniformBuffer
+
+One buffer holding several std140 uniform blocks, each bound to its own
+binding point by range. Blocks are written through NumPy views of one CPU side
+copy, then the whole buffer is uploaded in a single glBufferSubData, so
+per frame uniforms cost one call however many programs read them.
+"""
+class UniformBuffer:
+    def __init__(self, blocks: list[str]):
+        """
+        Creates the buffer, and binds each block's range to its binding
+        point.
+
+        Parameters
+        ----------
+        blocks : list[str]
+            The names of the blocks to hold, from UNIFORM_BLOCKS.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Each block must start at a multiple of the driver's alignment
+        alignment = int(glGetIntegerv(GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT))
+        ranges = []
+        size = 0
+        for name in blocks:
+            size += -size % alignment
+            ranges.append((name, size))
+            size += UNIFORM_BLOCKS[name][1].itemsize
+
+        # Views of each block into the CPU side copy, of shape (1,)
+        self.storage = np.zeros(size, dtype=np.uint8)
+        self.blocks = {
+            name: np.frombuffer(self.storage, dtype=UNIFORM_BLOCKS[name][1], count=1, offset=offset)
+            for name, offset in ranges
+        }
+
+        self.id = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.id)
+        glBufferData(GL_UNIFORM_BUFFER, self.storage.nbytes, None, GL_DYNAMIC_DRAW)
+        for name, offset in ranges:
+            binding, dtype = UNIFORM_BLOCKS[name]
+            glBindBufferRange(GL_UNIFORM_BUFFER, binding, self.id, offset, dtype.itemsize)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """
+        Returns a block's data, to be written to before upload().
+
+        Parameters
+        ----------
+        name : str
+            The block name, ie, "FrameData".
+
+        Returns
+        -------
+        np.ndarray
+            The block, a structured array of shape (1,).
+
+        """
+
+        return self.blocks[name]
+
+    def upload(self):
+        """
+        Uploads every block.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        glBindBuffer(GL_UNIFORM_BUFFER, self.id)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.storage.nbytes, self.storage)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        PROFILER.count("uniform_buffer_uploads")
+
+    def __del__(self):
+        """
+        On all references descoping, delete the buffer.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        try:
+            glDeleteBuffers(1, self.id)
+        except:
+            pass
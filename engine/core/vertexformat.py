@@ -0,0 +1,196 @@
+import numpy as np
+from OpenGL.GL import GL_FLOAT, GL_HALF_FLOAT, GL_INT_2_10_10_10_REV, GL_UNSIGNED_SHORT, GL_UNSIGNED_INT
+
+# Vertex layouts a model can be drawn with: five separate float32 buffers, or
+# one interleaved, compressed buffer
+SEPARATE_LAYOUT = "separate"
+PACKED_LAYOUT = "packed"
+
+# The packed layout is 24 bytes per vertex, against 56 for separate buffers:
+#     position   float32 x3                 12 bytes
+#     normal     GL_INT_2_10_10_10_REV       4 bytes, w unused
+#     tangent    GL_INT_2_10_10_10_REV       4 bytes, w is bitangent handedness
+#     uv         float16 x2                  4 bytes
+# Bitangents are not stored, but rebuilt in the vertex shader as
+# cross(normal, tangent.xyz) * tangent.w.
+PACKED_VERTEX_DTYPE = np.dtype([
+    ("position", "<f4", 3),
+    ("normal", "<u4"),
+    ("tangent", "<u4"),
+    ("uv", "<f2", 2)
+])
+
+# Attributes of the packed layout, as (location, size, type, normalised,
+# offset). Locations match the separate layout; bitangents (location 4) are
+# absent.
+PACKED_VERTEX_ATTRIBUTES = [
+    (0, 3, GL_FLOAT, False, PACKED_VERTEX_DTYPE.fields["position"][1]),
+    (1, 4, GL_INT_2_10_10_10_REV, True, PACKED_VERTEX_DTYPE.fields["normal"][1]),
+    (3, 4, GL_INT_2_10_10_10_REV, True, PACKED_VERTEX_DTYPE.fields["tangent"][1]),
+    (2, 2, GL_HALF_FLOAT, False, PACKED_VERTEX_DTYPE.fields["uv"][1])
+]
+
+def compact_indices(indices: np.ndarray, vertex_count: int) -> (np.ndarray, int):
+    """
+    Converts indices to the narrowest type that can address every vertex:
+    uint16 for up to 65535 vertices, otherwise uint32.
+
+    Parameters
+    ----------
+    indices : np.ndarray
+        The indices, of any integer type and shape.
+    vertex_count : int
+        The number of vertices indexed.
+
+    Returns
+    -------
+    (np.ndarray, int)
+        The flat indices, and the matching GL type to draw them with.
+
+    """
+
+    if vertex_count <= 0xFFFF:
+        return np.ascontiguousarray(indices, dtype=np.uint16).reshape(-1), GL_UNSIGNED_SHORT
+    return np.ascontiguousarray(indices, dtype=np.uint32).reshape(-1), GL_UNSIGNED_INT
+
+def pack_snorm_2_10_10_10(xyz: np.ndarray, w: np.ndarray = None) -> np.ndarray:
+    """
+    Packs vectors into signed normalised 10:10:10:2 integers, as read by
+    GL_INT_2_10_10_10_REV attributes: x in bits 0-9, y in 10-19, z in 20-29,
+    and w in 30-31.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        Vectors with components in [-1, 1], of shape (N, 3).
+    w : np.ndarray, optional
+        W components in [-1, 1], of shape (N,). The default is None (0).
+
+    Returns
+    -------
+    np.ndarray
+        The packed vectors, of shape (N,), as uint32.
+
+    """
+
+    xyz = np.clip(np.asarray(xyz, dtype=np.float32), -1, 1)
+    components = np.rint(xyz * 511).astype(np.int32) & 0x3FF
+    packed = components[:, 0] | components[:, 1] << 10 | components[:, 2] << 20
+    if w is not None:
+        packed |= (np.rint(np.clip(w, -1, 1)).astype(np.int32) & 0x3) << 30
+    return packed.astype(np.uint32)
+
+def unpack_snorm_2_10_10_10(packed: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Unpacks signed normalised 10:10:10:2 integers as OpenGL does, the inverse
+    of pack_snorm_2_10_10_10().
+
+    Parameters
+    ----------
+    packed : np.ndarray
+        The packed vectors, of shape (N,).
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The vectors, of shape (N, 3), and w components, of shape (N,).
+
+    """
+
+    packed = np.asarray(packed, dtype=np.uint32).astype(np.int64)
+
+    # Sign extend each field from its width
+    def field(shift, bits):
+        value = (packed >> shift) & ((1 << bits) - 1)
+        return np.where(value >= 1 << (bits - 1), value - (1 << bits), value)
+
+    xyz = np.stack([field(shift, 10) for shift in (0, 10, 20)], axis=1) / 511
+    w = field(30, 2).astype(np.float32)
+    return np.maximum(xyz, -1).astype(np.float32), np.maximum(w, -1)
+
+def pack_vertices(
+    vertices: np.ndarray,
+    normals: np.ndarray,
+    texCoords: np.ndarray = None,
+    tangents: np.ndarray = None,
+    bitangents: np.ndarray = None
+) -> np.ndarray:
+    """
+    Interleaves and compresses a mesh's vertex attributes into the packed
+    layout. Missing attributes are filled with zeros.
+
+    Parameters
+    ----------
+    vertices : np.ndarray
+        Positions, flat or of shape (N, 3).
+    normals : np.ndarray
+        Unit normals, flat or of shape (N, 3).
+    texCoords : np.ndarray, optional
+        Texture coordinates of the first channel, flat or of shape (N, 2).
+        The default is None.
+    tangents : np.ndarray, optional
+        Unit tangents, flat or of shape (N, 3). The default is None.
+    bitangents : np.ndarray, optional
+        Bitangents, flat or of shape (N, 3), only used for their handedness.
+        The default is None.
+
+    Returns
+    -------
+    np.ndarray
+        The packed vertices, of dtype PACKED_VERTEX_DTYPE and shape (N,).
+
+    """
+
+    positions = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+    count = len(positions)
+
+    def attribute(data, size):
+        data = np.asarray(data if data is not None else [], dtype=np.float32).reshape(-1)
+        if len(data) < count * size:
+            return np.zeros((count, size), dtype=np.float32)
+
+        # Further texture coordinate channels follow the first
+        return data[:count * size].reshape(count, size)
+
+    normals = attribute(normals, 3)
+    tangents = attribute(tangents, 3)
+    bitangents = attribute(bitangents, 3)
+
+    # Handedness is whether the stored bitangent agrees with the one rebuilt
+    # from the normal and tangent
+    handedness = np.where(np.einsum("ij,ij->i", np.cross(normals, tangents), bitangents) < 0, -1, 1)
+
+    packed = np.zeros(count, dtype=PACKED_VERTEX_DTYPE)
+    packed["position"] = positions
+    packed["normal"] = pack_snorm_2_10_10_10(normals)
+    packed["tangent"] = pack_snorm_2_10_10_10(tangents, handedness)
+    packed["uv"] = attribute(texCoords, 2)
+    return packed
+
+def unpack_vertices(packed: np.ndarray) -> dict:
+    """
+    Decodes packed vertices as the vertex shader sees them, ie, to check the
+    packing error against the original attributes.
+
+    Parameters
+    ----------
+    packed : np.ndarray
+        The packed vertices, as from pack_vertices().
+
+    Returns
+    -------
+    dict
+        Positions, normals, texture coordinates, tangents, and rebuilt
+        bitangents, each of shape (N, 3) or (N, 2).
+
+    """
+
+    normals, _ = unpack_snorm_2_10_10_10(packed["normal"])
+    tangents, handedness = unpack_snorm_2_10_10_10(packed["tangent"])
+    return {
+        "vertices": packed["position"].astype(np.float32),
+        "normals": normals,
+        "texCoords": packed["uv"].astype(np.float32),
+        "tangents": tangents,
+        "bitangents": np.cross(normals, tangents) * handedness[:, None]
+    }
@@ -1,9 +1,23 @@
 import glm
+import ctypes
 import logging
 import numpy as np
 from OpenGL.GL import *
-from engine.texture.material import Material
+from engine.texture.material import Material, get_default_map
 from engine.core.program import ShaderProgram
+from engine.config import CONFIG
+from engine.core.culling import CULLING_STATS, transform_aabbs, cull_aabbs
+from engine.core.profiler import PROFILER
+from engine.core.state import GL_STATE
+from engine.core.vertexformat import PACKED_LAYOUT, PACKED_VERTEX_DTYPE, PACKED_VERTEX_ATTRIBUTES, pack_vertices, compact_indices
+from engine.core.renderqueue import LIGHTING_PASS
+from engine.core.lod import LOD_SELECTOR
+from engine.core.bvh import INSTANCE_INDEX
+from engine.object.scenenode import SceneNode
+
+# Location of the first column of the per-instance model matrix attribute.
+# A mat4 attribute takes four consecutive locations, one per column.
+INSTANCE_MATRIX_LOCATION = 5
 
 """
 Mesh
@@ -11,7 +25,7 @@ Mesh
 Creates and stores VAO and VBO data, and manages rendering, for each mesh
 """
 class Mesh:
-    def __init__(self, parent, data: dict, material: Material):
+    def __init__(self, parent, data: dict, material: Material, node: SceneNode = None):
         """
         Initialises mesh properties, then calls to bind the mesh. 
 
@@ -23,6 +37,9 @@ class Mesh:
             Dictionary passed from the model for this mesh containing all data
         material : Material
             The material and textures with which to render this mesh.
+        node : SceneNode, optional
+            The node of the model's hierarchy placing the mesh in model space.
+            The default is None (no transform).
 
         Returns
         -------
@@ -30,25 +47,78 @@ class Mesh:
 
         """
         
-        # The JSON format captures vertex indices in a 2D array, so we unpack
-        self.indices = np.array(data['faces']).flatten()
-        self.vertices = np.array(data['vertices'], dtype=np.float32)
-        self.normals = np.array(data['normals'], dtype=np.float32)
+        # Arrays may already be NumPy arrays when loaded from the model cache,
+        # in which case asarray avoids a copy
+        self.vertices = np.asarray(data['vertices'], dtype=np.float32)
+        
+        # The JSON format captures vertex indices in a 2D array, so we unpack.
+        # Indices are stored in the narrowest type that addresses every vertex,
+        # and drawn with the matching type. Simplified levels of detail (lod1,
+        # lod2, ...) index the same vertices, so follow the full detail indices
+        # in one buffer. The byte offset and count of each level are kept so
+        # draws never touch the array.
+        levels = [np.asarray(data['faces']).reshape(-1)]
+        while f"lod{len(levels)}" in data:
+            levels.append(np.asarray(data[f"lod{len(levels)}"]).reshape(-1))
+        self.indices, self.index_type = compact_indices(np.concatenate(levels), self.vertices.size // 3)
+        self.lod_index_counts = np.array([len(level) for level in levels])
+        offsets = np.concatenate([[0], np.cumsum(self.lod_index_counts)[:-1]]) * self.indices.itemsize
+        self.lods = [(int(offset), int(count)) for offset, count in zip(offsets, self.lod_index_counts)]
+        self.index_count = self.lods[0][1]
+        self.normals = np.asarray(data['normals'], dtype=np.float32)
         
         # The JSON format may not contain texturecoords, tangents, or bitangents
-        self.texCoords = np.array(data['texturecoords'], dtype=np.float32) if "texturecoords" in data else np.array([])
-        self.tangents = np.array(data['tangents'], dtype=np.float32) if "tangents" in data else np.array([])
-        self.bitangents = np.array(data['bitangents'], dtype=np.float32) if "bitangents" in data else np.array([])
+        self.texCoords = np.asarray(data['texturecoords'], dtype=np.float32) if "texturecoords" in data else np.array([])
+        self.tangents = np.asarray(data['tangents'], dtype=np.float32) if "tangents" in data else np.array([])
+        self.bitangents = np.asarray(data['bitangents'], dtype=np.float32) if "bitangents" in data else np.array([])
+        
+        # Local bounding volumes, for culling: an axis aligned box, and a
+        # sphere around the box's centre
+        points = self.vertices.reshape(-1, 3)
+        self.aabb_min = points.min(axis=0) if len(points) else np.zeros(3, dtype=np.float32)
+        self.aabb_max = points.max(axis=0) if len(points) else np.zeros(3, dtype=np.float32)
+        self.bounding_center = (self.aabb_min + self.aabb_max) / 2
+        self.bounding_radius = float(np.linalg.norm(points - self.bounding_center, axis=1).max()) if len(points) else 0.
+        
+        # Transforms are shared with the parent model, which builds all model
+        # matrices in one batch and caches them until the transforms change
+        self.transforms = parent.transforms
+        self.node = node or SceneNode()
+        
+        # Each instance's matrix is the model's world matrix, then the
+        # instance's transform, then the mesh's node in the model. The
+        # matrices are cached until any of those change, when the instance
+        # version is incremented.
+        self.instance_key = None
+        self.instance_matrices = None
+        self.instance_data = None
+        self.instance_version = 0
+        
+        # Instance version and order of instances last uploaded to the
+        # per-instance attribute buffer, and how many matrices it can hold
+        self.uploaded_version = None
+        self.uploaded_order = None
+        self.instance_capacity = 0
+        
+        # Level of detail each instance was last drawn at, for hysteresis
+        self.instance_lods = None
         
-        # Initialise transforms as empty to start
-        self.transforms = np.array([])
+        # World space bounds of each instance, and the version they match
+        self.world_centers = None
+        self.world_extents = None
+        self.bounds_version = None
         
         self.material = material
 
         self.parent = parent
         
+        # Whether vertices are interleaved and compressed in one buffer
+        self.packed = parent.vertex_layout == PACKED_LAYOUT
+        
         self.VAO = 0
+        self.depthVAO = 0
         self.VBOs = {}
+        self.instanceVBO = 0
         
         self.bind()
         
@@ -66,7 +136,7 @@ class Mesh:
         
         # Generate and bind new VAO
         self.VAO = glGenVertexArrays(1)
-        glBindVertexArray(self.VAO)
+        GL_STATE.bind_vertex_array(self.VAO)
         
         # Generate and bind EBO, then fill it with the mesh's indices
         # GL_STATIC_DRAW is used as the indices themselves won't change
@@ -74,16 +144,28 @@ class Mesh:
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
         glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indices, GL_STATIC_DRAW)
         
-        # Generate, bind, and fill each VBO, with vector sizes given
-        self.bindVBO("pos", self.vertices, 3)
-        self.bindVBO("aNormal", self.normals, 3)
-        self.bindVBO("aTexCoords", self.texCoords, 2)
-        self.bindVBO("aTangent", self.tangents, 3)
-        self.bindVBO("aBitangent", self.bitangents, 3)
+        # Generate, bind, and fill each VBO, with vector sizes given, or one
+        # VBO of packed vertices
+        if self.packed:
+            self.bindPackedVBO()
+        else:
+            self.bindVBO("pos", self.vertices, 3)
+            self.bindVBO("aNormal", self.normals, 3)
+            self.bindVBO("aTexCoords", self.texCoords, 2)
+            self.bindVBO("aTangent", self.tangents, 3)
+            self.bindVBO("aBitangent", self.bitangents, 3)
+        
+        # Generate the per-instance model matrix buffer. It is filled when
+        # transforms are first drawn instanced.
+        self.bindInstanceVBO()
+        
+        # Generate a second VAO for depth only passes, reading only positions,
+        # instance matrices and indices from the same buffers
+        self.bindDepthVAO()
         
         # Unbind VAO and VBO (optional)
         glBindBuffer(GL_ARRAY_BUFFER, 0)
-        glBindVertexArray(0)
+        GL_STATE.bind_vertex_array(0)
         
     def genVBO(self, name: str) -> (int, int):
         """
@@ -147,9 +229,226 @@ class Mesh:
         # Enable the attribute array at the location
         glEnableVertexAttribArray(location)
 
+    def bindPackedVBO(self):
+        """
+        Interleaves and compresses the mesh's attributes into one VBO, and
+        sets up each attribute to read from it. Attribute locations match the
+        separate VBOs, except bitangents, which the vertex shader rebuilds from
+        the normal, tangent, and tangent handedness.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        vertices = pack_vertices(self.vertices, self.normals, self.texCoords, self.tangents, self.bitangents)
+        vBO, _ = self.genVBO("packed")
+        glBindBuffer(GL_ARRAY_BUFFER, vBO)
+        glBufferData(GL_ARRAY_BUFFER, vertices, GL_STATIC_DRAW)
+        
+        for location, size, type, normalised, offset in PACKED_VERTEX_ATTRIBUTES:
+            glVertexAttribPointer(location,
+                                  size,
+                                  type,
+                                  normalised,
+                                  vertices.itemsize,
+                                  ctypes.c_void_p(offset))
+            glEnableVertexAttribArray(location)
+        
+    def bindInstanceVBO(self):
+        """
+        Generates the per-instance model matrix buffer and sets up its
+        attribute. A mat4 attribute is four vec4 columns at consecutive
+        locations, each advancing once per instance rather than per vertex.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.instanceVBO = glGenBuffers(1)
+        self.setInstanceAttributes()
+        
+    def setInstanceAttributes(self):
+        """
+        Sets up the per-instance model matrix attribute of the bound VAO to
+        read from the instance buffer.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        glBindBuffer(GL_ARRAY_BUFFER, self.instanceVBO)
+        
+        # Each instance is 64 bytes: four columns of four floats
+        for column in range(4):
+            location = INSTANCE_MATRIX_LOCATION + column
+            glVertexAttribPointer(location,
+                                  4,
+                                  GL_FLOAT,
+                                  False,
+                                  64,
+                                  ctypes.c_void_p(column * 16))
+            glVertexAttribDivisor(location, 1)
+            glEnableVertexAttribArray(location)
+            
+    def bindDepthVAO(self):
+        """
+        Generates a VAO for depth only passes (ie, shadows), which read only
+        positions. It shares the position, instance, and index buffers with
+        the main VAO, so costs no extra vertex memory, but the vertex shader
+        fetches one attribute instead of five.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.depthVAO = glGenVertexArrays(1)
+        GL_STATE.bind_vertex_array(self.depthVAO)
+        
+        # The element buffer binding is part of VAO state
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
+        
+        # Positions at location 0, as in the main VAO. Packed positions are
+        # the first attribute of each vertex.
+        if self.packed:
+            glBindBuffer(GL_ARRAY_BUFFER, self.VBOs["packed"])
+            glVertexAttribPointer(0, 3, GL_FLOAT, False, PACKED_VERTEX_DTYPE.itemsize, None)
+        else:
+            glBindBuffer(GL_ARRAY_BUFFER, self.VBOs["pos"])
+            glVertexAttribPointer(0, 3, GL_FLOAT, False, 0, None)
+        glEnableVertexAttribArray(0)
+        
+        self.setInstanceAttributes()
+        
+    def uploadInstances(self, instance_data: np.ndarray, order: np.ndarray = None):
+        """
+        Uploads packed model matrices to the instance buffer, growing it if
+        needed. The buffer uses GL_DYNAMIC_DRAW, as transforms may change.
+
+        Parameters
+        ----------
+        instance_data : np.ndarray
+            Column major model matrices, of shape (N, 4, 4).
+        order : np.ndarray, optional
+            The instances instance_data was gathered from, in order, recorded
+            so unchanged visibility and levels of detail do not re-upload. The
+            default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        glBindBuffer(GL_ARRAY_BUFFER, self.instanceVBO)
+        if len(instance_data) > self.instance_capacity:
+            glBufferData(GL_ARRAY_BUFFER, instance_data, GL_DYNAMIC_DRAW)
+            self.instance_capacity = len(instance_data)
+        else:
+            glBufferSubData(GL_ARRAY_BUFFER, 0, instance_data)
+        self.uploaded_version = self.instance_version
+        self.uploaded_order = order
+        
+    def get_instance_matrices(self) -> np.ndarray:
+        """
+        Returns the world matrix of every instance, rebuilding them only if
+        the instance transforms, the model's node, or the mesh's node have
+        changed. Identity nodes (ie, most) cost nothing.
+
+        Returns
+        -------
+        np.ndarray
+            The matrices, of shape (N, 4, 4), row major.
+
+        """
+        
+        matrices = self.transforms.get_matrices(self.parent.up, self.parent.right)
+        key = (self.transforms.cache_key, self.parent.get_world_version(), self.node.get_world_version())
+        if key != self.instance_key:
+            if self.parent.world_is_identity and self.node.world_is_identity:
+                self.instance_matrices = matrices
+                self.instance_data = self.transforms.instance_data
+            else:
+                if not self.parent.world_is_identity:
+                    matrices = self.parent.world_matrix @ matrices
+                if not self.node.world_is_identity:
+                    matrices = matrices @ self.node.world_matrix
+                self.instance_matrices = matrices
+                
+                # OpenGL expects matrices column by column
+                self.instance_data = np.ascontiguousarray(matrices.transpose(0, 2, 1))
+            self.instance_key = key
+            self.instance_version += 1
+        return self.instance_matrices
+    
+    def get_instance_data(self) -> np.ndarray:
+        """
+        Returns the world matrices of every instance packed column major, as
+        expected by OpenGL for uniforms and instance attributes.
+
+        Returns
+        -------
+        np.ndarray
+            The packed matrices, of shape (N, 4, 4).
+
+        """
+        
+        self.get_instance_matrices()
+        return self.instance_data
+        
+    def get_world_bounds(self) -> (np.ndarray, np.ndarray):
+        """
+        Returns the world space bounding box of each instance, recomputed only
+        when transforms change.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray)
+            Box centres and half extents, each of shape (N, 3).
+
+        """
+        
+        matrices = self.get_instance_matrices()
+        if self.bounds_version != self.instance_version:
+            self.world_centers, self.world_extents = transform_aabbs(matrices, self.aabb_min, self.aabb_max)
+            self.bounds_version = self.instance_version
+        return self.world_centers, self.world_extents
+    
+    def cull(self, frustum: np.ndarray) -> np.ndarray:
+        """
+        Tests every instance's bounds against a frustum.
+
+        Parameters
+        ----------
+        frustum : np.ndarray
+            Frustum planes, of shape (6, 4).
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask of visible instances.
+
+        """
+        
+        centers, extents = self.get_world_bounds()
+        
+        # In large scenes, the scene's index answers each frustum once for
+        # every mesh
+        visible = INSTANCE_INDEX.cull(self, frustum)
+        if visible is not None:
+            return visible
+        return cull_aabbs(frustum, centers, extents)
+
     def set_transforms(self, transforms: list[dict[str, glm.vec3]]):
         """
-        Set the mesh's transforms. 
+        Set the mesh's transforms, which are shared with its parent model.
         Each transform must be a dict of the following shape:
             
                 {
@@ -169,11 +468,42 @@ class Mesh:
 
         """
         
-        self.transforms = np.array(transforms)
+        self.transforms.set_dicts(transforms)
+        
+    def prepare(self, frustum: np.ndarray = None) -> (np.ndarray, np.ndarray):
+        """
+        Culls the mesh's instances against a frustum, ready to draw.
+
+        Parameters
+        ----------
+        frustum : np.ndarray, optional
+            Frustum planes, of shape (6, 4). If given, only instances inside
+            the frustum are drawn. The default is None.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray)
+            Column major model matrices of every instance, and a boolean mask
+            of visible instances (or None for all), or None if no instance is
+            visible.
+
+        """
+        
+        instance_data = self.get_instance_data()
+        visible = None
+        if frustum is not None and len(instance_data):
+            visible = self.cull(frustum)
+            drawn = int(np.count_nonzero(visible))
+            CULLING_STATS.record(drawn, len(instance_data) - drawn)
+            if drawn == 0:
+                return None
+            if drawn == len(instance_data):
+                visible = None
+        return instance_data, visible
     
-    def draw(self, program: ShaderProgram):
+    def bind_material(self, program: ShaderProgram):
         """
-        Draws the mesh with the given shader program.
+        Binds the mesh's material textures and sets its uniforms.
 
         Parameters
         ----------
@@ -186,62 +516,234 @@ class Mesh:
 
         """
         
-        # First step: iterate through the textures of the material (for where
-        # they exist) and bind them to texture units. We then inform the shader
-        # being used to draw the mesh the texture unit to use for each texture.
+        # Iterate through the textures of the material and bind them to
+        # texture units. We then inform the shader being used to draw the mesh
+        # the texture unit to use for each texture. Textures already bound to
+        # their unit (ie, by a previous mesh with the same material) are not
+        # rebound. Maps the material does not define are bound to neutral
+        # stand-ins, so no previous mesh's map is left on their unit, and the
+        # order meshes are drawn in cannot change how they look.
         
-        glActiveTexture(GL_TEXTURE1)
         program.setInt('mat.diffuseMap', 1)
-        self.material.diffuse.bind()
+        self.material.diffuse.bind(1)
         
-        if self.material.normal:
-            glActiveTexture(GL_TEXTURE2)
-            program.setInt('mat.normalMap', 2)
-            self.material.normal.bind()
+        program.setInt('mat.normalMap', 2)
+        (self.material.normal or get_default_map("normal")).bind(2)
 
-        if self.material.specular:
-            glActiveTexture(GL_TEXTURE3)
-            program.setInt('mat.specularMap', 3)
-            self.material.specular.bind()
+        program.setInt('mat.specularMap', 3)
+        (self.material.specular or get_default_map("specular")).bind(3)
                 
-        if self.material.depth:
-            glActiveTexture(GL_TEXTURE4)
-            program.setInt('mat.depthMap', 4)
-            self.material.depth.bind()
+        program.setInt('mat.depthMap', 4)
+        (self.material.depth or get_default_map("depth")).bind(4)
             
         # We also set specular exponent and parallax height scale in the shader
         program.setFloat('mat.shininess', self.material.shininess)
         program.setFloat('mat.heightScale', self.material.height_scale)
         
-        # Bind VAO to begin rendering
-        glBindVertexArray(self.VAO)
-        
-        # For each transform...
-        for trf in self.transforms:
-            # We construct a model matrix from the transform.
-            model = glm.mat4()
-            model = glm.translate(model, trf["position"]);
-            model = glm.rotate(model, trf["rotation"].x, self.parent.up)
-            model = glm.rotate(model, trf["rotation"].y, self.parent.right)
-            model = glm.scale(model, trf["scale"])
+    def bind_geometry(self, program: ShaderProgram):
+        """
+        Binds the mesh's VAO, and tells the shader whether to rebuild
+        bitangents from packed vertices.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The shader program to use
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        program.setInt('packedVertices', int(self.packed))
+        GL_STATE.bind_vertex_array(self.VAO)
+        
+    def bind_depth_geometry(self):
+        """
+        Binds the mesh's position only VAO.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        GL_STATE.bind_vertex_array(self.depthVAO)
+        
+    def submit(self, queue, program: ShaderProgram, render_pass: int, frustum: np.ndarray = None):
+        """
+        Culls the mesh's instances, and queues any visible to be drawn.
+
+        Parameters
+        ----------
+        queue : RenderQueue
+            The queue to submit to.
+        program : ShaderProgram
+            The shader program to use
+        render_pass : int
+            The pass, ie, LIGHTING_PASS.
+        frustum : np.ndarray, optional
+            Frustum planes, of shape (6, 4). The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        prepared = self.prepare(frustum)
+        if prepared is None:
+            return
+        
+        # Levels of detail are picked from the camera, so only for the pass
+        # it sees. Shadows keep full detail, so cached shadow maps do not
+        # depend on where the camera is.
+        lods = LOD_SELECTOR.select(self, prepared[1]) if render_pass == LIGHTING_PASS else None
+        queue.submit(self, program, render_pass, *prepared, lods)
+        
+    def submit_depth(self, queue, program: ShaderProgram, frustum: np.ndarray = None):
+        """
+        Culls the mesh's instances, and queues any visible to be drawn depth
+        only, without material.
+
+        Parameters
+        ----------
+        queue : RenderQueue
+            The queue to submit to.
+        program : ShaderProgram
+            The depth shader program to use
+        frustum : np.ndarray, optional
+            Frustum planes, of shape (6, 4). The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        prepared = self.prepare(frustum)
+        if prepared is not None:
+            queue.submit_depth(self, program, *prepared)
+            
+    def draw_depth(self, program: ShaderProgram, frustum: np.ndarray = None):
+        """
+        Draws the mesh's depth only, immediately, with no material state and
+        only positions bound.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The depth shader program to use
+        frustum : np.ndarray, optional
+            Frustum planes, of shape (6, 4). The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        prepared = self.prepare(frustum)
+        if prepared is None:
+            return
+        
+        self.bind_depth_geometry()
+        self.draw_instances(program, *prepared)
+        
+    def draw(self, program: ShaderProgram, frustum: np.ndarray = None):
+        """
+        Draws the mesh with the given shader program immediately.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The shader program to use
+        frustum : np.ndarray, optional
+            Frustum planes, of shape (6, 4). If given, only instances inside
+            the frustum are drawn. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        # Cull instances outside the frustum first, so meshes with nothing
+        # visible do no binding work at all
+        prepared = self.prepare(frustum)
+        if prepared is None:
+            return
+        
+        self.bind_material(program)
+        self.bind_geometry(program)
+        self.draw_instances(program, *prepared)
+        
+    def draw_instances(self, program: ShaderProgram, instance_data: np.ndarray, visible: np.ndarray = None, lods: np.ndarray = None):
+        """
+        Issues the draw calls for the mesh's instances. The VAO and any
+        material state must already be bound.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The shader program to use
+        instance_data : np.ndarray
+            Column major model matrices of every instance, of shape (N, 4, 4).
+        visible : np.ndarray, optional
+            Boolean mask of instances to draw. The default is None (all).
+        lods : np.ndarray, optional
+            The level of detail of every instance, of shape (N,). The default
+            is None (full detail).
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        # Instances to draw, grouped by level of detail so each level's
+        # instances are contiguous
+        order = np.arange(len(instance_data)) if visible is None else np.flatnonzero(visible)
+        if lods is not None:
+            order = order[np.argsort(lods[order], kind="stable")]
+        count = len(order)
+        
+        # With many transforms, draw every instance of a level in one call,
+        # reading model matrices from the instance buffer. The buffer holds
+        # only the instances drawn, so is re-uploaded when transforms,
+        # visibility or levels change.
+        if count >= CONFIG["instancing_threshold"]:
+            if self.uploaded_version != self.instance_version or not np.array_equal(order, self.uploaded_order):
+                self.uploadInstances(instance_data[order], order)
+            program.setInt('instanced', 1)
+            if lods is None:
+                PROFILER.count("draw_calls")
+                glDrawElementsInstanced(GL_TRIANGLES, self.index_count, self.index_type, None, count)
+                return
+            
+            # Each level starts at its first instance in the buffer
+            starts = np.searchsorted(lods[order], np.arange(len(self.lods) + 1))
+            for level, (offset, index_count) in enumerate(self.lods):
+                instances = int(starts[level + 1] - starts[level])
+                if instances:
+                    PROFILER.count("draw_calls")
+                    glDrawElementsInstancedBaseInstance(GL_TRIANGLES, index_count, self.index_type, ctypes.c_void_p(offset), instances, int(starts[level]))
+            return
+        
+        # Otherwise, for a few transforms, setting the model matrix uniform for
+        # each is cheaper than maintaining the instance buffer
+        program.setInt('instanced', 0)
+        for index in order:
+            offset, index_count = self.lods[lods[index] if lods is not None else 0]
             
-            # Set the completed model matrix in the shader
-            program.setMat4('model', model)
+            # Set the model matrix in the shader
+            program.setMat4('model', instance_data[index])
             
             # Draw!
-            glDrawElements(GL_TRIANGLES, len(self.indices), GL_UNSIGNED_INT, None)
-            
-        # As a side note, this could be replaced by instanced rendering when
-        # the number of transforms are high, and in fact it used to be used for
-        # all rendering. For a smaller demo scene, however, I realised there was
-        # a performance hit.
-        
-        # Manually setting the model uniform in the shader is also inefficient.
-        # In future, this could be replaced with a Uniform Buffer Object of
-        # model matrices, but implementing this using 4x4 matrices as the data
-        # type was difficult and too time consuming.
+            PROFILER.count("draw_calls")
+            glDrawElements(GL_TRIANGLES, index_count, self.index_type, ctypes.c_void_p(offset))
             
-
     def __del__(self):
         """
         On all references descoping, delete the VAO, EBO, and all VBOs.
@@ -252,8 +754,12 @@ class Mesh:
 
         """
         try:
+            GL_STATE.forget_vertex_array(self.VAO)
+            GL_STATE.forget_vertex_array(self.depthVAO)
             glDeleteVertexArrays(1, self.VAO)
+            glDeleteVertexArrays(1, self.depthVAO)
             glDeleteBuffers(1, self.EBO)
+            glDeleteBuffers(1, self.instanceVBO)
             for name in list(self.VBOs.keys()):
                 glDeleteBuffers(1, self.VBOs.pop(name))
         except:
@@ -1,10 +1,14 @@
 import os
-import json
 import glm
+import numpy as np
 from engine.object.mesh import Mesh 
 from engine.object.sceneobject import SceneObject
+from engine.object.scenenode import SceneNode
 from engine.texture.material import Material
 from engine.core.program import ShaderProgram
+from engine.core.modelcache import load_model
+from engine.core.transforms import TransformStore
+from engine.config import CONFIG
 
 """
 Model
@@ -13,7 +17,7 @@ Inherits from SceneObject.
 Loads model JSON object from file, and creates and stores meshes.
 """
 class Model(SceneObject):
-    def __init__(self, path: str, materials: list[Material] = None):
+    def __init__(self, path: str, materials: list[Material] = None, dynamic: bool = False, vertex_layout: str = None):
         """
         Calls superclass constructor, loads data from path, and creates meshes
         with given materials.
@@ -25,6 +29,14 @@ class Model(SceneObject):
         materials : list[Material], optional
             A list of materials, where the mesh's materialindex will fetch the
             element of the same index in this list. The default is None.
+        dynamic : bool, optional
+            Whether the model's transforms change during the scene. Static
+            models may be cached by effects such as shadows. The default is
+            False.
+        vertex_layout : str, optional
+            How vertex attributes are stored on the GPU: "separate" float32
+            buffers, or one interleaved, compressed "packed" buffer of less
+            than half the size. The default is None (as configured).
 
         Raises
         ------
@@ -45,17 +57,31 @@ class Model(SceneObject):
         
         # Initialise empty meshes list
         self.meshes = []
+        self.vertex_layout = vertex_layout or CONFIG["vertex_layout"]
+        
+        # Instance transforms, shared by every mesh in the model
+        self.transforms = TransformStore()
+        self.dynamic = dynamic
 
         # Load data
         data = self.load_data(path)
         
+        # The model's node hierarchy, in model space. Each mesh is placed by
+        # the first node listing it, or the root if none does.
+        self.hierarchy = SceneNode.from_assimp(data["rootnode"]) if "rootnode" in data else SceneNode(path)
+        mesh_nodes = {}
+        for node in self.hierarchy.walk():
+            for index in node.mesh_indices:
+                mesh_nodes.setdefault(index, node)
+        
         # Iterate through meshes
-        for mesh_data in data['meshes']:
+        for index, mesh_data in enumerate(data['meshes']):
+            node = mesh_nodes.get(index, self.hierarchy)
             
             # If we have materials supplied, and the mesh has a materialindex,
             # use the supplied material at that index
             if materials and "materialindex" in mesh_data:
-                self.meshes.append(Mesh(self, mesh_data, materials[mesh_data["materialindex"]]))
+                self.meshes.append(Mesh(self, mesh_data, materials[mesh_data["materialindex"]], node))
             else:
                 # Otherwise use a default material
                 default = Material(
@@ -65,11 +91,12 @@ class Model(SceneObject):
                     "depth.jpg",
                     height_scale=0.12
                 )
-                self.meshes.append(Mesh(self, mesh_data, default))
+                self.meshes.append(Mesh(self, mesh_data, default, node))
         
     def load_data(self, path: str) -> dict:
         """
-        Load dictionary of model from JSON source file.
+        Load dictionary of model from JSON source file, or from its binary
+        cache if up to date.
 
         Parameters
         ----------
@@ -79,7 +106,8 @@ class Model(SceneObject):
         Returns
         -------
         dict
-            The loaded JSON as a Python dict.
+            The loaded model as a Python dict. Mesh arrays may be lists or
+            NumPy arrays.
 
         """
         
@@ -87,10 +115,10 @@ class Model(SceneObject):
         # for human inspection and in file loading. We use Assimp2JSON, a CLI
         # command to convert OBJs to JSON files, which also computes certain
         # elements not found in OBJs by default.
-        data = None
-        with open(path) as file:
-            data = json.load(file)
-        return data       
+        # Parsing the JSON is slow for large models, so after the first load
+        # the mesh arrays are memory mapped from a binary cache, which is
+        # rebuilt whenever the JSON source changes.
+        return load_model(path)
 
     def set_transforms(self, transforms: list[dict[str, glm.vec3]]):
         """
@@ -115,10 +143,54 @@ class Model(SceneObject):
 
         """
         
-        for mesh in self.meshes:
-            mesh.set_transforms(transforms)
+        self.transforms.set_dicts(transforms)
+        
+    def set_transform_arrays(self, positions: np.ndarray, rotations: np.ndarray = None, scales: np.ndarray = None):
+        """
+        Sets the transforms of each mesh in the model from arrays, avoiding
+        the per-transform overhead of dicts. Prefer this for many instances.
 
-    def draw(self, program: ShaderProgram):
+        Parameters
+        ----------
+        positions : np.ndarray
+            Positions, of shape (N, 3).
+        rotations : np.ndarray, optional
+            Rotations, of shape (N, 3) or (3,). The default is None (no
+            rotation).
+        scales : np.ndarray, optional
+            Scales, of shape (N, 3), (3,), or a scalar. The default is None
+            (unit scale).
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.transforms.set_arrays(positions, rotations, scales)
+
+    @property
+    def transform_version(self) -> tuple:
+        """
+        Returns the versions of everything placing the model's meshes: its
+        instance transforms, its node in the scene graph, and the nodes of its
+        hierarchy. Any change to these changes the result, so caches can
+        cheaply check whether the model has moved.
+
+        Returns
+        -------
+        tuple
+            The transform version.
+
+        """
+        
+        return (
+            self.transforms.version,
+            self.get_world_version(),
+            tuple(mesh.node.get_world_version() for mesh in self.meshes)
+        )
+
+    def draw(self, program: ShaderProgram, frustum: np.ndarray = None):
         """
         Draw each mesh in the model with a given shader.
 
@@ -126,6 +198,77 @@ class Model(SceneObject):
         ----------
         program : ShaderProgram
             The shader to draw each mesh with.
+        frustum : np.ndarray, optional
+            Frustum planes to cull instances against. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        for mesh in self.meshes:
+            mesh.draw(program, frustum)
+            
+    def submit(self, queue, program: ShaderProgram, render_pass: int, frustum: np.ndarray = None):
+        """
+        Queue each mesh in the model to be drawn with a given shader, culling
+        instances first.
+
+        Parameters
+        ----------
+        queue : RenderQueue
+            The queue to submit to.
+        program : ShaderProgram
+            The shader to draw each mesh with.
+        render_pass : int
+            The pass, ie, LIGHTING_PASS.
+        frustum : np.ndarray, optional
+            Frustum planes to cull instances against. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        for mesh in self.meshes:
+            mesh.submit(queue, program, render_pass, frustum)
+            
+    def draw_depth(self, program: ShaderProgram, frustum: np.ndarray = None):
+        """
+        Draw each mesh in the model depth only (ie, for shadows), skipping all
+        material state.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The depth shader to draw each mesh with.
+        frustum : np.ndarray, optional
+            Frustum planes to cull instances against. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        for mesh in self.meshes:
+            mesh.draw_depth(program, frustum)
+            
+    def submit_depth(self, queue, program: ShaderProgram, frustum: np.ndarray = None):
+        """
+        Queue each mesh in the model to be drawn depth only, culling instances
+        first. Depth items from every model are sorted together by VAO.
+
+        Parameters
+        ----------
+        queue : RenderQueue
+            The queue to submit to.
+        program : ShaderProgram
+            The depth shader to draw each mesh with.
+        frustum : np.ndarray, optional
+            Frustum planes to cull instances against. The default is None.
 
         Returns
         -------
@@ -134,7 +277,7 @@ class Model(SceneObject):
         """
         
         for mesh in self.meshes:
-            mesh.draw(program)
+            mesh.submit_depth(queue, program, frustum)
 
     def __del__(self):
         """
@@ -0,0 +1,227 @@
+import numpy as np
+
+IDENTITY = np.eye(4, dtype=np.float32)
+
+"""
+SceneNode
+
+A node of the scene graph, with a local transform relative to its parent.
+
+World matrices are cached, and recomputed only when the node's local
+transform, or that of an ancestor, has changed. Changing a transform marks the
+node and its descendants dirty, stopping at any already dirty (whose
+descendants must be dirty too), so both marking and recomputing cost only
+what changed. Each recompute increments the node's version, which renderers
+and caches can compare cheaply to tell whether the node has moved.
+"""
+class SceneNode:
+    def __init__(self, name: str = "", matrix: np.ndarray = None):
+        """
+        Initialises a node with no parent or children.
+
+        Parameters
+        ----------
+        name : str, optional
+            The node's name. The default is "".
+        matrix : np.ndarray, optional
+            The local transform, of shape (4, 4), row major (ie, M[:3, 3] is
+            the translation). The default is None (identity).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.name = name
+        self.parent = None
+        self.children = []
+
+        self.local_matrix = IDENTITY if matrix is None else np.asarray(matrix, dtype=np.float32).reshape(4, 4)
+        self.world_matrix = IDENTITY
+        self.world_is_identity = True
+
+        # Whether the world matrix is out of date, and the number of times it
+        # has been recomputed
+        self.dirty = True
+        self.version = 0
+
+        # Indices of the meshes placed at this node, if any
+        self.mesh_indices = []
+
+    @classmethod
+    def from_assimp(cls, data: dict) -> "SceneNode":
+        """
+        Builds a hierarchy from the rootnode of a model converted by
+        Assimp2JSON, each node of which has a name, a row major
+        transformation, the indices of its meshes, and its children.
+
+        Parameters
+        ----------
+        data : dict
+            The node, as loaded from JSON.
+
+        Returns
+        -------
+        SceneNode
+            The root of the hierarchy.
+
+        """
+
+        node = cls(data.get("name", ""), data.get("transformation"))
+        node.mesh_indices = list(data.get("meshes", []))
+        for child in data.get("children", []):
+            node.add_child(cls.from_assimp(child))
+        return node
+
+    def add_child(self, child: "SceneNode"):
+        """
+        Adds a child, removing it from its previous parent, if any.
+
+        Parameters
+        ----------
+        child : SceneNode
+            The child.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if child.parent is not None:
+            child.parent.remove_child(child)
+        child.parent = self
+        self.children.append(child)
+        child.invalidate()
+
+    def remove_child(self, child: "SceneNode"):
+        """
+        Removes a child, which becomes a root.
+
+        Parameters
+        ----------
+        child : SceneNode
+            The child.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.children.remove(child)
+        child.parent = None
+        child.invalidate()
+
+    def walk(self):
+        """
+        Iterates over the node and all its descendants, parents first.
+
+        Yields
+        ------
+        SceneNode
+            Each node.
+
+        """
+
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def find(self, name: str) -> "SceneNode":
+        """
+        Finds the first node with a name, among the node and its descendants.
+
+        Parameters
+        ----------
+        name : str
+            The name.
+
+        Returns
+        -------
+        SceneNode
+            The node, or None if there is none.
+
+        """
+
+        return next((node for node in self.walk() if node.name == name), None)
+
+    def set_local_matrix(self, matrix: np.ndarray):
+        """
+        Sets the local transform. Setting the same transform again does not
+        count as a change.
+
+        Parameters
+        ----------
+        matrix : np.ndarray
+            The local transform, of shape (4, 4), row major.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(4, 4)
+        if np.array_equal(matrix, self.local_matrix):
+            return
+        self.local_matrix = matrix.copy()
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Marks the node's world matrix, and those of its descendants, out of
+        date.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if not node.dirty:
+                node.dirty = True
+                stack.extend(node.children)
+
+    def get_world_matrix(self) -> np.ndarray:
+        """
+        Returns the world matrix, recomputing it (and those of any dirty
+        ancestors) only if out of date.
+
+        Returns
+        -------
+        np.ndarray
+            The world matrix, of shape (4, 4), row major.
+
+        """
+
+        if self.dirty:
+            if self.parent is None:
+                self.world_matrix = self.local_matrix
+            else:
+                self.world_matrix = self.parent.get_world_matrix() @ self.local_matrix
+            self.world_is_identity = np.array_equal(self.world_matrix, IDENTITY)
+            self.dirty = False
+            self.version += 1
+        return self.world_matrix
+
+    def get_world_version(self) -> int:
+        """
+        Returns the node's version, after bringing its world matrix up to
+        date. The version changes whenever the world matrix may have.
+
+        Returns
+        -------
+        int
+            The version.
+
+        """
+
+        self.get_world_matrix()
+        return self.version
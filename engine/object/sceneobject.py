@@ -1,15 +1,19 @@
 import glm
 import logging
+import numpy as np
 import engine.constants as constants
+from engine.object.scenenode import SceneNode
+from engine.core.transforms import compose_model_matrices
 
 from math import sin, cos, radians
 
 """
 SceneObject
 
-Base object for renderables in a scene. Holds axis and transform vectors.
+Base object for renderables in a scene. Holds axis and transform vectors, and
+is a node of the scene graph.
 """
-class SceneObject:
+class SceneObject(SceneNode):
     def __init__(self, name: str, position: glm.vec3 = None, rotation: glm.vec3 = None, scale: glm.vec3 = None):
         """
         Initialises scene object transform and axis vectors.
@@ -32,7 +36,7 @@ class SceneObject:
         """
         
         logging.info(f"Instantiating scene object {name}")
-        self.name = name
+        super().__init__(name)
         
         # For each transform vector, if none was passed, set it to a default.
         if position == None:
@@ -75,4 +79,35 @@ class SceneObject:
         self.right = glm.normalize(glm.cross(self.front, constants.WORLD_UP))
         
         # Cross the right and direction vectors to get local up vector
-        self.up = glm.normalize(glm.cross(self.right, self.front))
\ No newline at end of file
+        self.up = glm.normalize(glm.cross(self.right, self.front))
+        
+    def set_transform(self, position: glm.vec3, rotation: glm.vec3 = None, scale: glm.vec3 = None):
+        """
+        Sets the object's local transform in the scene graph, built as for
+        instance transforms (rotation.x about the up axis, and rotation.y about
+        the right axis, in radians). Moves every instance, and any children,
+        without touching their own transforms.
+
+        Parameters
+        ----------
+        position : glm.vec3
+            The position.
+        rotation : glm.vec3, optional
+            The rotation. The default is None (no rotation).
+        scale : glm.vec3, optional
+            The scale. The default is None (unit scale).
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        matrix = compose_model_matrices(
+            np.array([tuple(position)], dtype=np.float32),
+            np.array([tuple(glm.vec3() if rotation is None else rotation)], dtype=np.float32),
+            np.array([tuple(glm.vec3(1) if scale is None else scale)], dtype=np.float32),
+            self.up,
+            self.right
+        )[0]
+        self.set_local_matrix(matrix)
@@ -0,0 +1,268 @@
+import logging
+import numpy as np
+from engine.object.mesh import Mesh
+from engine.object.model import Model
+from engine.object.sceneobject import SceneObject
+from engine.core.transforms import TransformStore
+from engine.core.vertexformat import PACKED_LAYOUT, PACKED_VERTEX_DTYPE
+from engine.config import CONFIG
+
+def mesh_memory(mesh: Mesh) -> int:
+    """
+    Computes the GPU memory a mesh's buffers hold: its vertices, indices, and
+    instance matrices.
+
+    Parameters
+    ----------
+    mesh : Mesh
+        The mesh.
+
+    Returns
+    -------
+    int
+        The size in bytes.
+
+    """
+
+    if mesh.packed:
+        vertices = PACKED_VERTEX_DTYPE.itemsize * (mesh.vertices.size // 3)
+    else:
+        vertices = mesh.vertices.nbytes + mesh.normals.nbytes + mesh.texCoords.nbytes + mesh.tangents.nbytes + mesh.bitangents.nbytes
+    return vertices + mesh.indices.nbytes + mesh.get_instance_data().nbytes
+
+def mesh_draw_calls(mesh: Mesh) -> int:
+    """
+    Counts the draw calls a mesh takes with every instance visible at full
+    detail: one if instanced, or one per instance.
+
+    Parameters
+    ----------
+    mesh : Mesh
+        The mesh.
+
+    Returns
+    -------
+    int
+        The number of draw calls.
+
+    """
+
+    return 1 if is_instanced(mesh) else len(mesh.get_instance_data())
+
+def is_instanced(mesh: Mesh) -> bool:
+    """
+    Checks whether a mesh has enough instances to be drawn with one instanced
+    call.
+
+    Parameters
+    ----------
+    mesh : Mesh
+        The mesh.
+
+    Returns
+    -------
+    bool
+        Whether the mesh is instanced.
+
+    """
+
+    return len(mesh.get_instance_data()) >= CONFIG["instancing_threshold"]
+
+def normalise(vectors: np.ndarray) -> np.ndarray:
+    """
+    Normalises vectors, leaving zero vectors as they are.
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        The vectors, of shape (..., 3).
+
+    Returns
+    -------
+    np.ndarray
+        The unit vectors.
+
+    """
+
+    lengths = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, lengths, out=np.zeros_like(vectors), where=lengths > 0)
+
+def bake_instances(mesh: Mesh, instances: np.ndarray) -> dict:
+    """
+    Transforms a mesh's vertices to world space once for each of the given
+    instances. Normals, tangents and bitangents are all transformed by the
+    model matrix, as vertex.vs does when building the tangent space of an
+    instanced mesh, so baked instances are shaded as they were before.
+
+    Parameters
+    ----------
+    mesh : Mesh
+        The mesh.
+    instances : np.ndarray
+        The indices of the instances to bake.
+
+    Returns
+    -------
+    dict
+        Positions, normals, texture coordinates, tangents, and bitangents,
+        each of shape (instances, vertices, size), and the mesh's index array
+        for each level of detail.
+
+    """
+
+    matrices = mesh.get_instance_matrices()[instances].astype(np.float64)
+    linear, translation = matrices[:, :3, :3], matrices[:, :3, 3]
+
+    count = mesh.vertices.size // 3
+    def attribute(data, size):
+        data = np.asarray(data, dtype=np.float64).reshape(-1)
+        return data[:count * size].reshape(count, size) if len(data) >= count * size else np.zeros((count, size))
+
+    positions = np.einsum("nij,vj->nvi", linear, attribute(mesh.vertices, 3)) + translation[:, None]
+    normals = normalise(np.einsum("nij,vj->nvi", linear, attribute(mesh.normals, 3)))
+    tangents = normalise(np.einsum("nij,vj->nvi", linear, attribute(mesh.tangents, 3)))
+    bitangents = normalise(np.einsum("nij,vj->nvi", linear, attribute(mesh.bitangents, 3)))
+
+    # Texture coordinates are the same for every instance. Only the first
+    # channel is kept.
+    tex_coords = np.broadcast_to(attribute(mesh.texCoords, 2), (len(instances), count, 2))
+
+    return {
+        "positions": positions,
+        "normals": normals,
+        "texturecoords": tex_coords,
+        "tangents": tangents,
+        "bitangents": bitangents,
+        "levels": np.split(mesh.indices.astype(np.int64), np.cumsum(mesh.lod_index_counts)[:-1])
+    }
+
+def merge_instances(members: list[(Mesh, np.ndarray)]) -> dict:
+    """
+    Bakes instances of meshes sharing a material into the data of one world
+    space mesh, in the format Mesh takes. Each level of detail of the merged
+    mesh draws that level of every member, or its coarsest if it has fewer.
+
+    Parameters
+    ----------
+    members : list[(Mesh, np.ndarray)]
+        Each mesh, and the indices of its instances to bake.
+
+    Returns
+    -------
+    dict
+        The merged mesh data.
+
+    """
+
+    baked = [bake_instances(mesh, instances) for mesh, instances in members]
+    levels = max(len(bake["levels"]) for bake in baked)
+
+    # Each instance's vertices follow the previous instance's
+    base = 0
+    faces = [[] for _ in range(levels)]
+    for bake in baked:
+        instances, count = bake["positions"].shape[:2]
+        offsets = base + np.arange(instances) * count
+        for level in range(levels):
+            indices = bake["levels"][min(level, len(bake["levels"]) - 1)]
+            faces[level].append((indices[None, :] + offsets[:, None]).reshape(-1))
+        base += instances * count
+
+    def merged(name, size):
+        return np.concatenate([bake[name].reshape(-1, size) for bake in baked]).astype(np.float32).reshape(-1)
+
+    data = {
+        "vertices": merged("positions", 3),
+        "normals": merged("normals", 3),
+        "texturecoords": merged("texturecoords", 2),
+        "tangents": merged("tangents", 3),
+        "bitangents": merged("bitangents", 3),
+        "faces": np.concatenate(faces[0])
+    }
+    for level in range(1, levels):
+        data[f"lod{level}"] = np.concatenate(faces[level])
+    return data
+
+"""
+StaticBatch
+
+A model made of the static instances of other models, baked into world space
+and merged by material and region, so the region's instances sharing a
+material are drawn with one VAO and one draw call.
+
+It has one identity instance, so its meshes are culled, shadowed and drawn
+like any other model's. It is never dynamic.
+"""
+class StaticBatch(Model):
+    def __init__(self, name: str, groups: dict):
+        """
+        Bakes and merges instances into the batch's meshes.
+
+        Parameters
+        ----------
+        name : str
+            The name of the batch, for use in logging.
+        groups : dict
+            The members of each mesh to create, by (material, vertex layout):
+            lists of each source mesh and the indices of its instances.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Batches have no source file, so skip loading one
+        SceneObject.__init__(self, name)
+
+        self.meshes = []
+        self.dynamic = False
+        self.transforms = TransformStore()
+        self.transforms.set_arrays(np.zeros((1, 3)))
+
+        # Meshes read their vertex layout from the model as they are created
+        for (material, vertex_layout), members in groups.items():
+            self.vertex_layout = vertex_layout
+            self.meshes.append(Mesh(self, merge_instances(members), material))
+
+def build_static_batches(models: list[Model], chunk_size: float = None) -> list[StaticBatch]:
+    """
+    Groups the instances of static models into batches by region: the
+    squares of a grid over the ground, by instance centre. Each batch holds
+    one mesh per material and vertex layout in its square, so culling still
+    skips regions out of view.
+
+    Parameters
+    ----------
+    models : list[Model]
+        The models to batch. Every instance of every mesh is baked, so they
+        should no longer be drawn themselves.
+    chunk_size : float, optional
+        The side of each square of the grid. The default is None (the
+        "static_batch_chunk_size" config value).
+
+    Returns
+    -------
+    list[StaticBatch]
+        The batches.
+
+    """
+
+    chunk_size = chunk_size or CONFIG["static_batch_chunk_size"]
+
+    chunks = {}
+    for model in models:
+        for mesh in model.meshes:
+            centers, _ = mesh.get_world_bounds()
+            cells = np.floor(centers[:, [0, 2]] / chunk_size).astype(np.int64)
+            layout = PACKED_LAYOUT if mesh.packed else "separate"
+            for cell in np.unique(cells, axis=0):
+                instances = np.flatnonzero(np.all(cells == cell, axis=1))
+                groups = chunks.setdefault(tuple(cell), {})
+                groups.setdefault((mesh.material, layout), []).append((mesh, instances))
+
+    batches = []
+    for (x, z), groups in sorted(chunks.items()):
+        logging.info(f"Baking static batch at ({x}, {z}) of {len(groups)} meshes")
+        batches.append(StaticBatch(f"static batch ({x}, {z})", groups))
+    return batches
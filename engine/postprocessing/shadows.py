@@ -1,112 +1,446 @@
 import glm
+import math
+import numpy as np
 from OpenGL.GL import *
 from engine.texture.framebuffer import FrameBuffer
 from engine.texture.depthbuffer import DepthBuffer
 from engine.core.program import ShaderProgram
 from engine.config import CONFIG
+from engine.core.culling import extract_frustum_planes
+from engine.core.state import GL_STATE
+from engine.core.renderqueue import RENDER_QUEUE
+from engine.core.uniformbuffer import MAX_SHADOW_CASCADES
+
+def cascade_splits(near: float, far: float, count: int, weight: float) -> np.ndarray:
+    """
+    Splits a depth range into cascades with the practical split scheme: a
+    blend of logarithmic splits, which keep texel density even but make near
+    cascades tiny, and uniform splits.
+
+    Parameters
+    ----------
+    near : float
+        The start of the range.
+    far : float
+        The end of the range.
+    count : int
+        The number of cascades.
+    weight : float
+        The weight of logarithmic splits, from 0 (uniform) to 1
+        (logarithmic).
+
+    Returns
+    -------
+    np.ndarray
+        The far distance of each cascade, of shape (count,).
+
+    """
+
+    fractions = np.arange(1, count + 1) / count
+    return weight * near * (far / near) ** fractions + (1 - weight) * (near + (far - near) * fractions)
+
+def frustum_slice_corners(view: glm.mat4, projection: glm.mat4, near: float, far: float) -> np.ndarray:
+    """
+    Returns the world space corners of a slice of the camera's frustum.
+
+    Parameters
+    ----------
+    view : glm.mat4
+        The camera's view matrix.
+    projection : glm.mat4
+        The camera's (perspective) projection matrix.
+    near : float
+        The distance of the slice's near side from the camera.
+    far : float
+        The distance of the slice's far side from the camera.
+
+    Returns
+    -------
+    np.ndarray
+        The corners, of shape (8, 3).
+
+    """
+
+    # View space corners, from the projection's scales
+    scale_x, scale_y = projection[0][0], projection[1][1]
+    corners = np.array([
+        (x * depth / scale_x, y * depth / scale_y, -depth, 1)
+        for depth in (near, far) for x in (-1, 1) for y in (-1, 1)
+    ])
+
+    # NumPy reads glm matrices row by row
+    inverse = np.array(glm.inverse(view))
+    return (corners @ inverse.T)[:, :3]
+
+def fit_cascade(corners: np.ndarray, light_view: glm.mat4, resolution: int, caster_top: float) -> glm.mat4:
+    """
+    Fits an orthographic projection from the light around a slice of the
+    camera's frustum.
+
+    The projection covers the slice's bounding sphere, whose size does not
+    change as the camera turns, and is moved only in whole texels, so shadow
+    edges do not shimmer as the camera moves. Depth covers the slice, and
+    extends towards the light to every caster.
+
+    Parameters
+    ----------
+    corners : np.ndarray
+        The slice's corners, as from frustum_slice_corners().
+    light_view : glm.mat4
+        The light's view matrix, a rotation only.
+    resolution : int
+        The cascade's shadow map resolution.
+    caster_top : float
+        The largest light view z (ie, nearest to the light) of any caster.
+
+    Returns
+    -------
+    glm.mat4
+        The cascade's light space matrix.
+
+    """
+
+    # Radius rounded up, so precision errors do not change it
+    center = corners.mean(axis=0)
+    radius = math.ceil(np.linalg.norm(corners - center, axis=1).max() * 16) / 16
+
+    # Snap the centre to the texel grid, in light view space
+    texel = 2 * radius / resolution
+    light_center = light_view * glm.vec3(*center)
+    x = math.floor(light_center.x / texel) * texel
+    y = math.floor(light_center.y / texel) * texel
+
+    # The light looks down -z, so depths are negated z
+    top = max(light_center.z + radius, caster_top)
+    bottom = light_center.z - radius
+    projection = glm.ortho(x - radius, x + radius, y - radius, y + radius, -top, -bottom)
+    return projection * light_view
 
 """
 ShadowsEffect
 
-Handles shadow casting and updating the light space matrix
+Handles shadow casting and updating the light space matrices of cascaded
+shadow maps: the camera's frustum is split by depth into cascades, each with
+its own shadow map fitted around it, so near shadows get as many texels as
+far ones.
 """
 class ShadowsEffect:
     def __init__(self, light_position: glm.vec3):
         """
-        Initialises the effect by creating the light space matrix
+        Initialises the effect's cascades
 
         Parameters
         ----------
         light_position : glm.vec3
             Current position of shadow-casting light
 
+        Raises
+        ------
+        ValueError
+            If more cascades are configured than the shaders support.
+
         Returns
         -------
         None.
 
         """
-        
-        self.update_light_space_matrix(light_position)
-    
-    def update_light_space_matrix(self, light_position: glm.vec3):
+
+        self.cascades = CONFIG["shadow_cascades"]
+        self.resolution = CONFIG["shadow_cascade_resolution"]
+        if not 1 <= self.cascades <= MAX_SHADOW_CASCADES:
+            raise ValueError(f"shadow_cascades must be from 1 to {MAX_SHADOW_CASCADES}, not {self.cascades}.")
+
+        # The light shines from its position towards the centre of the scene.
+        # Cascades are fitted to the camera each frame by update_cascades().
+        self.light_position = glm.vec3(light_position)
+        self.splits = cascade_splits(CONFIG["near_plane"], CONFIG["shadow_distance"], self.cascades, CONFIG["shadow_split_weight"])
+        self.light_space_matrices = [glm.mat4(1)] * self.cascades
+
+        # Signatures of what was last rendered to each cascade's shadow map,
+        # and to its static caster map. When unchanged, the maps are reused as
+        # they are.
+        self.signatures = [None] * self.cascades
+        self.static_signatures = [None] * self.cascades
+
+        # Counts of cascade passes rendered, skipped, and static map rebuilds
+        self.passes_rendered = 0
+        self.passes_skipped = 0
+        self.static_rebuilds = 0
+
+    def get_light_view(self, light_position: glm.vec3) -> glm.mat4:
+        """
+        Returns the light's view matrix, a rotation looking from the light's
+        position towards the centre of the scene.
+
+        Parameters
+        ----------
+        light_position : glm.vec3
+            The position of the shadow-casting light
+
+        Returns
+        -------
+        glm.mat4
+            The view matrix.
+
+        """
+
+        # A light at the centre shines straight down
+        direction = glm.normalize(-light_position) if glm.length(light_position) > 0 else glm.vec3(0, -1, 0)
+
+        # Any up vector will do, unless it is parallel to the light
+        up = glm.vec3(0, 0, 1) if abs(direction.y) > 0.99 else glm.vec3(0, 1, 0)
+        return glm.lookAt(glm.vec3(0), direction, up)
+
+    def update_cascades(self, light_position: glm.vec3, view: glm.mat4, projection: glm.mat4, objects: list):
         """
-        Updates the light space matrix for use in shadow calculations.
+        Fits each cascade's light space matrix to its slice of the camera's
+        frustum.
 
         Parameters
         ----------
         light_position : glm.vec3
             The position of the shadow-casting light
+        view : glm.mat4
+            The camera's view matrix.
+        projection : glm.mat4
+            The camera's projection matrix.
+        objects : list
+            The shadow casters.
 
         Returns
         -------
         None.
 
         """
-        
-        # Generate view and projection matrices from the light's perspective
-        # looking towards the centre of the scene. Importantly, the aspect
-        # ratio of the shadows are not of the screen height, but the shadow
-        # resolution.
-        projection = glm.perspective(45, CONFIG["shadow_width"]/CONFIG["shadow_height"], CONFIG["near_plane"], CONFIG["far_plane"])
-        view = glm.lookAt(light_position, glm.vec3(0), glm.vec3(0, 1, 0))
-        self.light_space_matrix = projection * view
+
+        self.light_position = glm.vec3(light_position)
+        light_view = self.get_light_view(light_position)
+
+        # Casters between the light and a cascade must be inside its depth
+        # range, so find how far towards the light any caster reaches
+        rotation = np.array(light_view)[2, :3]
+        caster_top = -np.inf
+        for obj in objects:
+            for mesh in obj.meshes:
+                centers, extents = mesh.get_world_bounds()
+                if len(centers):
+                    caster_top = max(caster_top, float((centers @ rotation + extents @ np.abs(rotation)).max()))
+
+        near = CONFIG["near_plane"]
+        for cascade, far in enumerate(self.splits):
+            corners = frustum_slice_corners(view, projection, near, far)
+            self.light_space_matrices[cascade] = fit_cascade(corners, light_view, self.resolution, caster_top)
+            near = far
 
     def create(self):
         """
-        Create the depth and frame buffers, and attachs the generated depth
-        buffer to the frame buffer.
+        Create the depth texture array and a frame buffer for each cascade,
+        with that cascade's layer of the array attached.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.depth_buffer, self.frame_buffers = self.create_cascade_buffers()
+
+        # Static casters are kept in maps of their own, copied into the
+        # shadow maps before dynamic casters are drawn over them
+        if CONFIG["shadow_cache_static"]:
+            self.static_depth_buffer, self.static_frame_buffers = self.create_cascade_buffers()
+
+    def create_cascade_buffers(self) -> (DepthBuffer, list[FrameBuffer]):
+        """
+        Creates a depth texture array with a layer per cascade, and a frame
+        buffer for each layer.
+
+        Returns
+        -------
+        (DepthBuffer, list[FrameBuffer])
+            The texture array, and the frame buffers, by cascade.
+
+        """
+
+        # Create depth buffer texture with cascade resolution from config
+        depth_buffer = DepthBuffer(self.cascades)
+        depth_buffer.generate(self.resolution, self.resolution)
+
+        frame_buffers = []
+        for cascade in range(self.cascades):
+            # Attach the cascade's layer to its framebuffer
+            frame_buffer = FrameBuffer()
+            frame_buffer.bind()
+            depth_buffer.attach(cascade)
+
+            # Check for errors
+            frame_buffer.check_complete()
+            frame_buffers.append(frame_buffer)
+        return depth_buffer, frame_buffers
+
+    def get_signature(self, cascade: int, objects: list) -> tuple:
+        """
+        Builds a signature of everything a cascade's shadow map of the given
+        casters depends on: its light space matrix and each caster's
+        transforms.
+
+        Parameters
+        ----------
+        cascade : int
+            The cascade.
+        objects : list
+            The shadow casters, each with a transform_version.
+
+        Returns
+        -------
+        tuple
+            The signature. Equal signatures give equal shadow maps.
+
+        """
+
+        return (
+            glm.mat4(self.light_space_matrices[cascade]),
+            tuple((id(obj), obj.transform_version) for obj in objects)
+        )
+
+    def render(self, program: ShaderProgram, objects: list, renderer=None) -> int:
+        """
+        Renders the shadow casters into each cascade's shadow map, culled
+        against that cascade, unless nothing they depend on has changed since
+        the last render, in which case the previous map is reused.
+
+        If shadow_cache_static is set, casters not marked dynamic are drawn to
+        a separate map only when they change. Each render then copies that map
+        and draws only the dynamic casters over it.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The depth shader program
+        objects : list
+            The shadow casters.
+        renderer : MultiDrawRenderer, optional
+            Renderer to draw casters with multi-draw indirect, with program
+            its depth program. The default is None (the render queue).
+
+        Returns
+        -------
+        int
+            The number of cascades redrawn.
+
+        """
+
+        static = [obj for obj in objects if not obj.dynamic]
+        dynamic = [obj for obj in objects if obj.dynamic]
+
+        rendered = 0
+        for cascade in range(self.cascades):
+            signature = self.get_signature(cascade, objects)
+            if signature == self.signatures[cascade]:
+                self.passes_skipped += 1
+                continue
+            self.signatures[cascade] = signature
+            self.passes_rendered += 1
+            rendered += 1
+
+            # Only casters inside the cascade's frustum affect its map
+            frustum = extract_frustum_planes(self.light_space_matrices[cascade])
+
+            if not CONFIG["shadow_cache_static"]:
+                self.start(program, cascade)
+                self.draw_casters(program, objects, frustum, renderer)
+                continue
+
+            # Redraw the static map only if a static caster or the cascade
+            # moved
+            static_signature = self.get_signature(cascade, static)
+            if static_signature != self.static_signatures[cascade]:
+                self.static_signatures[cascade] = static_signature
+                self.static_rebuilds += 1
+                self.start(program, cascade, self.static_frame_buffers[cascade])
+                self.draw_casters(program, static, frustum, renderer)
+
+            # Copy the static map into the shadow map
+            size = self.resolution
+            GL_STATE.bind_framebuffer(self.static_frame_buffers[cascade].get_id(), GL_READ_FRAMEBUFFER)
+            GL_STATE.bind_framebuffer(self.frame_buffers[cascade].get_id(), GL_DRAW_FRAMEBUFFER)
+            glBlitFramebuffer(0, 0, size, size, 0, 0, size, size, GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+
+            # Then draw dynamic casters over it, without clearing
+            self.start(program, cascade, clear=False)
+            self.draw_casters(program, dynamic, frustum, renderer)
+        return rendered
+
+    def draw_casters(self, program: ShaderProgram, objects: list, frustum: np.ndarray = None, renderer=None):
+        """
+        Draws shadow casters into the bound shadow map, depth only (ie, with
+        no material state), sorted through the render queue.
+
+        Parameters
+        ----------
+        program : ShaderProgram
+            The depth shader program
+        objects : list
+            The shadow casters.
+        frustum : np.ndarray, optional
+            Frustum planes to cull casters against. The default is None.
+        renderer : MultiDrawRenderer, optional
+            Renderer to draw every caster in one multi-draw indirect call
+            with instead. The default is None (the render queue).
 
         Returns
         -------
         None.
 
         """
-        
-        # Generate depth and frame bufferss
-        self.depth_buffer = DepthBuffer()
-        self.frame_buffer = FrameBuffer()
-        
-        # Bind FBO
-        self.frame_buffer.bind()
-        
-        # Create depth buffer texture with shadow resolution from config
-        self.depth_buffer.generate(CONFIG["shadow_width"], CONFIG["shadow_height"])
-        
-        # Attach depth buffer texture to framebuffer
-        self.depth_buffer.attach()
-        
-        # Check for errors
-        self.frame_buffer.check_complete()
 
-    def start(self, program: ShaderProgram):  
+        if renderer:
+            renderer.draw_depth(program, objects, frustum)
+            return
+
+        RENDER_QUEUE.begin()
+        for obj in objects:
+            obj.submit_depth(RENDER_QUEUE, program, frustum)
+        RENDER_QUEUE.execute()
+
+    def start(self, program: ShaderProgram, cascade: int, frame_buffer: FrameBuffer = None, clear: bool = True):
         """
-        Begin shadow pass
+        Begin shadow pass of a cascade
 
         Parameters
         ----------
         program : ShaderProgram
             The depth shader program
+        cascade : int
+            The cascade to render.
+        frame_buffer : FrameBuffer, optional
+            The frame buffer to render to. The default is None (the cascade's
+            shadow map frame buffer).
+        clear : bool, optional
+            Whether to clear the depth buffer first. The default is True.
 
         Returns
         -------
         None.
 
         """
-        
-        # Bind the frame buffer with depth buffer attached
-        self.frame_buffer.bind()
-        
+
+        # Bind the frame buffer with the cascade's layer attached
+        (frame_buffer or self.frame_buffers[cascade]).bind()
+
         # Set the viewport to the size of the shadow resolution
-        glViewport(0, 0, CONFIG["shadow_width"], CONFIG["shadow_height"])
-        
+        GL_STATE.set_viewport(0, 0, self.resolution, self.resolution)
+
         # Clear the depth buffer bit
-        glClear(GL_DEPTH_BUFFER_BIT)
-        
-        # Use the depth program and set its light space matrix uniform
+        if clear:
+            glClear(GL_DEPTH_BUFFER_BIT)
+
+        # Use the depth program. Its light space matrices come from the frame
+        # uniform block, indexed by cascade.
         program.use()
-        program.setMat4('lightSpaceMatrix', self.light_space_matrix)
-        
-    def end(self, program: ShaderProgram):
+        program.setInt('cascade', cascade)
+
+    def end(self, program: ShaderProgram, target: FrameBuffer = None):
         """
         Finish shadow pass
 
@@ -114,32 +448,36 @@ class ShadowsEffect:
         ----------
         program : ShaderProgram
             The lighting program to switch to after shadow pass
+        target : FrameBuffer, optional
+            The frame buffer the lighting pass renders to. The default is None
+            (the window).
 
         Returns
         -------
         None.
 
         """
-        
-        
-        # Unbind the frame buffer
-        self.frame_buffer.unbind()
-        
+
+
+        # Unbind the frame buffer (whichever was used, if any), returning to
+        # the lighting pass's target
+        if target:
+            target.bind()
+        else:
+            self.frame_buffers[0].unbind()
+
         # Reset the viewport to window size
-        glViewport(0, 0, CONFIG["window_width"], CONFIG["window_height"])
-        
+        GL_STATE.set_viewport(0, 0, CONFIG["window_width"], CONFIG["window_height"])
+
         # Clear both colour and depth buffer bits
         glClear(GL_DEPTH_BUFFER_BIT | GL_COLOR_BUFFER_BIT)
-        
+
         # Use the new shader program for lighting pass
         program.use()
-        
-        # Set the 10th texture unit to the depth buffer's shadow map texture
-        glActiveTexture(GL_TEXTURE10)
-        self.depth_buffer.bind()
-        
-        # Set the uniforms in the lighting shader for light space matrix and
-        # shadow map unit
-        program.setMat4('lightSpaceMatrix', self.light_space_matrix)
+
+        # Set the 10th texture unit to the cascades' shadow map array
+        self.depth_buffer.bind(10)
+
+        # Set the shadow map unit uniform in the lighting shader. Its light
+        # space matrices and splits come from the frame uniform block.
         program.setInt('shadowMap', 10)
-        
\ No newline at end of file
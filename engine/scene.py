@@ -1,15 +1,29 @@
 import glm
 import glfw
 import math
+import logging
 import random
+import numpy as np
 from OpenGL.GL import *
 from engine.object.camera import Camera
 from engine.object.model import Model
+from engine.object.scenenode import SceneNode
+from engine.object.staticbatch import build_static_batches, mesh_memory, mesh_draw_calls, is_instanced
 from engine.config import CONFIG
 from engine.postprocessing.shadows import ShadowsEffect
 from engine.core.program import ShaderProgram
 from engine.texture.skybox import Skybox
 from engine.texture.material import Material
+from engine.core.cache import TEXTURE_CACHE, finish_texture_loads
+from engine.core.culling import CULLING_STATS, extract_frustum_planes
+from engine.core.profiler import PROFILER
+from engine.core.state import GL_STATE
+from engine.core.renderqueue import RENDER_QUEUE, LIGHTING_PASS
+from engine.core.lod import LOD_SELECTOR
+from engine.core.bvh import INSTANCE_INDEX
+from engine.core.uniformbuffer import UniformBuffer, pack_mat4
+from engine.core.clusters import LightClusters, POINT_LIGHT_DTYPE
+from engine.core.multidraw import MultiDrawRenderer
 
 """
 Scene
@@ -32,6 +46,9 @@ class Scene:
         self.last_mouse_x = 0
         self.last_mouse_y = 0
         
+        # Frame buffer to render to, or None for the window
+        self.target = None
+        
         # Time information to pause and resume scene time
         self.pause_colour = False
         self.sky_colour = glm.vec3()
@@ -59,7 +76,7 @@ class Scene:
         
     def initialise_lights(self):
         """
-        Initialise scene global light position and point light position array.
+        Initialise scene global light position and point light array.
 
         Returns
         -------
@@ -70,7 +87,17 @@ class Scene:
         # Global light is pseudo-directional
         # It is a spot light without attenuation, allowing for easier shadows
         self.global_light_position = glm.vec3(0, 50, 0)
-        self.point_light_positions = [glm.vec3(10, 0.75, 0)]
+        
+        # Point lights are campfires. Deep orange and bright, their diffuse
+        # colour flickers each frame. Lights are shaded only where they reach,
+        # so to add more lights, add them to this array.
+        self.point_lights = np.zeros(1, dtype=POINT_LIGHT_DTYPE)
+        self.point_lights["position"] = (10, 0.75, 0)
+        self.point_lights["ambient"] = (0.886, 0.345, 0.133)
+        self.point_lights["specular"] = (1, 1, 1)
+        self.point_lights["constant"] = 0.2
+        self.point_lights["linear"] = 0.02
+        self.point_lights["quadratic"] = 0.016
         
     def initialise_shadows(self):
         """
@@ -144,7 +171,8 @@ class Scene:
                     specular_path="leaves_specular.jpg",
                     shininess=64
                 )
-            ]
+            ],
+            vertex_layout="packed"
         )
         
         # Bamboo type 2
@@ -162,7 +190,8 @@ class Scene:
                     specular_path="leaves_specular.jpg",
                     shininess=32
                 )
-            ]
+            ],
+            vertex_layout="packed"
         )
         
         # Vines
@@ -174,7 +203,8 @@ class Scene:
                     specular_path="leaves_specular.jpg",
                     shininess=8
                 )
-            ]
+            ],
+            vertex_layout="packed"
         )
         
         # Bamboo type 3
@@ -192,7 +222,8 @@ class Scene:
                     specular_path="leaves_specular.jpg",
                     shininess=32
                 )
-            ]
+            ],
+            vertex_layout="packed"
         )
         
         # Rock behind vines
@@ -224,7 +255,9 @@ class Scene:
             ]
         )
         
-        # Splined elephant (no texture coords in model)
+        # Splined elephant (no texture coords in model). It moves every frame,
+        # so is marked dynamic. It has one instance, and is moved by its node
+        # in the scene graph.
         elephant = Model(
             "resources/models/elephant.json",
             materials=[
@@ -232,26 +265,20 @@ class Scene:
                     "cube.jpg",
                     shininess=8
                 )
-            ]
+            ],
+            dynamic=True
         )
+        elephant.set_transform_arrays(np.zeros((1, 3)))
+        elephant.set_transform(glm.vec3(-9, 7, 12), glm.vec3(180, 0, 0), glm.vec3(4))
        
         # In a square, generate positions according to a wiggly function
-        positions = []
-        for i in range(-20, 20):
-            for j in range(-20, 20):
-                positions.append(
-                    glm.vec3(
-                        i, 
-                        -0.143*math.sin(1.75*(i + 1.73)) - 0.180*math.sin(2.96*(i+4.98)) 
-                            - 0.012*math.sin(6.23*(j+3.17)) + 0.288*math.sin(8.07*(j+i+4.63)),
-                        j
-                    )
-                )
+        i, j = np.meshgrid(np.arange(-20, 20), np.arange(-20, 20), indexing="ij")
+        heights = -0.143*np.sin(1.75*(i + 1.73)) - 0.180*np.sin(2.96*(i+4.98)) \
+            - 0.012*np.sin(6.23*(j+3.17)) + 0.288*np.sin(8.07*(j+i+4.63))
                
-        # Set floor cube transforms to these positions
-        cube.set_transforms([
-            {"position": pos, "rotation": glm.vec3(), "scale": glm.vec3(1)} for pos in positions
-        ])
+        # Set floor cube transforms to these positions, passing arrays
+        # directly as there are many
+        cube.set_transform_arrays(np.stack([i, heights, j], axis=-1).reshape(-1, 3))
         
         # Set vine transforms to along the left-hand side with random offsets
         plant3.set_transforms([
@@ -318,7 +345,7 @@ class Scene:
         
         # Set campfire transforms (offset position due to model)
         campfire.set_transforms([
-            {"position": self.point_light_positions[0]-glm.vec3(0, 0, 1), "rotation": glm.vec3(), "scale": glm.vec3(0.05)}
+            {"position": glm.vec3(*self.point_lights["position"][0])-glm.vec3(0, 0, 1), "rotation": glm.vec3(), "scale": glm.vec3(0.05)}
         ])
         
         # Add all models to render array
@@ -331,6 +358,77 @@ class Scene:
         self.objects.append(rock2)
         self.objects.append(plant4)
         self.objects.append(elephant)
+        self.elephant = elephant
+        
+        # Every model is a node of the scene graph, under one root. Moving a
+        # node moves all its instances and children, and only what moved is
+        # recomputed.
+        self.root = SceneNode("root")
+        for obj in self.objects:
+            self.root.add_child(obj)
+        
+        # Every material has queued its textures for decoding by now, so wait
+        # for them all at once and upload
+        finish_texture_loads()
+        
+        # Nothing but the elephant moves from here on
+        self.static_batching = {}
+        if CONFIG["static_batching"]:
+            self.freeze_static()
+        
+    def freeze_static(self):
+        """
+        Bakes every static model's instances into world space batches, merged
+        by material and region, and draws those instead. Models are marked
+        dynamic (ie, Model(..., dynamic=True)) to keep them out, as must any
+        that will move afterwards. Models with meshes too large to be worth
+        copying per instance are left instanced, as are models already drawn
+        with one instanced call per mesh, which baking could only make larger
+        and split into more draws.
+        
+        Memory use and draw calls of the models batched, before and after,
+        are logged and kept in self.static_batching.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        models = [
+            obj for obj in self.objects
+            if not obj.dynamic
+            and all(mesh.vertices.size // 3 <= CONFIG["static_batch_max_vertices"] for mesh in obj.meshes)
+            and not any(is_instanced(mesh) for mesh in obj.meshes)
+        ]
+        if not models:
+            return
+        
+        meshes = [mesh for model in models for mesh in model.meshes]
+        memory = sum(mesh_memory(mesh) for mesh in meshes)
+        draw_calls = sum(mesh_draw_calls(mesh) for mesh in meshes)
+        
+        batches = build_static_batches(models)
+        for model in models:
+            self.objects.remove(model)
+            self.root.remove_child(model)
+        for batch in batches:
+            self.objects.append(batch)
+            self.root.add_child(batch)
+        
+        batched = [mesh for batch in batches for mesh in batch.meshes]
+        self.static_batching = {
+            "models": len(models),
+            "batches": len(batches),
+            "meshes": {"before": len(meshes), "after": len(batched)},
+            "memory_bytes": {"before": memory, "after": sum(mesh_memory(mesh) for mesh in batched)},
+            "draw_calls": {"before": draw_calls, "after": sum(mesh_draw_calls(mesh) for mesh in batched)}
+        }
+        logging.info(
+            f"Froze {len(models)} static models into {len(batches)} batches: "
+            f"{self.static_batching['draw_calls']['before']} to {self.static_batching['draw_calls']['after']} draw calls, "
+            f"{memory / 2**20:.2f} to {self.static_batching['memory_bytes']['after'] / 2**20:.2f} MiB"
+        )
         
     def initialise_shaders(self):
         """
@@ -346,6 +444,69 @@ class Scene:
         self.shadow_program = ShaderProgram('resources/shaders/depth_vertex.vs', 'resources/shaders/depth_fragment.fs')
         self.skybox_program = ShaderProgram('resources/shaders/skybox_vertex.vs', 'resources/shaders/skybox_fragment.fs')
         
+        # Camera and light uniforms are shared by every program through one
+        # buffer, uploaded once per frame
+        self.uniforms = UniformBuffer(["FrameData", "LightData"])
+        
+        # Point lights, and the lights reaching each cluster of the view
+        # frustum, in texture buffers
+        self.light_clusters = LightClusters()
+        
+        # Optionally, opaque meshes are drawn from one shared geometry arena
+        # with multi-draw indirect, by variants of the lighting and depth
+        # programs reading transforms and materials from storage buffers
+        self.multi_draw = None
+        if CONFIG["multi_draw_indirect"]:
+            self.multi_draw_program = ShaderProgram('resources/shaders/vertex_mdi.vs', 'resources/shaders/fragment.fs', defines=["MULTI_DRAW"])
+            self.multi_draw_shadow_program = ShaderProgram('resources/shaders/depth_vertex_mdi.vs', 'resources/shaders/depth_fragment.fs')
+            self.multi_draw = MultiDrawRenderer()
+        
+    def update_uniforms(self, projection: glm.mat4, view: glm.mat4):
+        """
+        Packs this frame's camera, global light, shadow, and point light data
+        into the uniform blocks, assigns point lights to clusters, and uploads
+        them.
+
+        Parameters
+        ----------
+        projection : glm.mat4
+            The camera's projection matrix.
+        view : glm.mat4
+            The camera's view matrix.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        frame = self.uniforms["FrameData"]
+        frame["viewProject"] = pack_mat4(projection * view)
+        frame["view"] = pack_mat4(view)
+        frame["projection"] = pack_mat4(projection)
+        frame["viewPos"] = self.camera.position
+        
+        # Shadow cascades, each with its light space matrix and the depth at
+        # which it ends
+        cascades = self.shadows.cascades
+        frame["lightSpaceMatrices"][0, :cascades] = [pack_mat4(matrix) for matrix in self.shadows.light_space_matrices]
+        frame["cascadeSplits"][0, :cascades] = self.shadows.splits
+        frame["cascadeCount"] = cascades
+        
+        # Global light moves, and uses sky colour as light colour
+        global_light = frame["globalLight"]
+        global_light["position"] = self.global_light_position
+        global_light["ambient"] = self.sky_colour*glm.vec3(0.2)
+        global_light["diffuse"] = self.sky_colour
+        global_light["specular"] = glm.vec3(0)
+        
+        # Campfires flicker in diffuse intensity randomly
+        flicker = [random.gauss(1, 0.2) for _ in range(len(self.point_lights))]
+        self.point_lights["diffuse"] = self.point_lights["ambient"] * np.array(flicker)[:, None]
+        self.light_clusters.update(self.point_lights, view, projection, self.uniforms["LightData"])
+        
+        self.uniforms.upload()
+        
     def mouse_callback(self, x: int, y: int):
         """
         Calculate delta of mouse position, and rotate camera by that
@@ -422,32 +583,27 @@ class Scene:
 
         """
         
-        # If we haven't paused...
-        if not self.pause_colour:
-            # Advance time
-            self.ticks += 0.1
+        with PROFILER.section("update", gpu=False):
+            # If we haven't paused...
+            if not self.pause_colour:
+                # Advance time
+                self.ticks += 0.1
             
-            # Move global light
-            self.global_light_position.z = 20 * math.sin(self.ticks) * dt
-            self.global_light_position.y = 20 * math.cos(self.ticks) * dt
+                # Move global light
+                self.global_light_position.z = 20 * math.sin(self.ticks) * dt
+                self.global_light_position.y = 20 * math.cos(self.ticks) * dt
             
-            # Move campfire light in a small circle to 'flicker'
-            self.point_light_positions[0].x += dt*math.sin(self.ticks*1000)
-            self.point_light_positions[0].z += dt*math.cos(self.ticks*1000)
+                # Move campfire light in a small circle to 'flicker'
+                self.point_lights["position"][0] += dt*np.array((math.sin(self.ticks*1000), 0, math.cos(self.ticks*1000)))
             
-            # Update the light space matrix
-            self.shadows.update_light_space_matrix(self.global_light_position)
+                # Change the sky colour between night and day
+                self.sky_colour = glm.vec3(math.sin(self.ticks) * 0.5, 0, math.cos(self.ticks) * 0.5)
             
-            # Change the sky colour between night and day
-            self.sky_colour = glm.vec3(math.sin(self.ticks) * 0.5, 0, math.cos(self.ticks) * 0.5)
-            
-            # Move elephant back and forward
-            self.objects[8].set_transforms([
-                {"position": glm.vec3(-9, 7, 12), "rotation": glm.vec3(180, 0.5*math.sin(self.ticks)*dt, 0), "scale": glm.vec3(4)}
-            ])
+                # Move elephant back and forward
+                self.elephant.set_transform(glm.vec3(-9, 7, 12), glm.vec3(180, 0.5*math.sin(self.ticks)*dt, 0), glm.vec3(4))
         
-        # Update camera
-        self.camera.update(window, dt)
+            # Update camera
+            self.camera.update(window, dt)
         
     def draw(self):
         """
@@ -459,64 +615,117 @@ class Scene:
 
         """
         
-        # Clear buffer bits, colour sky according to time
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        glClearColor(self.sky_colour.x, self.sky_colour.y, self.sky_colour.z, 1.0)
-        
-        # Draw skybox first, using camera to get view and projection matrices
-        # Make sure to remove translation data from view matrix
-        self.skybox_program.use()
-        self.skybox_program.setMat4("view", glm.mat4(glm.mat3(self.camera.get_view())))
-        self.skybox_program.setMat4("projection", self.camera.get_perspective(CONFIG['window_width'], CONFIG['window_height']))
-        self.skybox.draw(self.skybox_program)
-        
-        # Start shadow pass.
-        # The main shadows can be seen on the left-hand side of the scene as 
-        # the light passes behind the right-hand rocks.
-        self.shadows.start(self.shadow_program)
-        for obj in self.objects:
-            obj.draw(self.shadow_program)
-        self.shadows.end(self.lighting_program)
+        # Textures bound from here on belong to the new frame, and cannot be
+        # evicted until it ends
+        TEXTURE_CACHE.new_frame()
+        CULLING_STATS.new_frame()
+        GL_STATE.new_frame()
+        RENDER_QUEUE.new_frame()
+        LOD_SELECTOR.new_frame()
         
-        # Assign uniforms of main lighting program
-        self.lighting_program.setMat4('viewProject', self.camera.get_perspective(CONFIG['window_width'], CONFIG['window_height']) * self.camera.get_view())
-        self.lighting_program.setVec3('viewPos', self.camera.position)
+        # Camera matrices are used by several passes, so compute them once
+        projection = self.camera.get_perspective(CONFIG['window_width'], CONFIG['window_height'])
+        view = self.camera.get_view()
         
-        # Global light moves, and uses sky colour as light colour
-        self.lighting_program.setVec3('globalLight.position', self.global_light_position)
-        self.lighting_program.setVec3("globalLight.ambient", self.sky_colour*glm.vec3(0.2))
-        self.lighting_program.setVec3("globalLight.diffuse", self.sky_colour)
-        self.lighting_program.setVec3("globalLight.specular", glm.vec3(0))
-        
-        # Point light 0 is the campfire. Deep orange, bright, and flickers in 
-        # diffuse intensity randomly.
-        self.lighting_program.setVec3("pointLights[0].position", self.point_light_positions[0])
-        self.lighting_program.setVec3("pointLights[0].ambient", glm.vec3(0.886, 0.345, 0.133))
-        self.lighting_program.setVec3("pointLights[0].diffuse", glm.vec3(0.886, 0.345, 0.133)*random.gauss(1, 0.2))
-        self.lighting_program.setVec3("pointLights[0].specular", glm.vec3(1))
-        self.lighting_program.setFloat("pointLights[0].constant", 0.2)
-        self.lighting_program.setFloat("pointLights[0].linear", 0.02)
-        self.lighting_program.setFloat("pointLights[0].quadratic", 0.016)
-        
-        # The lighting shader computes the sum of all point lights in the array
-        # This could be improved by using a uniform buffer object, to both
-        # improve performance and surpass limits of array sizes in GLSL.
-        
-        # To add more lights, change the NUM_POINT_LIGHTS macro in the lighting
-        # shader and define here.
-        
-        # self.lighting_program.setVec3("pointLights[1].position", self.point_light_positions[1])
-        # self.lighting_program.setVec3("pointLights[1].ambient", glm.vec3(0.886, 0.345, 0.133))
-        # self.lighting_program.setVec3("pointLights[1].diffuse", glm.vec3(0.886, 0.345, 0.133))
-        # self.lighting_program.setVec3("pointLights[1].specular", glm.vec3(1))
-        # self.lighting_program.setFloat("pointLights[1].constant", 1)
-        # self.lighting_program.setFloat("pointLights[1].linear", 0.09)
-        # self.lighting_program.setFloat("pointLights[1].quadratic", 0.032)
-
-        # Finally, draw all objects in lighting pass.
-        for obj in self.objects:
-            obj.draw(self.lighting_program)
-            
+        # Bind the render target, if not the window
+        if self.target:
+            self.target.bind()
         
+        # Clear buffer bits, colour sky according to time
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glClearColor(self.sky_colour.x, self.sky_colour.y, self.sky_colour.z, 1.0)
         
+        # Refit the instance index to anything that moved, so every pass can
+        # cull through it
+        INSTANCE_INDEX.update(self.objects)
+        
+        # Likewise upload anything that moved to the multi-draw renderer
+        if self.multi_draw:
+            self.multi_draw.update(self.objects)
+        
+        # Fit the shadow cascades to the camera, then upload camera, light,
+        # and shadow uniforms for every pass at once
+        self.shadows.update_cascades(self.global_light_position, view, projection, self.objects)
+        self.update_uniforms(projection, view)
+        
+        with PROFILER.section("skybox"):
+            # Draw skybox first. Its shader reads the camera's view and
+            # projection matrices from the frame uniform block, removing
+            # translation data from the view matrix
+            self.skybox_program.use()
+            self.skybox.draw(self.skybox_program)
+        
+        with PROFILER.section("shadow"):
+            # Start shadow pass.
+            # The main shadows can be seen on the left-hand side of the scene as 
+            # the light passes behind the right-hand rocks.
+            # Each cascade is drawn with only the casters inside its frustum.
+            # If neither a cascade nor any caster has moved, the previous
+            # shadow map is reused.
+            CULLING_STATS.begin_pass("shadow")
+            if self.multi_draw:
+                self.shadows.render(self.multi_draw_shadow_program, self.objects, self.multi_draw)
+            else:
+                self.shadows.render(self.shadow_program, self.objects)
+            self.shadows.end(self.lighting_program, self.target)
+            self.light_clusters.bind(self.lighting_program)
+            if self.multi_draw:
+                self.multi_draw_program.use()
+                self.multi_draw_program.setInt('shadowMap', 10)
+                self.light_clusters.bind(self.multi_draw_program)
+        
+        with PROFILER.section("lighting"):
+            # Camera and light uniforms are already in the uniform blocks
+            view_project = projection * view
+
+            # Finally, draw all objects in lighting pass, culling any outside the
+            # camera's frustum. Objects are queued and drawn sorted by state,
+            # with transparent ones last, furthest first. Instances small on
+            # screen are drawn at a simplified level of detail.
+            CULLING_STATS.begin_pass("lighting")
+            camera_frustum = extract_frustum_planes(view_project)
+            LOD_SELECTOR.set_view(self.camera.position, projection)
+            if self.multi_draw:
+                # Opaque meshes in a call per texture set, then blended
+                # meshes through the queue
+                self.multi_draw.draw(self.multi_draw_program, camera_frustum)
+                RENDER_QUEUE.begin(self.camera.position)
+                for mesh in self.multi_draw.blended_meshes():
+                    mesh.submit(RENDER_QUEUE, self.lighting_program, LIGHTING_PASS, camera_frustum)
+                RENDER_QUEUE.execute()
+            else:
+                RENDER_QUEUE.begin(self.camera.position)
+                for obj in self.objects:
+                    obj.submit(RENDER_QUEUE, self.lighting_program, LIGHTING_PASS, camera_frustum)
+                RENDER_QUEUE.execute()
+
+"""
+CampfiresScene
+
+The scene, with a few hundred small campfire lights scattered over the floor
+around the central one, to measure lighting with many lights.
+"""
+class CampfiresScene(Scene):
+    def initialise_lights(self):
+        """
+        Initialise the scene's lights, and add the scattered campfires.
+
+        Returns
+        -------
+        None.
+
+        """
         
+        super().initialise_lights()
+        
+        # Small campfires, the same colour as the central one, but falling
+        # off within a few units
+        count = CONFIG["campfire_scene_lights"]
+        campfires = np.zeros(count, dtype=POINT_LIGHT_DTYPE)
+        campfires["position"] = [(random.uniform(-20, 20), 0.75, random.uniform(-20, 20)) for _ in range(count)]
+        campfires["ambient"] = (0.886, 0.345, 0.133)
+        campfires["specular"] = (1, 1, 1)
+        campfires["constant"] = 1
+        campfires["linear"] = 0.7
+        campfires["quadratic"] = 1.8
+        self.point_lights = np.concatenate([self.point_lights, campfires])
@@ -6,12 +6,20 @@ from engine.texture.texture import Texture
 DepthBuffer
 
 Inherits from Texture.
-Holds and generates shadow map texture
+Holds and generates shadow map texture, or an array of them (ie, one per
+shadow cascade)
 """
 class DepthBuffer(Texture):
-    def __init__(self):
+    def __init__(self, layers: int = 0):
         """
-        Initialises Texture superclass constructor with 2D texture type
+        Initialises Texture superclass constructor with 2D texture type, or 2D
+        array type if given layers
+
+        Parameters
+        ----------
+        layers : int, optional
+            The number of layers of a texture array. The default is 0 (a
+            single 2D texture).
 
         Returns
         -------
@@ -20,11 +28,12 @@ class DepthBuffer(Texture):
         """
         
         logging.info("Creating depthbuffer")
-        super().__init__(GL_TEXTURE_2D)
+        super().__init__(GL_TEXTURE_2D_ARRAY if layers else GL_TEXTURE_2D)
+        self.layers = layers
 
     def generate(self, width: int, height: int):
         """
-        Binds and generates 2D texture for shadow map.
+        Binds and generates 2D texture (or texture array) for shadow map.
 
         Parameters
         ----------
@@ -43,33 +52,44 @@ class DepthBuffer(Texture):
         self.bind()
         
         # Specify texture with clamped depth format, width, and height
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT, width, height, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
+        if self.layers:
+            glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, GL_DEPTH_COMPONENT, width, height, self.layers, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
+        else:
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT, width, height, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
         
         # Sets texture magnification function
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(self.type, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(self.type, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
         
         # Clamp shadows to border to keep shadows constrained properly to
         # perspective.
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
-        glTexParameterfv(GL_TEXTURE_2D, GL_TEXTURE_BORDER_COLOR, [1.0, 1.0, 1.0, 1.0])
+        glTexParameteri(self.type, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
+        glTexParameteri(self.type, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
+        glTexParameterfv(self.type, GL_TEXTURE_BORDER_COLOR, [1.0, 1.0, 1.0, 1.0])
         
         # Unbind texture
         self.unbind()
 
-    def attach(self):
+    def attach(self, layer: int = None):
         """
         Attachs current shadow map texture to the framebuffer.
 
+        Parameters
+        ----------
+        layer : int, optional
+            The layer of a texture array to attach. The default is None.
+
         Returns
         -------
         None.
 
         """
         
-        # Attach texture to bound framebuffer
-        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.get_id(), 0)
+        # Attach texture (or one layer of it) to bound framebuffer
+        if self.layers:
+            glFramebufferTextureLayer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, self.get_id(), 0, layer)
+        else:
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.get_id(), 0)
         
         # Set read/write buffers to none, as we aren't rendering any colour
         # data
@@ -1,5 +1,6 @@
 import logging
 from OpenGL.GL import *
+from engine.core.state import GL_STATE
 
 """
 FrameBuffer
@@ -19,6 +20,44 @@ class FrameBuffer:
         logging.info("Creating framebuffer")
         self.FBO = glGenFramebuffers(1)
         
+        # Renderbuffers owned by this framebuffer, if any
+        self.renderbuffers = []
+        
+    def attach_renderbuffers(self, width: int, height: int):
+        """
+        Creates and attaches colour and depth renderbuffers, so the
+        framebuffer can stand in for the window's default framebuffer (ie, for
+        offscreen rendering).
+
+        Parameters
+        ----------
+        width : int
+            Width of the buffers.
+        height : int
+            Height of the buffers.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.bind()
+        
+        # One RGBA colour buffer and one combined depth/stencil buffer
+        for internal_format, attachment in (
+            (GL_RGBA8, GL_COLOR_ATTACHMENT0),
+            (GL_DEPTH24_STENCIL8, GL_DEPTH_STENCIL_ATTACHMENT)
+        ):
+            renderbuffer = glGenRenderbuffers(1)
+            glBindRenderbuffer(GL_RENDERBUFFER, renderbuffer)
+            glRenderbufferStorage(GL_RENDERBUFFER, internal_format, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, renderbuffer)
+            self.renderbuffers.append(renderbuffer)
+            
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        self.check_complete()
+        
     def check_complete(self):
         """
         Checks to see if the frame buffer is complete.
@@ -65,7 +104,7 @@ class FrameBuffer:
 
         """
         
-        glBindFramebuffer(GL_FRAMEBUFFER, self.FBO)
+        GL_STATE.bind_framebuffer(self.FBO)
 
     def unbind(self):
         """
@@ -77,7 +116,7 @@ class FrameBuffer:
 
         """
         
-        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        GL_STATE.bind_framebuffer(0)
     
     def __del__(self):
         """
@@ -90,8 +129,11 @@ class FrameBuffer:
         """
         
         try:
+            GL_STATE.forget_framebuffer(self.FBO)
             glDeleteFramebuffers(1, self.FBO)
             self.FBO = 0
+            for renderbuffer in self.renderbuffers:
+                glDeleteRenderbuffers(1, renderbuffer)
         except:
             pass
         
\ No newline at end of file
@@ -1,4 +1,36 @@
 from engine.core.cache import get_or_load_texture
+from engine.texture.texture import Texture, solid_texture
+
+# Colours of the stand-ins bound for maps a material does not define: a flat
+# tangent space normal, no specular highlight, and no depth
+DEFAULT_MAP_COLOURS = {
+    "normal": (128, 128, 255, 255),
+    "specular": (0, 0, 0, 255),
+    "depth": (0, 0, 0, 255)
+}
+
+# Stand-in textures, created on first use, by map
+default_maps = {}
+
+def get_default_map(name: str) -> Texture:
+    """
+    Returns the stand-in texture for a material map, creating it if needed.
+
+    Parameters
+    ----------
+    name : str
+        The map, a key of DEFAULT_MAP_COLOURS.
+
+    Returns
+    -------
+    Texture
+        The stand-in texture.
+
+    """
+    
+    if name not in default_maps:
+        default_maps[name] = solid_texture(DEFAULT_MAP_COLOURS[name])
+    return default_maps[name]
 
 """
 Material
@@ -16,7 +48,9 @@ class Material:
         height_scale: float = 0
     ):
         """
-        Loads each texture specified (if unloaded), and sets exponents.
+        Queues each texture specified for loading (if unloaded), and sets
+        exponents. Textures are decoded in the background; see
+        engine.core.cache.finish_texture_loads().
 
         Parameters
         ----------
@@ -50,3 +84,34 @@ class Material:
         # Set other properties
         self.shininess = shininess
         self.height_scale = height_scale
+        
+    @property
+    def blended(self) -> bool:
+        """
+        Whether meshes with this material must be alpha blended, ie, whether
+        the diffuse texture has transparent texels. Only known once the
+        texture is loaded.
+
+        Returns
+        -------
+        bool
+            True if the material is blended.
+
+        """
+        
+        return self.diffuse.has_alpha
+        
+    @property
+    def textures(self) -> tuple:
+        """
+        The texture of each map, or None where a map is not defined. Materials
+        with equal textures bind the same texture units.
+
+        Returns
+        -------
+        tuple
+            The diffuse, normal, specular, and depth textures.
+
+        """
+        
+        return (self.diffuse, self.normal, self.specular, self.depth)
@@ -5,6 +5,8 @@ from OpenGL.GL import *
 from engine.texture.texture import Texture
 from engine.object.model import Model
 from engine.core.program import ShaderProgram
+from engine.core.profiler import PROFILER
+from engine.core.state import GL_STATE
 
 """
 Skybox
@@ -104,15 +106,14 @@ class Skybox(Texture):
         """
         
         # Disable depth mask to render behind everything
-        glDepthMask(GL_FALSE)
+        GL_STATE.set_depth_mask(False)
         
         # Set 0th texture unit to skybox cube map
-        glActiveTexture(GL_TEXTURE0)
         program.setInt("skybox", 0)
-        self.bind()
+        self.bind(0)
         
         # Hijack cube model's mesh to draw similarly, but with cube map texture
-        glBindVertexArray(self.model.meshes[0].VAO)
+        GL_STATE.bind_vertex_array(self.model.meshes[0].VAO)
         
         # Create model matrix to draw around the center of the scene
         model_matrix = glm.mat4()
@@ -123,10 +124,12 @@ class Skybox(Texture):
         program.setMat4("model", model_matrix)
         
         # Draw model with cube map texture
-        glDrawElements(GL_TRIANGLES, len(self.model.meshes[0].indices), GL_UNSIGNED_INT, None)
+        PROFILER.count("draw_calls")
+        mesh = self.model.meshes[0]
+        glDrawElements(GL_TRIANGLES, mesh.index_count, mesh.index_type, None)
         
         # Reenable depth masking
-        glDepthMask(GL_TRUE)
+        GL_STATE.set_depth_mask(True)
         
         
         
\ No newline at end of file
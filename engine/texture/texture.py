@@ -1,6 +1,12 @@
 import os
+import logging
+import numpy as np
 from OpenGL.GL import *
 from PIL import Image
+from concurrent.futures import Executor
+from engine.core.assets import get_compiled_asset, read_texture_blob
+from engine.core.profiler import PROFILER
+from engine.core.state import GL_STATE
 
 """
 Texture
@@ -8,7 +14,7 @@ Texture
 Loads and holds reference to texture
 """
 class Texture:
-    def __init__(self, type: int, path: str = None):
+    def __init__(self, type: int, path: str = None, executor: Executor = None, cache = None):
         """
         Generates a texture object, and, if supplied a path (and if the texture
         is standalone), loads the texture.
@@ -19,6 +25,13 @@ class Texture:
             The type of the texture object.
         path : str, optional
             The path to the texture file. The default is None.
+        executor : Executor, optional
+            If given, the image is decoded on the executor, and only uploaded
+            when Texture.finish() is called or the texture is first bound.
+            The default is None, which loads the texture immediately.
+        cache : TextureCache, optional
+            The cache accounting for this texture's memory, notified on upload
+            and bind. The default is None.
 
         Raises
         ------
@@ -36,15 +49,34 @@ class Texture:
             
         # Generate a texture object
         self.type = type
+        self.path = path
         self.texture = glGenTextures(1)
         
+        # Future holding the decoded image while a deferred load is pending
+        self.pending = None
+        
+        # Memory accounting for the texture cache: bytes used by all levels,
+        # and the cache frame in which the texture was last bound
+        self.cache = cache
+        self.size_bytes = 0
+        self.last_frame = -1
+        
+        # Whether any texel is not fully opaque, known once uploaded
+        self.has_alpha = False
+        
         # For depthbuffers and cube maps, we do not want to load a texture
         if path and type == GL_TEXTURE_2D:
-            self.load(path)
+            if executor:
+                self.pending = executor.submit(Texture.decode, path)
+            else:
+                self.load(path)
         
-    def load(self, path: str):
+    @staticmethod
+    def decode(path: str) -> (list[np.ndarray], bool, bool):
         """
-        Loads texture from file.
+        Decodes a texture file into RGBA levels ready for upload. Touches no
+        GL state, so is safe to run off the context thread. PIL releases the
+        GIL while decoding, so several textures can decode in parallel.
 
         Parameters
         ----------
@@ -53,12 +85,19 @@ class Texture:
 
         Returns
         -------
-        None.
+        (list[np.ndarray], bool, bool)
+            The levels to upload, largest first, each of shape
+            (height, width, 4), whether the levels are a full mip chain, and
+            whether any texel is not fully opaque.
 
         """
         
-        # Bind texture object
-        self.bind()
+        # If the asset compiler has already flipped the image and built its mip
+        # chain, use the memory mapped blob as is
+        artifact = get_compiled_asset(f"resources/textures/{path}")
+        if artifact:
+            levels, has_alpha = read_texture_blob(artifact)
+            return levels, True, has_alpha
         
         # Load image
         image = Image.open(f"resources/textures/{path}")
@@ -66,18 +105,144 @@ class Texture:
         # Flip for OpenGL
         image = image.transpose(Image.FLIP_TOP_BOTTOM)
         
-        # Convert image to bytes and pass as data for texture object
-        image_bytes = image.convert('RGBA').tobytes()
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, image.width, image.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, image_bytes)
+        # Convert image to RGBA bytes
+        image = image.convert('RGBA')
+        return [np.asarray(image)], False, image.getextrema()[3][0] < 255
+        
+    def upload(self, levels: list[np.ndarray], mipmapped: bool, has_alpha: bool = False):
+        """
+        Uploads decoded levels to the texture object. Must be called on the
+        thread owning the GL context.
+
+        Parameters
+        ----------
+        levels : list[np.ndarray]
+            The levels to upload, as returned by Texture.decode().
+        mipmapped : bool
+            Whether the levels are a full mip chain. If not, mipmaps are
+            generated from the first level.
+        has_alpha : bool, optional
+            Whether any texel is not fully opaque. The default is False.
 
-        # Generate mipmaps for performant distance rendering
-        glGenerateMipmap(GL_TEXTURE_2D)
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.has_alpha = has_alpha
+        
+        # Bind texture object
+        GL_STATE.bind_texture(self.type, self.texture)
+        
+        # Pass each level's bytes as data for texture object
+        for i, level in enumerate(levels):
+            glTexImage2D(GL_TEXTURE_2D, i, GL_RGBA, level.shape[1], level.shape[0], 0, GL_RGBA, GL_UNSIGNED_BYTE, level)
+            
+        if mipmapped:
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+            self.size_bytes = sum(level.nbytes for level in levels)
+        else:
+            # Generate mipmaps for performant distance rendering
+            glGenerateMipmap(GL_TEXTURE_2D)
+            self.size_bytes = Texture.mip_chain_bytes(levels[0].shape[1], levels[0].shape[0])
         
         # Set parameters to repeat on edge and to set magnification function
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        
+        if self.cache is not None:
+            self.cache.on_upload(self)
+        
+    @staticmethod
+    def mip_chain_bytes(width: int, height: int) -> int:
+        """
+        Returns the bytes used by an RGBA8 texture and its full mip chain.
+
+        Parameters
+        ----------
+        width : int
+            Width of the base level.
+        height : int
+            Height of the base level.
+
+        Returns
+        -------
+        int
+            Total bytes of all levels.
+
+        """
+        
+        total = 0
+        while True:
+            total += width * height * 4
+            if width == 1 and height == 1:
+                return total
+            width, height = max(width // 2, 1), max(height // 2, 1)
+        
+    def load(self, path: str):
+        """
+        Loads texture from file, decoding and uploading on this thread.
+
+        Parameters
+        ----------
+        path : str
+            The path to the image for the texture.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.upload(*Texture.decode(path))
+        
+    def finish(self):
+        """
+        Waits for a deferred decode to complete, then uploads it. Does nothing
+        if no load is pending.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            self.upload(*pending.result())
+            
+    def evict(self):
+        """
+        Deletes the texture object to free its memory, keeping the path so it
+        can be reloaded.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        logging.info(f"Evicting texture {self.path}")
+        GL_STATE.forget_texture(self.texture)
+        glDeleteTextures(1, [self.texture])
+        self.texture = 0
+        self.size_bytes = 0
+        
+    def reload(self):
+        """
+        Regenerates and reloads an evicted texture object, synchronously.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.texture = glGenTextures(1)
+        self.load(self.path)
     
     def get_id(self) -> int:
         """
@@ -92,9 +257,17 @@ class Texture:
         
         return self.texture
     
-    def bind(self):
+    def bind(self, unit: int = None):
         """
-        Binds the texture object to the type.
+        Binds the texture object to the type, unless already bound. If a
+        deferred load is still pending, waits for it and uploads first. If the
+        texture was evicted from its cache, the cache reloads it first.
+
+        Parameters
+        ----------
+        unit : int, optional
+            The texture unit to bind to, ie, 1 for GL_TEXTURE1. The default is
+            None (the active unit).
 
         Returns
         -------
@@ -102,7 +275,13 @@ class Texture:
 
         """
         
-        glBindTexture(self.type, self.texture)
+        if self.pending is not None:
+            self.finish()
+        if self.cache is not None:
+            self.cache.on_bind(self)
+            
+        if GL_STATE.bind_texture(self.type, self.texture, unit):
+            PROFILER.count("texture_binds")
 
     def unbind(self):
         """
@@ -114,7 +293,7 @@ class Texture:
 
         """
         
-        glBindTexture(self.type, 0)
+        GL_STATE.bind_texture(self.type, 0)
 
     def __del__(self):
         """
@@ -127,7 +306,29 @@ class Texture:
         """
         
         try:
+            GL_STATE.forget_texture(self.texture)
             glDeleteTextures(1, self.texture)
             self.texture = 0
         except:
             pass
+
+def solid_texture(colour: tuple) -> Texture:
+    """
+    Creates a one texel texture of a single colour, ie, to stand in for a
+    material map that is not defined.
+
+    Parameters
+    ----------
+    colour : tuple
+        The RGBA colour, each channel 0 to 255.
+
+    Returns
+    -------
+    Texture
+        The texture.
+
+    """
+    
+    texture = Texture(GL_TEXTURE_2D)
+    texture.upload([np.array([[colour]], dtype=np.uint8)], True)
+    return texture
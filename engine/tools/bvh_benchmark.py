@@ -0,0 +1,224 @@
+import sys
+import json
+import time
+import logging
+import argparse
+import glm
+import numpy as np
+from engine.core.bvh import BVH, ray_boxes, box_distances
+from engine.core.culling import cull_aabbs, extract_frustum_planes
+
+"""
+bvh_benchmark
+
+Compares BVH queries against testing every box, over random scenes of
+instance bounding boxes scattered across a ground plane, and checks that both
+give the same results.
+
+Usage:
+    python -m engine.tools.bvh_benchmark --counts 1000 10000 100000
+"""
+
+def generate_instances(count: int, rng: np.random.Generator, size: float = None) -> (np.ndarray, np.ndarray):
+    """
+    Scatters instance bounding boxes over a square of ground, mostly small,
+    with a few large, as for grass, plants and rocks.
+
+    Parameters
+    ----------
+    count : int
+        The number of instances.
+    rng : np.random.Generator
+        The random number generator.
+    size : float, optional
+        The side of the square. The default is None (scaled so density is the
+        same for every count).
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        Box centres and half extents, each of shape (count, 3).
+
+    """
+
+    size = size or 10 * np.sqrt(count)
+    centers = np.column_stack([
+        rng.uniform(-size / 2, size / 2, count),
+        rng.uniform(0, 2, count),
+        rng.uniform(-size / 2, size / 2, count)
+    ])
+    extents = rng.uniform(0.2, 1, (count, 3)) * np.where(rng.random(count) < 0.05, 8, 1)[:, None]
+    return centers, extents
+
+def generate_frustums(count: int, rng: np.random.Generator, size: float) -> list[np.ndarray]:
+    """
+    Generates camera frustums at head height, looking in random directions.
+
+    Parameters
+    ----------
+    count : int
+        The number of frustums.
+    rng : np.random.Generator
+        The random number generator.
+    size : float
+        The side of the square cameras are placed in.
+
+    Returns
+    -------
+    list[np.ndarray]
+        Frustum planes, each of shape (6, 4).
+
+    """
+
+    projection = glm.perspective(glm.radians(45), 16 / 9, 0.1, 200)
+    frustums = []
+    for _ in range(count):
+        position = glm.vec3(rng.uniform(-size / 2, size / 2), 2, rng.uniform(-size / 2, size / 2))
+        yaw = rng.uniform(0, 2 * np.pi)
+        target = position + glm.vec3(np.cos(yaw), rng.uniform(-0.3, 0.1), np.sin(yaw))
+        frustums.append(extract_frustum_planes(projection * glm.lookAt(position, target, glm.vec3(0, 1, 0))))
+    return frustums
+
+def time_calls(function, arguments: list) -> (list, float):
+    """
+    Calls a function once for each set of arguments.
+
+    Parameters
+    ----------
+    function : callable
+        The function.
+    arguments : list
+        Tuples of arguments.
+
+    Returns
+    -------
+    (list, float)
+        The results, and the mean time per call in milliseconds.
+
+    """
+
+    start = time.perf_counter()
+    results = [function(*args) for args in arguments]
+    return results, (time.perf_counter() - start) * 1000 / max(len(arguments), 1)
+
+def benchmark(count: int, queries: int, rng: np.random.Generator) -> dict:
+    """
+    Times building, refitting and querying a BVH over a random scene, and the
+    same queries by brute force.
+
+    Parameters
+    ----------
+    count : int
+        The number of instances.
+    queries : int
+        The number of queries of each kind.
+    rng : np.random.Generator
+        The random number generator.
+
+    Raises
+    ------
+    AssertionError
+        If a BVH query disagrees with brute force.
+
+    Returns
+    -------
+    dict
+        Timings in milliseconds, and tree statistics.
+
+    """
+
+    centers, extents = generate_instances(count, rng)
+    size = 10 * np.sqrt(count)
+    mins, maxs = centers - extents, centers + extents
+    bvh = BVH()
+
+    start = time.perf_counter()
+    bvh.build(centers, extents)
+    build_time = (time.perf_counter() - start) * 1000
+
+    # Move a tenth of the instances a little, as a frame of animation would
+    moved = centers.copy()
+    moving = rng.random(count) < 0.1
+    moved[moving] += rng.normal(0, 0.5, (np.count_nonzero(moving), 3))
+    start = time.perf_counter()
+    bvh.refit(moved, extents)
+    refit_time = (time.perf_counter() - start) * 1000
+    refit_cost = bvh.cost
+    bvh.refit(centers, extents)
+
+    frustums = [(planes,) for planes in generate_frustums(queries, rng, size)]
+    bvh_frustum, bvh_frustum_time = time_calls(bvh.query_frustum, frustums)
+    brute_frustum, brute_frustum_time = time_calls(lambda planes: cull_aabbs(planes, centers, extents), frustums)
+    assert all(np.array_equal(a, b) for a, b in zip(bvh_frustum, brute_frustum)), "Frustum queries differ"
+
+    # Rays from head height, towards random points on the ground
+    origins = np.column_stack([rng.uniform(-size / 2, size / 2, queries), np.full(queries, 2), rng.uniform(-size / 2, size / 2, queries)])
+    targets = np.column_stack([rng.uniform(-size / 2, size / 2, queries), np.zeros(queries), rng.uniform(-size / 2, size / 2, queries)])
+    rays = list(zip(origins, targets - origins))
+    bvh_ray, bvh_ray_time = time_calls(bvh.raycast, rays)
+    brute_ray, brute_ray_time = time_calls(lambda origin, direction: ray_boxes(origin, direction, mins, maxs).min(), rays)
+    assert all(np.isclose(a[1], b) or a[1] == b for a, b in zip(bvh_ray, brute_ray)), "Ray casts differ"
+
+    # Spheres the size of a campfire's light
+    spheres = [(center, 7.0) for center in origins]
+    bvh_sphere, bvh_sphere_time = time_calls(bvh.query_sphere, spheres)
+    brute_sphere, brute_sphere_time = time_calls(lambda center, radius: np.flatnonzero(box_distances(center, mins, maxs) <= radius * radius), spheres)
+    assert all(np.array_equal(a, b) for a, b in zip(bvh_sphere, brute_sphere)), "Sphere queries differ"
+
+    return {
+        "instances": count,
+        "nodes": len(bvh.node_child),
+        "depth": len(bvh.levels),
+        "sah_cost": bvh.built_cost,
+        "refit_sah_cost": refit_cost,
+        "build_ms": build_time,
+        "refit_ms": refit_time,
+        "frustum_ms": {"bvh": bvh_frustum_time, "brute_force": brute_frustum_time},
+        "ray_ms": {"bvh": bvh_ray_time, "brute_force": brute_ray_time},
+        "sphere_ms": {"bvh": bvh_sphere_time, "brute_force": brute_sphere_time}
+    }
+
+def main(argv: list[str] = None) -> int:
+    """
+    Command line entry point.
+
+    Parameters
+    ----------
+    argv : list[str], optional
+        Command line arguments. The default is None (sys.argv).
+
+    Returns
+    -------
+    int
+        Exit code.
+
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmark BVH queries against brute force.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000, 100000], help="instance counts to test")
+    parser.add_argument("--queries", type=int, default=100, help="queries of each kind per count")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("-o", "--output", default=None, help="path to write results as JSON")
+    args = parser.parse_args(argv)
+
+    logging.root.setLevel(logging.INFO)
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for count in args.counts:
+        result = benchmark(count, args.queries, rng)
+        results.append(result)
+        logging.info(
+            f"{count} instances: build {result['build_ms']:.1f} ms, refit {result['refit_ms']:.2f} ms, "
+            + ", ".join(
+                f"{query} {result[f'{query}_ms']['bvh']:.3f} ms (brute force {result[f'{query}_ms']['brute_force']:.3f} ms)"
+                for query in ("frustum", "ray", "sphere")
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
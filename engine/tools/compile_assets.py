@@ -0,0 +1,298 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import numpy as np
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from engine.core.modelcache import hash_file, write_model_cache, prepare_model
+from engine.core.assets import (
+    MANIFEST_NAME,
+    load_manifest,
+    write_texture_blob,
+    preprocess_shader
+)
+
+"""
+compile_assets
+
+Offline asset compiler. Walks a source directory and writes runtime ready
+artifacts to a build directory, alongside a manifest read by the engine at
+startup.
+
+Usage:
+    python -m engine.tools.compile_assets resources/ build/
+"""
+
+# Source subdirectories, the compiler for their files, and the extension of
+# the artifacts they produce (None keeps the source extension)
+ASSET_TYPES = {
+    "models": ("model", ".pglm"),
+    "textures": ("texture", ".pglt"),
+    "shaders": ("shader", None)
+}
+
+def compile_model(source: str, artifact: str, digest: bytes):
+    """
+    Compiles an Assimp2JSON model to the binary model format, optimising
+    its meshes if configured.
+
+    Parameters
+    ----------
+    source : str
+        The path to the JSON source.
+    artifact : str
+        The path to write the binary model to.
+    digest : bytes
+        The SHA-256 digest of the source.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    with open(source) as file:
+        data = json.load(file)
+    prepare_model(data, source)
+    write_model_cache(artifact, data, digest)
+
+def compile_texture(source: str, artifact: str, digest: bytes):
+    """
+    Compiles an image to a texture blob, flipped for OpenGL, converted to RGBA,
+    with its full mip chain.
+
+    Parameters
+    ----------
+    source : str
+        The path to the image.
+    artifact : str
+        The path to write the blob to.
+    digest : bytes
+        Unused. The SHA-256 digest of the source.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    image = Image.open(source).transpose(Image.FLIP_TOP_BOTTOM).convert("RGBA")
+    has_alpha = image.getextrema()[3][0] < 255
+
+    # Box filter each level down from the previous one, to 1x1
+    levels = [np.asarray(image)]
+    while image.width > 1 or image.height > 1:
+        image = image.resize((max(image.width // 2, 1), max(image.height // 2, 1)), Image.BOX)
+        levels.append(np.asarray(image))
+
+    write_texture_blob(artifact, levels, has_alpha)
+
+def compile_shader(source: str, artifact: str, digest: bytes):
+    """
+    Compiles a GLSL source by preprocessing it.
+
+    Parameters
+    ----------
+    source : str
+        The path to the shader source.
+    artifact : str
+        The path to write the preprocessed source to.
+    digest : bytes
+        Unused. The SHA-256 digest of the source.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    with open(artifact, "w") as file:
+        file.write(preprocess_shader(source))
+
+COMPILERS = {
+    "model": compile_model,
+    "texture": compile_texture,
+    "shader": compile_shader
+}
+
+def compile_asset(kind: str, source: str, artifact: str, digest: bytes) -> str:
+    """
+    Compiles a single asset. Runs in a worker process.
+
+    Parameters
+    ----------
+    kind : str
+        The asset type, a key of COMPILERS.
+    source : str
+        The path to the source file.
+    artifact : str
+        The path to write the artifact to.
+    digest : bytes
+        The SHA-256 digest of the source.
+
+    Returns
+    -------
+    str
+        The artifact path.
+
+    """
+
+    os.makedirs(os.path.dirname(artifact), exist_ok=True)
+
+    # Write to a temporary path so an interrupted compile is never mistaken for
+    # an up to date artifact
+    temp_path = f"{artifact}.tmp"
+    COMPILERS[kind](source, temp_path, digest)
+    os.replace(temp_path, artifact)
+    return artifact
+
+def find_sources(source_dir: str) -> list[(str, str, str)]:
+    """
+    Walks the source directory for compilable assets.
+
+    Parameters
+    ----------
+    source_dir : str
+        The asset source directory.
+
+    Returns
+    -------
+    list[(str, str, str)]
+        Tuples of manifest key, asset type, and artifact path relative to the
+        build directory.
+
+    """
+
+    sources = []
+    for subdir, (kind, extension) in ASSET_TYPES.items():
+        for root, _, files in os.walk(os.path.join(source_dir, subdir)):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, source_dir).replace(os.sep, "/")
+                artifact = f"{os.path.splitext(key)[0]}{extension}" if extension else key
+                sources.append((key, kind, artifact))
+    return sources
+
+def compile_assets(source_dir: str, build_dir: str, jobs: int = None, force: bool = False) -> dict:
+    """
+    Compiles all out of date assets in parallel, and writes the manifest.
+
+    An asset is skipped if its source's mtime and size match the manifest. If
+    they differ but its hash does not, only the manifest entry is updated.
+
+    Parameters
+    ----------
+    source_dir : str
+        The asset source directory.
+    build_dir : str
+        The directory to write artifacts and the manifest to.
+    jobs : int, optional
+        Number of worker processes. The default is None (one per CPU).
+    force : bool, optional
+        Recompile every asset regardless of the manifest. The default is False.
+
+    Returns
+    -------
+    dict
+        Counts of compiled, skipped, and failed assets.
+
+    """
+
+    manifest = load_manifest(build_dir)
+    previous = manifest["assets"]
+    assets = {}
+    pending = []
+    stats = {"compiled": 0, "skipped": 0, "failed": 0}
+
+    for key, kind, artifact in find_sources(source_dir):
+        source = os.path.join(source_dir, key)
+        stat = os.stat(source)
+        entry = previous.get(key)
+        artifact_exists = os.path.exists(os.path.join(build_dir, artifact))
+
+        # Fast path: untouched since last compile
+        if not force and entry and artifact_exists and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            assets[key] = entry
+            stats["skipped"] += 1
+            continue
+
+        # Slow path: touched, but contents may be the same
+        digest = hash_file(source)
+        record = {
+            "type": kind,
+            "artifact": artifact,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": digest.hex()
+        }
+        if not force and entry and artifact_exists and entry["hash"] == record["hash"]:
+            assets[key] = record
+            stats["skipped"] += 1
+            continue
+
+        pending.append((key, kind, source, os.path.join(build_dir, artifact), digest, record))
+
+    # Compile everything out of date across a process pool
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(compile_asset, kind, source, artifact, digest): (key, record)
+            for key, kind, source, artifact, digest, record in pending
+        }
+        for future in as_completed(futures):
+            key, record = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                logging.error(f"Failed to compile {key}: {error}")
+                stats["failed"] += 1
+                continue
+            logging.info(f"Compiled {key}")
+            assets[key] = record
+            stats["compiled"] += 1
+
+    # Write the manifest last, so it only refers to complete artifacts
+    manifest["assets"] = dict(sorted(assets.items()))
+    manifest["source_dir"] = source_dir
+    os.makedirs(build_dir, exist_ok=True)
+    with open(os.path.join(build_dir, MANIFEST_NAME), "w") as file:
+        json.dump(manifest, file, indent=4)
+
+    return stats
+
+def main(argv: list[str] = None) -> int:
+    """
+    Command line entry point.
+
+    Parameters
+    ----------
+    argv : list[str], optional
+        Command line arguments. The default is None (sys.argv).
+
+    Returns
+    -------
+    int
+        Exit code, non-zero if any asset failed to compile.
+
+    """
+
+    parser = argparse.ArgumentParser(description="Compile engine assets into runtime artifacts.")
+    parser.add_argument("source", help="asset source directory, ie resources/")
+    parser.add_argument("build", help="output directory, ie build/")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+    parser.add_argument("-f", "--force", action="store_true", help="recompile all assets")
+    args = parser.parse_args(argv)
+
+    logging.root.setLevel(logging.INFO)
+    start = time.perf_counter()
+    stats = compile_assets(os.path.normpath(args.source), os.path.normpath(args.build), args.jobs, args.force)
+    logging.info(
+        f"Compiled {stats['compiled']}, skipped {stats['skipped']}, "
+        f"failed {stats['failed']} assets in {time.perf_counter() - start:.2f}s"
+    )
+    return 1 if stats["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,24 @@
 import glfw
 import logging
+import argparse
 from engine.config import CONFIG
 from engine.application import Application
+from engine.core.state import GL_STATE
 from OpenGL.GL import *
 
-def initialise_glfw():
+def initialise_glfw(context: str = None):
     """
     Initialise GLFW, the OpenGL wrapper library, and sets flags for the
     GL context.
 
+    Parameters
+    ----------
+    context : str, optional
+        For benchmarks, how to create a context without a visible window:
+        "hidden" (a hidden window), "egl", or "osmesa" (software rendering,
+        ie, llvmpipe, needing no display or GPU). The default is None (a
+        visible window).
+
     Raises
     ------
     RuntimeError
@@ -19,6 +29,10 @@ def initialise_glfw():
     None.
 
     """
+    # OSMesa needs no windowing system at all, where GLFW supports that
+    if context == "osmesa" and hasattr(glfw, "PLATFORM_NULL"):
+        glfw.init_hint(glfw.PLATFORM, glfw.PLATFORM_NULL)
+        
     if not glfw.init():
         raise RuntimeError("Failed to initialize GLFW.")
 
@@ -32,11 +46,25 @@ def initialise_glfw():
     
     # Multisampling level
     glfw.window_hint(glfw.SAMPLES, CONFIG['sampling_level'])
+    
+    # Headless contexts for benchmarking
+    if context:
+        glfw.window_hint(glfw.VISIBLE, False)
+    if context == "egl":
+        glfw.window_hint(glfw.CONTEXT_CREATION_API, glfw.EGL_CONTEXT_API)
+    elif context == "osmesa":
+        glfw.window_hint(glfw.CONTEXT_CREATION_API, glfw.OSMESA_CONTEXT_API)
 
-def initialise_display():
+def initialise_display(hidden: bool = False):
     """
     Initialises window with information from config file.
 
+    Parameters
+    ----------
+    hidden : bool, optional
+        Whether the window is hidden, ie, for benchmarks. The default is
+        False.
+
     Returns
     -------
     window : GLFWWindow
@@ -62,7 +90,8 @@ def initialise_display():
     
     # Set window as context, then hide cursor
     glfw.make_context_current(window)
-    glfw.set_input_mode(window, glfw.CURSOR, glfw.CURSOR_DISABLED)
+    if not hidden:
+        glfw.set_input_mode(window, glfw.CURSOR, glfw.CURSOR_DISABLED)
     
     return window
 
@@ -76,22 +105,80 @@ def initialise_gl_flags():
 
     """
     # Enable depth testing
-    glEnable(GL_DEPTH_TEST)
+    GL_STATE.enable(GL_DEPTH_TEST)
     
     # Enable multisampling explicitly
-    glEnable(GL_MULTISAMPLE)
+    GL_STATE.enable(GL_MULTISAMPLE)
     
     # Enable back face culling 
-    glEnable(GL_CULL_FACE)
+    GL_STATE.enable(GL_CULL_FACE)
     glCullFace(GL_BACK)
     
     # Enable alpha blending for PNG transparencies
-    glEnable(GL_BLEND);
-    glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA);
+    GL_STATE.enable(GL_BLEND)
+    GL_STATE.set_blend_func(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+    
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command line arguments.
+
+    Returns
+    -------
+    argparse.Namespace
+        The parsed arguments.
+
+    """
+    
+    parser = argparse.ArgumentParser(description=CONFIG['app_name'])
+    parser.add_argument("--benchmark", metavar="SCENE", help="render SCENE offscreen and write timings, instead of running interactively")
+    parser.add_argument("--frames", type=int, default=600, help="number of frames to time")
+    parser.add_argument("--warmup", type=int, default=10, help="number of untimed frames rendered first")
+    parser.add_argument("--path", help="camera path JSON to replay")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the scene's random numbers")
+    parser.add_argument("--output", default="benchmark.json", help="path to write results to")
+    parser.add_argument("--context", choices=["hidden", "egl", "osmesa"], default="hidden", help="how to create the headless context")
+    return parser.parse_args()
+
+def run_benchmark(args: argparse.Namespace):
+    """
+    Runs a headless benchmark and writes its results.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed arguments.
+
+    Raises
+    ------
+    RuntimeError
+        If a context cannot be created.
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    # Imported here, as importing a scene creates GL objects
+    from engine.benchmark import Benchmark
+    
+    initialise_glfw(args.context)
+    window = initialise_display(hidden=True)
+    if not window:
+        raise RuntimeError(f"Failed to create a {args.context} context.")
+    initialise_gl_flags()
+    
+    benchmark = Benchmark(args.benchmark, args.frames, args.path, args.warmup, args.seed)
+    Benchmark.write(benchmark.run(window), args.output)
+    glfw.terminate()
     
 if __name__ == '__main__': 
     logging.root.setLevel(logging.INFO)
-    initialise_glfw()
-    app = Application(initialise_display())
-    initialise_gl_flags()
-    app.run()
\ No newline at end of file
+    args = parse_arguments()
+    if args.benchmark:
+        run_benchmark(args)
+    else:
+        initialise_glfw()
+        app = Application(initialise_display())
+        initialise_gl_flags()
+        app.run()
\ No newline at end of file
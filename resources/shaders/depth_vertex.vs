@@ -2,10 +2,39 @@
 
 layout (location = 0) in vec3 aPos;
 
-uniform mat4 lightSpaceMatrix;
+// per-instance model matrix, used instead of the model uniform when instanced
+layout (location = 5) in mat4 aInstanceModel;
+
+// Global light struct
+struct GlobalLight {
+    vec3 position;
+    vec3 ambient;
+    vec3 diffuse;
+    vec3 specular;
+};
+
+// per-frame data, shared by every program through one uniform buffer
+// (the layout must match FRAME_DATA_DTYPE in engine/core/uniformbuffer.py)
+#define MAX_SHADOW_CASCADES 4
+layout (std140) uniform FrameData {
+    mat4 viewProject; // View * Projection matrix
+    mat4 view; // View matrix
+    mat4 projection; // Projection matrix
+    mat4 lightSpaceMatrices[MAX_SHADOW_CASCADES]; // Light space matrix of each shadow cascade
+    vec4 cascadeSplits; // View depth at which each shadow cascade ends
+    vec3 viewPos; // Position vector of camera
+    int cascadeCount; // Number of shadow cascades
+    GlobalLight globalLight; // Global light information
+};
+
 uniform mat4 model;
+uniform bool instanced;
+uniform int cascade; // The shadow cascade being rendered
 
 void main() {
-    // transform all vertices to light space
-    gl_Position = lightSpaceMatrix * model * vec4(aPos, 1.0);
+    // select the model matrix for this instance
+    mat4 modelMatrix = instanced ? aInstanceModel : model;
+    
+    // transform all vertices to the cascade's light space
+    gl_Position = lightSpaceMatrices[cascade] * modelMatrix * vec4(aPos, 1.0);
 }
\ No newline at end of file
@@ -0,0 +1,43 @@
+#version 460 core
+
+layout (location = 0) in vec3 aPos;
+
+// Global light struct
+struct GlobalLight {
+    vec3 position;
+    vec3 ambient;
+    vec3 diffuse;
+    vec3 specular;
+};
+
+// per-frame data, shared by every program through one uniform buffer
+// (the layout must match FRAME_DATA_DTYPE in engine/core/uniformbuffer.py)
+#define MAX_SHADOW_CASCADES 4
+layout (std140) uniform FrameData {
+    mat4 viewProject; // View * Projection matrix
+    mat4 view; // View matrix
+    mat4 projection; // Projection matrix
+    mat4 lightSpaceMatrices[MAX_SHADOW_CASCADES]; // Light space matrix of each shadow cascade
+    vec4 cascadeSplits; // View depth at which each shadow cascade ends
+    vec3 viewPos; // Position vector of camera
+    int cascadeCount; // Number of shadow cascades
+    GlobalLight globalLight; // Global light information
+};
+
+// storage buffers written by MultiDrawRenderer, as in vertex_mdi.vs
+layout (std430, binding = 0) readonly buffer InstanceTransforms {
+    mat4 instanceModels[];
+};
+layout (std430, binding = 1) readonly buffer DrawInstances {
+    uint drawInstances[];
+};
+
+uniform int cascade; // The shadow cascade being rendered
+
+void main() {
+    // each draw's instances start at its base instance
+    mat4 modelMatrix = instanceModels[drawInstances[gl_BaseInstance + gl_InstanceID]];
+    
+    // transform all vertices to the cascade's light space
+    gl_Position = lightSpaceMatrices[cascade] * modelMatrix * vec4(aPos, 1.0);
+}
@@ -9,7 +9,6 @@ in VS_OUT {
     vec2 texCoords;
     vec3 tangentViewPosition;
     vec3 tangentFragPosition;
-    vec4 fragPosLightSpace;
     vec3 normal;
     vec3 tangentGlobalLightPosition;
 } fs_in;
@@ -25,14 +24,17 @@ struct Material {
 };
 
 // point light struct
+// stored as four texels in pointLightData, falloff values and radius filling
+// the fourth component of each vec3
 struct PointLight {
     vec3 position;
-    vec3 ambient;
-    vec3 specular;
-    vec3 diffuse;
     float constant;
+    vec3 ambient;
     float linear;
+    vec3 diffuse;
     float quadratic;
+    vec3 specular;
+    float radius;
 };
 
 // global light struct
@@ -47,15 +49,53 @@ struct GlobalLight {
 // material uniform
 uniform Material mat;
 
-// define lights
-// changing length of pointLights allows for more, additive point lights
-// Must have same length as lights set, else undefined elements set all lighting to 0
-#define NUM_LIGHT_POINTS 1
-uniform PointLight pointLights[NUM_LIGHT_POINTS];
-uniform GlobalLight globalLight;
+// when drawn by multi-draw indirect, one draw call covers meshes of several
+// materials sharing textures, so the vertex shader reads each draw's
+// material values from a storage buffer and passes them on
+#ifdef MULTI_DRAW
+flat in float materialShininess;
+flat in float materialHeightScale;
+#define SHININESS materialShininess
+#define HEIGHT_SCALE materialHeightScale
+#else
+#define SHININESS mat.shininess
+#define HEIGHT_SCALE mat.heightScale
+#endif
 
-// shadow map uniform
-uniform sampler2D shadowMap;
+// per-frame data, shared with the vertex shader
+// (the layout must match FRAME_DATA_DTYPE in engine/core/uniformbuffer.py)
+#define MAX_SHADOW_CASCADES 4
+layout (std140) uniform FrameData {
+    mat4 viewProject;
+    mat4 view;
+    mat4 projection;
+    mat4 lightSpaceMatrices[MAX_SHADOW_CASCADES];
+    vec4 cascadeSplits;
+    vec3 viewPos;
+    int cascadeCount;
+    GlobalLight globalLight;
+};
+
+// light clustering info
+// the view frustum is split into a grid of clusters, tiles of the screen along
+// x and y and exponentially deeper slices along z, and each cluster lists only
+// the point lights which reach it
+// (the layout must match LIGHT_DATA_DTYPE in engine/core/uniformbuffer.py)
+layout (std140) uniform LightData {
+    ivec4 clusterGrid;      // clusters along x, y, and z, and whether to use them
+    vec4 clusterDepth;      // near, far, slices per unit of log depth, log of near
+    vec2 clusterTileSize;   // size of a tile in pixels
+    int pointLightCount;
+};
+
+// every point light, the offset and count of each cluster's lights in the
+// index list, and the index list
+uniform samplerBuffer pointLightData;
+uniform usamplerBuffer clusterData;
+uniform usamplerBuffer clusterLightIndices;
+
+// shadow map uniform, a layer per cascade
+uniform sampler2DArray shadowMap;
 
 // forward declaration of functions
 // parallax mapping of tex coords
@@ -64,6 +104,12 @@ vec2 parallax(vec3 viewDirection);
 // calculate directional lighting
 vec3 addDirectionalLight(vec3 normal, vec3 viewDirection, vec2 coords);
 
+// fetch a point light from the light buffer
+PointLight getPointLight(int index);
+
+// find the cluster the fragment is in
+int getCluster();
+
 // calculate point lighting
 vec3 addPointLight(PointLight dirLight, vec3 normal, vec3 fragPosition, vec3 viewDirection, vec2 coords);
 
@@ -75,7 +121,7 @@ void main() {
     vec3 viewDirection = normalize(fs_in.tangentViewPosition - fs_in.tangentFragPosition);
     
     // if material height scale is defined, parallax map the tex coords for better three-dimensionality
-    vec2 parallaxTexCoords = mat.heightScale > 0 ? parallax(viewDirection) : fs_in.texCoords;
+    vec2 parallaxTexCoords = HEIGHT_SCALE > 0 ? parallax(viewDirection) : fs_in.texCoords;
     
     // get normal at tex coords on material normal map
     vec3 normal = texture(mat.normalMap, parallaxTexCoords).rgb;
@@ -85,9 +131,19 @@ void main() {
     
     // add together directional and sum of all point lights
     vec3 totalLighting = addDirectionalLight(normal, viewDirection, parallaxTexCoords);
-    for (int i = 0; i < NUM_LIGHT_POINTS;) {
-        totalLighting += addPointLight(pointLights[i], normal, fs_in.fragPosition, viewDirection, parallaxTexCoords);
-        ++i;
+    if (clusterGrid.w != 0) {
+        // sum only the lights in this fragment's cluster, in ascending order
+        // lights outside it contribute nothing, so the sum is the same
+        uvec2 cluster = texelFetch(clusterData, getCluster()).rg;
+        for (uint i = 0u; i < cluster.y; ++i) {
+            int index = int(texelFetch(clusterLightIndices, int(cluster.x + i)).r);
+            totalLighting += addPointLight(getPointLight(index), normal, fs_in.fragPosition, viewDirection, parallaxTexCoords);
+        }
+    } else {
+        // sum every light, to compare against
+        for (int i = 0; i < pointLightCount; ++i) {
+            totalLighting += addPointLight(getPointLight(i), normal, fs_in.fragPosition, viewDirection, parallaxTexCoords);
+        }
     }
     
     // set output to total lighting
@@ -98,27 +154,45 @@ float addDirectionalShadows() {
     // get light direction in world space 
     vec3 lightDirection = normalize(globalLight.position - fs_in.fragPosition);
     
-    // divide perspective
-    vec3 projCoords = fs_in.fragPosLightSpace.xyz / fs_in.fragPosLightSpace.w;
+    // select the first cascade reaching the fragment's depth
+    // fragments beyond the last cascade are unshadowed
+    float depth = -(view * vec4(fs_in.fragPosition, 1.0)).z;
+    int cascade = 0;
+    while (cascade < cascadeCount && depth > cascadeSplits[cascade]) {
+        ++cascade;
+    }
+    if (cascade == cascadeCount) {
+        return 0.0;
+    }
+    
+    // transform to the cascade's light space (orthographic, so no divide
+    // is needed)
+    vec3 projCoords = (lightSpaceMatrices[cascade] * vec4(fs_in.fragPosition, 1.0)).xyz;
     
     // normalise coords between 0 and 1
     projCoords = projCoords * 0.5 + 0.5;
     
     // get the closest depth from the shadow map
-    float closestDepth = texture(shadowMap, projCoords.xy).r;
+    float closestDepth = texture(shadowMap, vec3(projCoords.xy, cascade)).r;
     
     // get depth of coords
     float currentDepth = projCoords.z;
 
-    // calculate bias to offset shadow acne
-    float bias = max(0.05 * (1.0 - dot(normalize(fs_in.normal), lightDirection)), 0.005);
+    // calculate bias to offset shadow acne, larger where the surface faces
+    // away from the light. it is measured in the cascade's texels, which
+    // cover more of the world in further cascades, then converted to the
+    // cascade's depth range
+    vec2 texelSize = 1.0 / textureSize(shadowMap, 0).xy;
+    mat4 lightSpaceMatrix = lightSpaceMatrices[cascade];
+    float texelWorldSize = 2.0 * texelSize.x / abs(lightSpaceMatrix[0][0]);
+    float bias = max(4.0 * (1.0 - dot(normalize(fs_in.normal), lightDirection)), 1.0)
+               * texelWorldSize * 0.5 * abs(lightSpaceMatrix[2][2]);
     
     // percentage-closer filtering
     float shadow = 0.0;
-    vec2 texelSize = 1.0 / textureSize(shadowMap, 0);
     for (int x = -1; x <= 1; ++x) {
         for (int y = -1; y <= 1; ++y) {
-            float pcfDepth = texture(shadowMap, projCoords.xy + vec2(x, y) * texelSize).r; 
+            float pcfDepth = texture(shadowMap, vec3(projCoords.xy + vec2(x, y) * texelSize, cascade)).r; 
             shadow += currentDepth - bias > pcfDepth ? 1.0 : 0.0;        
         }    
     }
@@ -132,6 +206,32 @@ float addDirectionalShadows() {
     return shadow;
 }
 
+PointLight getPointLight(int index) {
+    // each light is four texels
+    vec4 positionConstant = texelFetch(pointLightData, index * 4);
+    vec4 ambientLinear = texelFetch(pointLightData, index * 4 + 1);
+    vec4 diffuseQuadratic = texelFetch(pointLightData, index * 4 + 2);
+    vec4 specularRadius = texelFetch(pointLightData, index * 4 + 3);
+    return PointLight(
+        positionConstant.xyz, positionConstant.w,
+        ambientLinear.xyz, ambientLinear.w,
+        diffuseQuadratic.xyz, diffuseQuadratic.w,
+        specularRadius.xyz, specularRadius.w
+    );
+}
+
+int getCluster() {
+    // tile from the fragment's position on screen
+    ivec2 tile = ivec2(gl_FragCoord.xy / clusterTileSize);
+    
+    // slice from the log of the fragment's distance in front of the camera
+    float depth = -(view * vec4(fs_in.fragPosition, 1.0)).z;
+    int slice = int(floor((log(depth) - clusterDepth.w) * clusterDepth.z));
+    
+    ivec3 cluster = clamp(ivec3(tile, slice), ivec3(0), clusterGrid.xyz - 1);
+    return (cluster.z * clusterGrid.y + cluster.y) * clusterGrid.x + cluster.x;
+}
+
 vec3 addDirectionalLight(vec3 norm, vec3 viewDirection, vec2 coords) {
     // get light direction in tangent space
     vec3 lightDirection = normalize(fs_in.tangentGlobalLightPosition - fs_in.tangentFragPosition);
@@ -144,7 +244,7 @@ vec3 addDirectionalLight(vec3 norm, vec3 viewDirection, vec2 coords) {
     // calculate Phong-Blinn specular lighting
     // uses material shininess as phong exponent, specular map, and light specular colour
     vec3 halfway = normalize(lightDirection + viewDirection);
-    vec3 specularLighting = pow(max(dot(viewDirection, halfway), 0.0), mat.shininess)
+    vec3 specularLighting = pow(max(dot(viewDirection, halfway), 0.0), SHININESS)
                         * vec3(texture(mat.specularMap, coords))
                         * globalLight.specular;
 
@@ -165,9 +265,17 @@ vec3 addPointLight(PointLight pointLight, vec3 norm, vec3 fragPosition, vec3 vie
     // calculate distance of point from light source
     float distance = length(pointLight.position - fragPosition);
     
-    // calculate attenuation from light falloff values
+    // lights have no effect beyond their radius
+    if (distance >= pointLight.radius) {
+        return vec3(0.0);
+    }
+    
+    // calculate attenuation from light falloff values, fading out smoothly
+    // to nothing at the radius
     float attenuation = 1.0 / (pointLight.constant + pointLight.linear * distance + 
   			     pointLight.quadratic * (distance * distance));    
+    float window = clamp(1.0 - pow(distance / pointLight.radius, 4.0), 0.0, 1.0);
+    attenuation *= window * window;
     
     // calculate diffuse lighting
     // uses normal, light direction, material's main texture, light colour, and attenuation
@@ -179,7 +287,7 @@ vec3 addPointLight(PointLight pointLight, vec3 norm, vec3 fragPosition, vec3 vie
     // calculate Phong-Blinn specular lighting
     // uses material shininess as phong exponent, specular map, light specular colour, and attenuation
     vec3 halfway = normalize(lightDirection + viewDirection);
-    vec3 specularLighting = pow(max(dot(viewDirection, halfway), 0.0), mat.shininess)
+    vec3 specularLighting = pow(max(dot(viewDirection, halfway), 0.0), SHININESS)
                             * vec3(texture(mat.specularMap, coords))
                             * pointLight.specular
                             * attenuation;
@@ -204,7 +312,7 @@ vec2 parallax(vec3 viewDirection) {
     // we find the coord shift based on vector P and the number of layers
     float layerDepth = 1 / numLayers;
     float currentDepth = 0;
-    vec2 p = viewDirection.xy * mat.heightScale; 
+    vec2 p = viewDirection.xy * HEIGHT_SCALE; 
     vec2 coordShift = p / numLayers;
     
     // set initial values of the map and tex coords
@@ -3,12 +3,34 @@ layout (location = 0) in vec3 aPos;
 
 out vec3 texCoords;
 
-uniform mat4 projection;
-uniform mat4 view;
+// Global light struct
+struct GlobalLight {
+    vec3 position;
+    vec3 ambient;
+    vec3 diffuse;
+    vec3 specular;
+};
+
+// per-frame data, shared by every program through one uniform buffer
+// (the layout must match FRAME_DATA_DTYPE in engine/core/uniformbuffer.py)
+#define MAX_SHADOW_CASCADES 4
+layout (std140) uniform FrameData {
+    mat4 viewProject; // View * Projection matrix
+    mat4 view; // View matrix
+    mat4 projection; // Projection matrix
+    mat4 lightSpaceMatrices[MAX_SHADOW_CASCADES]; // Light space matrix of each shadow cascade
+    vec4 cascadeSplits; // View depth at which each shadow cascade ends
+    vec3 viewPos; // Position vector of camera
+    int cascadeCount; // Number of shadow cascades
+    GlobalLight globalLight; // Global light information
+};
+
 uniform mat4 model;
 
 void main() {
     texCoords = -aPos;
-    gl_Position = projection * view * model * vec4(aPos, 1.0);
+    
+    // remove translation from the view matrix, so the skybox follows the camera
+    gl_Position = projection * mat4(mat3(view)) * model * vec4(aPos, 1.0);
     gl_Position.z = gl_Position.w*0.9999;
 }  
\ No newline at end of file
@@ -4,16 +4,19 @@
 layout (location = 0) in vec3 aPos;
 layout (location = 1) in vec3 aNormal;
 layout (location = 2) in vec2 aTexCoords;
-layout (location = 3) in vec3 aTangent;
+layout (location = 3) in vec4 aTangent; // w is bitangent handedness when packed
 layout (location = 4) in vec3 aBitangent;
 
+// per-instance model matrix, used instead of the model uniform when instanced
+// (a mat4 attribute takes locations 5 to 8)
+layout (location = 5) in mat4 aInstanceModel;
+
 // VS_OUT interface block
 out VS_OUT {
     vec3 fragPosition;
     vec2 texCoords;
     vec3 tangentViewPosition;
     vec3 tangentFragPosition;
-    vec4 fragPosLightSpace;
     vec3 normal;
     vec3 tangentGlobalLightPosition;
 } vs_out;
@@ -26,28 +29,46 @@ struct GlobalLight {
     vec3 specular;
 };
 
-uniform mat4 viewProject; // View * Projection matrix
+// per-frame data, shared by every program through one uniform buffer
+// (the layout must match FRAME_DATA_DTYPE in engine/core/uniformbuffer.py)
+#define MAX_SHADOW_CASCADES 4
+layout (std140) uniform FrameData {
+    mat4 viewProject; // View * Projection matrix
+    mat4 view; // View matrix
+    mat4 projection; // Projection matrix
+    mat4 lightSpaceMatrices[MAX_SHADOW_CASCADES]; // Light space matrix of each shadow cascade
+    vec4 cascadeSplits; // View depth at which each shadow cascade ends
+    vec3 viewPos; // Position vector of camera
+    int cascadeCount; // Number of shadow cascades
+    GlobalLight globalLight; // Global light information
+};
+
 uniform mat4 model; // Transformation matrix for the current object
-uniform vec3 viewPos; // Position vector of camera
-uniform mat4 lightSpaceMatrix; // Light space matrix from global light
-uniform GlobalLight globalLight; // Global light information
+uniform bool instanced; // Whether to read the model matrix per instance
+uniform bool packedVertices; // Whether bitangents must be rebuilt from the tangent
 
 void main() {
     
+    // Select the model matrix for this instance
+    mat4 modelMatrix = instanced ? aInstanceModel : model;
+    
     // Pass simple outs
     // pass current tex coords
     vs_out.texCoords = aTexCoords;
     
     // pass frag position as model matrix * vertex position
-    vs_out.fragPosition = vec3(model * vec4(aPos, 1.0));
+    vs_out.fragPosition = vec3(modelMatrix * vec4(aPos, 1.0));
     
     // pass normal as model (cast down, inverted, and transposed) * normal
-    vs_out.normal = transpose(inverse(mat3(model))) * aNormal;
+    vs_out.normal = transpose(inverse(mat3(modelMatrix))) * aNormal;
     
     // build tangent-bitangent-normal matrix for converting vectors to tangent space
-    vec3 T = normalize(vec3(model * vec4(aTangent, 0.0)));
-    vec3 B = normalize(vec3(model * vec4(aBitangent, 0.0)));
-    vec3 N = normalize(vec3(model * vec4(aNormal, 0.0)));
+    // packed vertices store no bitangent, so rebuild it from the normal,
+    // tangent, and handedness
+    vec3 bitangent = packedVertices ? cross(aNormal, aTangent.xyz) * aTangent.w : aBitangent;
+    vec3 T = normalize(vec3(modelMatrix * vec4(aTangent.xyz, 0.0)));
+    vec3 B = normalize(vec3(modelMatrix * vec4(bitangent, 0.0)));
+    vec3 N = normalize(vec3(modelMatrix * vec4(aNormal, 0.0)));
     mat3 TBN = transpose(mat3(T, B, N));
     
     // pass tangent frag, view, and global light positions for normal mapping
@@ -55,9 +76,6 @@ void main() {
     vs_out.tangentFragPosition = TBN * vs_out.fragPosition;
     vs_out.tangentGlobalLightPosition = TBN * globalLight.position;
     
-    // pass frag position * light space matrix for shadow calculation
-    vs_out.fragPosLightSpace = lightSpaceMatrix * vec4(vs_out.fragPosition, 1.0);
-    
     // set overall vertex position as view * projection * model
     gl_Position = viewProject * vec4(vs_out.fragPosition, 1.0);
 }
\ No newline at end of file
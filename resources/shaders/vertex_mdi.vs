@@ -0,0 +1,95 @@
+#version 460 core
+
+// vertices from the geometry arena, always packed
+layout (location = 0) in vec3 aPos;
+layout (location = 1) in vec3 aNormal;
+layout (location = 2) in vec2 aTexCoords;
+layout (location = 3) in vec4 aTangent; // w is bitangent handedness
+
+// VS_OUT interface block
+out VS_OUT {
+    vec3 fragPosition;
+    vec2 texCoords;
+    vec3 tangentViewPosition;
+    vec3 tangentFragPosition;
+    vec3 normal;
+    vec3 tangentGlobalLightPosition;
+} vs_out;
+
+// material values of the draw, for the fragment shader
+flat out float materialShininess;
+flat out float materialHeightScale;
+
+// Global light struct
+struct GlobalLight {
+    vec3 position;
+    vec3 ambient;
+    vec3 diffuse;
+    vec3 specular;
+};
+
+// per-frame data, shared by every program through one uniform buffer
+// (the layout must match FRAME_DATA_DTYPE in engine/core/uniformbuffer.py)
+#define MAX_SHADOW_CASCADES 4
+layout (std140) uniform FrameData {
+    mat4 viewProject; // View * Projection matrix
+    mat4 view; // View matrix
+    mat4 projection; // Projection matrix
+    mat4 lightSpaceMatrices[MAX_SHADOW_CASCADES]; // Light space matrix of each shadow cascade
+    vec4 cascadeSplits; // View depth at which each shadow cascade ends
+    vec3 viewPos; // Position vector of camera
+    int cascadeCount; // Number of shadow cascades
+    GlobalLight globalLight; // Global light information
+};
+
+// material values, as MATERIAL_DTYPE in engine/core/multidraw.py
+struct MaterialData {
+    float shininess;
+    float heightScale;
+};
+
+// storage buffers written by MultiDrawRenderer (bindings must match those in
+// engine/core/multidraw.py): the model matrix of every instance, the
+// instance drawn by each instance of each draw, and each draw's material
+layout (std430, binding = 0) readonly buffer InstanceTransforms {
+    mat4 instanceModels[];
+};
+layout (std430, binding = 1) readonly buffer DrawInstances {
+    uint drawInstances[];
+};
+layout (std430, binding = 2) readonly buffer DrawMaterials {
+    uint drawMaterials[];
+};
+layout (std430, binding = 3) readonly buffer Materials {
+    MaterialData materials[];
+};
+
+uniform int drawOffset; // Index of the first draw of the current call
+
+void main() {
+    
+    // Each draw's instances start at its base instance
+    mat4 modelMatrix = instanceModels[drawInstances[gl_BaseInstance + gl_InstanceID]];
+    
+    MaterialData material = materials[drawMaterials[drawOffset + gl_DrawID]];
+    materialShininess = material.shininess;
+    materialHeightScale = material.heightScale;
+    
+    vs_out.texCoords = aTexCoords;
+    vs_out.fragPosition = vec3(modelMatrix * vec4(aPos, 1.0));
+    vs_out.normal = transpose(inverse(mat3(modelMatrix))) * aNormal;
+    
+    // build tangent-bitangent-normal matrix for converting vectors to tangent
+    // space, rebuilding the bitangent from the normal, tangent, and handedness
+    vec3 bitangent = cross(aNormal, aTangent.xyz) * aTangent.w;
+    vec3 T = normalize(vec3(modelMatrix * vec4(aTangent.xyz, 0.0)));
+    vec3 B = normalize(vec3(modelMatrix * vec4(bitangent, 0.0)));
+    vec3 N = normalize(vec3(modelMatrix * vec4(aNormal, 0.0)));
+    mat3 TBN = transpose(mat3(T, B, N));
+    
+    vs_out.tangentViewPosition = TBN * viewPos;
+    vs_out.tangentFragPosition = TBN * vs_out.fragPosition;
+    vs_out.tangentGlobalLightPosition = TBN * globalLight.position;
+    
+    gl_Position = viewProject * vec4(vs_out.fragPosition, 1.0);
+}
@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+from engine.core.bvh import BVH
+from engine.core.culling import cull_aabbs
+from engine.tools.bvh_benchmark import generate_frustums, generate_instances
+
+def ray_distances(origin: np.ndarray, direction: np.ndarray, mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+    """
+    Finds where a ray enters each box by the slab method, one box at a time.
+
+    Parameters
+    ----------
+    origin : np.ndarray
+        The ray's origin, of shape (3,).
+    direction : np.ndarray
+        The ray's direction, of shape (3,).
+    mins : np.ndarray
+        Box minimum corners, of shape (N, 3).
+    maxs : np.ndarray
+        Box maximum corners, of shape (N, 3).
+
+    Returns
+    -------
+    np.ndarray
+        The distance to each box, in multiples of the direction's length, 0
+        inside it, or infinity if missed.
+
+    """
+
+    distances = np.full(len(mins), np.inf)
+    for box, (low, high) in enumerate(zip(mins, maxs)):
+        enter, leave = 0.0, np.inf
+        for axis in range(3):
+            if direction[axis] == 0:
+                if not low[axis] <= origin[axis] <= high[axis]:
+                    break
+                continue
+            near, far = sorted(((low[axis] - origin[axis]) / direction[axis], (high[axis] - origin[axis]) / direction[axis]))
+            enter, leave = max(enter, near), min(leave, far)
+        else:
+            if enter <= leave:
+                distances[box] = enter
+    return distances
+
+def sphere_items(center: np.ndarray, radius: float, mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+    """
+    Finds the boxes a sphere touches, by testing every one.
+
+    Parameters
+    ----------
+    center : np.ndarray
+        The sphere's centre, of shape (3,).
+    radius : float
+        The sphere's radius.
+    mins : np.ndarray
+        Box minimum corners, of shape (N, 3).
+    maxs : np.ndarray
+        Box maximum corners, of shape (N, 3).
+
+    Returns
+    -------
+    np.ndarray
+        The indices of the boxes, ascending.
+
+    """
+
+    closest = np.minimum(np.maximum(center, mins), maxs)
+    return np.flatnonzero(np.linalg.norm(closest - center, axis=1) <= radius)
+
+@pytest.fixture(params=[1, 10, 1000])
+def scene(request):
+    rng = np.random.default_rng(request.param)
+    centers, extents = generate_instances(request.param, rng)
+    bvh = BVH(leaf_size=4, bins=8)
+    bvh.build(centers, extents)
+    return bvh, centers, extents, rng
+
+def test_tree_holds_every_item(scene):
+    bvh, centers, extents, _ = scene
+    np.testing.assert_array_equal(np.sort(bvh.order), np.arange(len(centers)))
+
+    # Every node's bounds enclose its items, and leaves are small enough
+    for node in range(len(bvh.node_child)):
+        items = bvh.leaf_items(np.array([node]))
+        assert np.all(bvh.node_min[node] <= centers[items] - extents[items])
+        assert np.all(bvh.node_max[node] >= centers[items] + extents[items])
+        if bvh.node_child[node] < 0:
+            assert bvh.node_count[node] <= bvh.leaf_size
+
+def check_queries(bvh: BVH, centers: np.ndarray, extents: np.ndarray, rng: np.random.Generator):
+    """
+    Checks frustum, sphere and ray queries of a tree against testing every
+    item.
+
+    Parameters
+    ----------
+    bvh : BVH
+        The tree.
+    centers : np.ndarray
+        Item box centres, of shape (N, 3).
+    extents : np.ndarray
+        Item box half extents, of shape (N, 3).
+    rng : np.random.Generator
+        The random number generator.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    mins, maxs = centers - extents, centers + extents
+    size = 10 * np.sqrt(len(centers))
+    for planes in generate_frustums(10, rng, size):
+        np.testing.assert_array_equal(bvh.query_frustum(planes), cull_aabbs(planes, centers, extents))
+
+    for _ in range(10):
+        origin = np.array([rng.uniform(-size / 2, size / 2), 2, rng.uniform(-size / 2, size / 2)])
+        radius = rng.uniform(0.5, 10)
+        np.testing.assert_array_equal(bvh.query_sphere(origin, radius), sphere_items(origin, radius, mins, maxs))
+
+        direction = np.array([rng.uniform(-size / 2, size / 2), 0, rng.uniform(-size / 2, size / 2)]) - origin
+        item, distance = bvh.raycast(origin, direction)
+        expected = ray_distances(origin, direction, mins, maxs)
+        np.testing.assert_allclose(distance, expected.min(initial=np.inf))
+        if item >= 0:
+            np.testing.assert_allclose(expected[item], expected.min(initial=np.inf))
+
+def test_queries_match_brute_force(scene):
+    check_queries(*scene)
+
+def test_queries_match_after_refit(scene):
+    bvh, centers, extents, rng = scene
+    moved = centers + rng.normal(0, 2, centers.shape)
+    bvh.refit(moved, extents)
+    check_queries(bvh, moved, extents, rng)
+
+def test_update_rebuilds_when_items_change(scene):
+    bvh, centers, extents, rng = scene
+    assert bvh.update(centers[:-1], extents[:-1])
+    check_queries(bvh, centers[:-1], extents[:-1], rng)
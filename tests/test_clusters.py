@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from engine.core.clusters import RADIUS_MARGIN, assign_lights, assign_lights_reference, cluster_bounds
+
+GRID = (8, 6, 12)
+NEAR = 0.1
+FAR = 100.0
+
+# A 90 degree vertical field of view at 16:9
+SCALE = (9 / 16, 1.0)
+
+def random_lights(count: int, seed: int) -> (np.ndarray, np.ndarray):
+    """
+    Makes random lights in cluster space, some behind the camera, beyond the
+    far plane, or outside the frustum to the sides.
+
+    Parameters
+    ----------
+    count : int
+        The number of lights.
+    seed : int
+        The random seed.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        Light positions, of shape (count, 3), and radii, of shape (count,).
+
+    """
+
+    rng = np.random.default_rng(seed)
+    depths = rng.uniform(-10, FAR + 10, count)
+    sides = rng.uniform(-1.5, 1.5, (count, 2)) * np.abs(depths)[:, None] / SCALE
+    radii = np.where(rng.uniform(size=count) < 0.5, rng.uniform(0.05, 1, count), rng.uniform(1, 20, count))
+    return np.column_stack([sides, depths]), radii
+
+def brute_force(centers: np.ndarray, radii: np.ndarray, bounds: np.ndarray) -> list[set]:
+    """
+    Tests every light against every cluster's box, exactly.
+
+    Parameters
+    ----------
+    centers : np.ndarray
+        Light positions, of shape (N, 3).
+    radii : np.ndarray
+        Light radii, of shape (N,).
+    bounds : np.ndarray
+        Cluster bounds, as from cluster_bounds().
+
+    Returns
+    -------
+    list[set]
+        The lights touching each cluster.
+
+    """
+
+    touching = []
+    for low, high in bounds:
+        closest = np.minimum(np.maximum(centers, low), high)
+        distances = np.sqrt(np.sum((closest - centers) ** 2, axis=1))
+        touching.append(set(np.flatnonzero(distances <= radii).tolist()))
+    return touching
+
+def cluster_lists(clusters: np.ndarray, indices: np.ndarray) -> list[np.ndarray]:
+    """
+    Splits the index list into each cluster's lights.
+
+    Parameters
+    ----------
+    clusters : np.ndarray
+        The offset and count of each cluster's lights, as from assign_lights().
+    indices : np.ndarray
+        The index list, as from assign_lights().
+
+    Returns
+    -------
+    list[np.ndarray]
+        The lights of each cluster.
+
+    """
+
+    return [indices[offset:offset + count] for offset, count in clusters]
+
+@pytest.mark.parametrize("seed", range(4))
+def test_assignment_matches_brute_force(seed):
+    centers, radii = random_lights(200, seed)
+    bounds = cluster_bounds(GRID, NEAR, FAR, SCALE)
+    clusters, indices = assign_lights(centers, radii, GRID, NEAR, FAR, SCALE)
+
+    assert len(clusters) == np.prod(GRID)
+    assert clusters[:, 1].sum() == len(indices)
+
+    expected = brute_force(centers, radii, bounds)
+    for cluster, (lights, touching) in enumerate(zip(cluster_lists(clusters, indices), expected)):
+        assert np.all(np.diff(lights.astype(np.int64)) > 0), f"cluster {cluster} lights out of order"
+
+        # Every light touching the cluster is listed, and any other listed
+        # light is within the margin of touching it
+        assert touching <= set(lights.tolist()), f"cluster {cluster} misses lights"
+        low, high = bounds[cluster]
+        for light in set(lights.tolist()) - touching:
+            distance = np.linalg.norm(np.clip(centers[light], low, high) - centers[light])
+            assert distance <= radii[light] * (1 + RADIUS_MARGIN) + RADIUS_MARGIN
+
+@pytest.mark.parametrize("seed", range(2))
+def test_assignment_matches_reference(seed):
+    centers, radii = random_lights(100, seed)
+    clusters, indices = assign_lights(centers, radii, GRID, NEAR, FAR, SCALE)
+    reference_clusters, reference_indices = assign_lights_reference(centers, radii, GRID, NEAR, FAR, SCALE)
+    np.testing.assert_array_equal(clusters, reference_clusters)
+    np.testing.assert_array_equal(indices, reference_indices)
+
+def test_fragments_see_every_light_reaching_them():
+    # Shading a fragment with its cluster's lights must give the same result
+    # as looping over every light, so every light reaching a fragment must be
+    # in the cluster fragment.fs picks for it
+    centers, radii = random_lights(200, 7)
+    clusters, indices = assign_lights(centers, radii, GRID, NEAR, FAR, SCALE)
+    lists = cluster_lists(clusters, indices)
+
+    rng = np.random.default_rng(8)
+    depths = NEAR * (FAR / NEAR) ** rng.uniform(0, 1, 5000)
+    ndc = rng.uniform(-1, 1, (5000, 2))
+    fragments = np.column_stack([ndc * depths[:, None] / SCALE, depths])
+
+    # As getCluster() in fragment.fs: tile from the screen position, and
+    # slice from the log of the depth
+    size_x, size_y, size_z = GRID
+    tiles = np.floor((ndc + 1) / 2 * (size_x, size_y)).astype(int)
+    slices = np.floor((np.log(depths) - np.log(NEAR)) * size_z / np.log(FAR / NEAR)).astype(int)
+    cells = np.clip(np.column_stack([tiles, slices]), 0, np.array(GRID) - 1)
+    owners = (cells[:, 2] * size_y + cells[:, 1]) * size_x + cells[:, 0]
+
+    for fragment, cluster in zip(fragments, owners):
+        reaching = np.flatnonzero(np.linalg.norm(centers - fragment, axis=1) <= radii)
+        assert np.isin(reaching, lists[cluster]).all()
@@ -0,0 +1,104 @@
+import numpy as np
+from engine.core.lod import screen_sizes, select_lods
+from engine.core.simplify import generate_lods, simplify
+
+def grid(size: int, height=None) -> (np.ndarray, np.ndarray):
+    """
+    Makes a square grid of triangles on the ground, facing up.
+
+    Parameters
+    ----------
+    size : int
+        Vertices along each side.
+    height : callable, optional
+        Height of the grid at (x, z). The default is None (flat).
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        Positions, of shape (size * size, 3), and triangle indices, of shape
+        (triangles, 3).
+
+    """
+
+    x, z = np.meshgrid(np.linspace(0, 1, size), np.linspace(0, 1, size), indexing="ij")
+    y = height(x, z) if height else np.zeros_like(x)
+    positions = np.column_stack([x.ravel(), y.ravel(), z.ravel()])
+    corners = (np.arange(size - 1)[:, None] * size + np.arange(size - 1)).ravel()
+    triangles = np.concatenate([
+        np.column_stack([corners, corners + 1, corners + size]),
+        np.column_stack([corners + 1, corners + size + 1, corners + size])
+    ])
+    return positions, triangles
+
+def triangle_normals(positions: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Computes the area weighted normal of every triangle.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Vertex positions, of shape (N, 3).
+    indices : np.ndarray
+        Triangle indices, of any shape.
+
+    Returns
+    -------
+    np.ndarray
+        Normals twice the triangle areas long, of shape (triangles, 3).
+
+    """
+
+    a, b, c = positions[np.asarray(indices).reshape(-1, 3)].transpose(1, 0, 2)
+    return np.cross(b - a, c - a)
+
+def test_flat_grid_keeps_its_shape():
+    positions, triangles = grid(17)
+    full = triangle_normals(positions, triangles)
+
+    lod = simplify(positions, triangles, len(triangles) // 4)
+    assert len(lod) % 3 == 0 and len(lod) // 3 <= len(triangles) // 2
+    assert lod.min() >= 0 and lod.max() < len(positions)
+
+    # Collapses must neither flip nor fold triangles, nor shrink the outline,
+    # so the grid stays facing one way with the same area
+    normals = triangle_normals(positions, lod)
+    assert np.all(normals[:, 1] * full[0, 1] > 0)
+    np.testing.assert_allclose(np.abs(normals[:, 1]).sum(), np.abs(full[:, 1]).sum())
+
+def test_lod_chain_reduces_triangles():
+    positions, triangles = grid(33, lambda x, z: 0.05 * np.sin(6 * x) * np.cos(4 * z))
+    ratios = [0.5, 0.25, 0.1]
+    lods = generate_lods(positions, triangles, ratios)
+
+    assert len(lods) == len(ratios)
+    counts = [len(triangles)] + [len(lod) // 3 for lod in lods]
+    assert counts == sorted(counts, reverse=True)
+    for lod, ratio in zip(lods, ratios):
+        assert len(lod) // 3 <= len(triangles) * ratio * 1.1
+        assert lod.min() >= 0 and lod.max() < len(positions)
+
+        # No degenerate triangles
+        faces = lod.reshape(-1, 3)
+        assert np.all((faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2]))
+
+def test_small_meshes_get_no_lods():
+    positions, triangles = grid(5)
+    assert generate_lods(positions, triangles, [0.5], min_triangles=len(triangles) + 1) == []
+
+def test_screen_sizes():
+    centers = np.array([[0, 0, -10], [0, 0, -20], [0, 0, 0.5]])
+    sizes = screen_sizes(centers, np.ones(3), np.zeros(3), 2.0)
+    np.testing.assert_allclose(sizes[:2], [0.2, 0.1])
+
+    # The camera is inside the last sphere
+    assert sizes[2] == np.inf
+
+def test_select_lods_hysteresis():
+    thresholds = [0.25, 0.12, 0.05]
+    sizes = np.array([1.0, 0.26, 0.24, 0.2, 0.1, 0.01])
+    np.testing.assert_array_equal(select_lods(sizes, None, thresholds, 0.1), [0, 0, 1, 1, 2, 3])
+
+    # Near a threshold, instances keep the level they had
+    current = np.array([0, 1, 0, 0, 3, 0])
+    np.testing.assert_array_equal(select_lods(sizes, current, thresholds, 0.1), [0, 1, 0, 1, 2, 3])
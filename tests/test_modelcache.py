@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from engine.config import CONFIG
+from engine.core.modelcache import is_prepared, prepare_model
+
+def model() -> dict:
+    """
+    Makes a model of one square grid mesh, large enough to get levels of
+    detail.
+
+    Returns
+    -------
+    dict
+        The model dictionary.
+
+    """
+
+    size = 20
+    x, z = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    corners = (np.arange(size - 1)[:, None] * size + np.arange(size - 1)).ravel()
+    faces = np.concatenate([
+        np.column_stack([corners, corners + 1, corners + size]),
+        np.column_stack([corners + 1, corners + size + 1, corners + size])
+    ])
+    vertices = np.column_stack([x.ravel(), np.zeros(size * size), z.ravel()]).astype(np.float32)
+    return {"meshes": [{"vertices": vertices.ravel(), "faces": faces}]}
+
+@pytest.mark.parametrize("key, value", [
+    ("vertex_cache_size", 32),
+    ("optimize_overdraw", False),
+    ("optimize_meshes", False),
+    ("lod_ratios", [0.5]),
+    ("lod_min_triangles", 10)
+])
+def test_changed_settings_make_models_stale(monkeypatch, key, value):
+    data = model()
+    prepare_model(data)
+    assert is_prepared(data)
+
+    monkeypatch.setitem(CONFIG, key, value)
+    assert not is_prepared(data)
+
+    data = model()
+    prepare_model(data)
+    assert is_prepared(data)
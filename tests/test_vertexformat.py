@@ -0,0 +1,87 @@
+import numpy as np
+from engine.core.vertexformat import (
+    PACKED_VERTEX_DTYPE, pack_snorm_2_10_10_10, unpack_snorm_2_10_10_10, pack_vertices, unpack_vertices
+)
+
+# Largest error of a snorm 10 bit component, half a step of 1 / 511
+SNORM_TOLERANCE = 0.5 / 511 + 1e-6
+
+def random_frames(count: int, seed: int = 0) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Makes random orthonormal tangent frames, half of them mirrored.
+
+    Parameters
+    ----------
+    count : int
+        The number of frames.
+    seed : int, optional
+        The random seed. The default is 0.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray, np.ndarray)
+        Normals, tangents, and bitangents, each of shape (count, 3).
+
+    """
+
+    rng = np.random.default_rng(seed)
+    normals = rng.normal(size=(count, 3))
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    tangents = np.cross(normals, rng.normal(size=(count, 3)))
+    tangents /= np.linalg.norm(tangents, axis=1, keepdims=True)
+    handedness = np.where(np.arange(count) % 2, -1.0, 1.0)
+    bitangents = np.cross(normals, tangents) * handedness[:, None]
+    return normals, tangents, bitangents
+
+def test_packed_vertex_size():
+    assert PACKED_VERTEX_DTYPE.itemsize == 24
+
+def test_snorm_round_trip():
+    values = np.random.default_rng(1).uniform(-1, 1, size=(1000, 3))
+    w = np.where(np.arange(1000) % 2, -1, 1)
+    xyz, unpacked_w = unpack_snorm_2_10_10_10(pack_snorm_2_10_10_10(values, w))
+    np.testing.assert_allclose(xyz, values, atol=SNORM_TOLERANCE)
+    np.testing.assert_array_equal(unpacked_w, w)
+
+def test_snorm_extremes():
+    values = np.array([[-1, 0, 1], [1, -1, 0]], dtype=np.float32)
+    xyz, _ = unpack_snorm_2_10_10_10(pack_snorm_2_10_10_10(values))
+    np.testing.assert_array_equal(xyz, values)
+
+def test_vertex_round_trip():
+    count = 500
+    rng = np.random.default_rng(2)
+    positions = rng.uniform(-100, 100, size=(count, 3)).astype(np.float32)
+    uvs = rng.uniform(-4, 4, size=(count, 2)).astype(np.float32)
+    normals, tangents, bitangents = random_frames(count)
+
+    unpacked = unpack_vertices(pack_vertices(positions, normals, uvs, tangents, bitangents))
+
+    # Positions are stored as they are, and texture coordinates as float16
+    np.testing.assert_array_equal(unpacked["vertices"], positions)
+    np.testing.assert_allclose(unpacked["texCoords"], uvs, rtol=2 ** -11, atol=2 ** -14)
+
+    np.testing.assert_allclose(unpacked["normals"], normals, atol=SNORM_TOLERANCE)
+    np.testing.assert_allclose(unpacked["tangents"], tangents, atol=SNORM_TOLERANCE)
+
+    # Rebuilt bitangents keep the handedness of mirrored frames, within the
+    # error of the normal and tangent they are made from
+    np.testing.assert_allclose(unpacked["bitangents"], bitangents, atol=4 * SNORM_TOLERANCE)
+
+def test_flat_attributes_with_extra_uv_channels():
+    count = 4
+    positions = np.arange(count * 3, dtype=np.float32)
+    normals, tangents, bitangents = random_frames(count)
+
+    # Further texture coordinate channels follow the first, and are dropped
+    uvs = np.concatenate([np.full(count * 2, 0.25), np.full(count * 2, 0.75)])
+
+    unpacked = unpack_vertices(pack_vertices(positions, normals.reshape(-1), uvs, tangents.reshape(-1), bitangents.reshape(-1)))
+    np.testing.assert_array_equal(unpacked["vertices"], positions.reshape(-1, 3))
+    np.testing.assert_array_equal(unpacked["texCoords"], np.full((count, 2), 0.25))
+
+def test_missing_attributes_are_zero():
+    packed = pack_vertices(np.zeros((3, 3)), np.zeros((3, 3)))
+    unpacked = unpack_vertices(packed)
+    for name in ("normals", "texCoords", "tangents", "bitangents"):
+        np.testing.assert_array_equal(unpacked[name], 0)